@@ -4,28 +4,56 @@
 
 from flask import Flask
 from flask_login import LoginManager, current_user
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import make_transient_to_detached
 import os
 
+from MusicList import database, passwords
+from MusicList.cache import LRUCache
+
 """创建 Flask 实例"""
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev"
 
-"""初始化数据库(数据库保存在本地)"""
+"""初始化数据库(数据库默认保存在本地，引擎配置见 `MusicList.database`)"""
 database_path = os.path.join(app.root_path, "data.db")
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + database_path
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URL", "sqlite:///" + database_path
+)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
+app.config["DATABASE_PROFILE"] = os.environ.get("DATABASE_PROFILE", "default")
+database.configure(app)
+db = database.Database(app)
+
+"""密码哈希的参数和线程池大小，见 `MusicList.passwords`"""
+passwords.configure(app)
 
 """用户登录"""
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
+"""已登录用户的缓存，修改用户信息后需要调用 `user_cache.invalidate(index)`"""
+app.config.setdefault("USER_CACHE_SIZE", 1024)
+app.config.setdefault("USER_CACHE_TTL", 300)
+user_cache = LRUCache(app.config["USER_CACHE_SIZE"], app.config["USER_CACHE_TTL"])
+
 @login_manager.user_loader
 def load_user(index):
-    """加载用户"""
+    """
+    加载用户。\n
+    缓存中只保存用户各列的值，命中时重新构造对象并关联到当前会话，不需要查询数据库。
+    """
     from MusicList.model import User
-    return User.query.get(int(index))
+    index = int(index)
+    values = user_cache.get(index)
+    if values is None:
+        user = User.query.get(index)
+        if user is not None:
+            columns = User.__table__.columns.keys()
+            user_cache.set(index, {key: getattr(user, key) for key in columns})
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 @app.context_processor
 def inject_user():
@@ -34,4 +62,14 @@ def inject_user():
 
 
 # 导入其他模块
-from MusicList import model, commands, api
+from MusicList import (
+    model,
+    search,
+    recommend,
+    counters,
+    playlists,
+    artists,
+    slowlog,
+    commands,
+    api,
+)
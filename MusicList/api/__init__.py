@@ -19,4 +19,6 @@ from MusicList.api import (
     message,
     music_list_current_user,
     music_list_other_user,
+    export,
+    metrics,
 )
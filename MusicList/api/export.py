@@ -0,0 +1,41 @@
+"""
+数据导出。\n
+以 CSV 或 JSONL 格式流式下载当前用户的歌单、消息和评论；管理员可以导出其他用户或全部数据。
+"""
+
+from flask import Response, abort, request, stream_with_context
+from flask_login import current_user, login_required
+
+from MusicList import app, exporter
+from MusicList.model import User
+
+
+@app.route("/export/<string:kind>.<string:file_format>", methods=["GET"])
+@login_required
+def export(kind, file_format):
+    """
+    GET: 导出数据 \n
+    `kind`: `lists`、`messages` 或 `comments` \n
+    `file_format`: `csv` 或 `jsonl` \n
+    管理员可以通过参数 `user` 指定用户的 `index`，`user=all` 表示全部用户。
+    """
+    if kind not in exporter.KINDS or file_format not in exporter.FORMATS:
+        abort(404)
+    user_index = current_user.index
+    target = request.args.get("user")
+    if target is not None and current_user.level != 1:
+        abort(404)
+    if target == "all":
+        user_index = None
+    elif target is not None:
+        # 只有 `user=all` 表示全部用户，其他无法解析的值不能退化为导出全部数据
+        user_index = request.args.get("user", type=int)
+        if user_index is None:
+            abort(400)
+        if User.query.filter(User.index == user_index).first() is None:
+            abort(404)
+    rows = exporter.iter_export(kind, file_format, user_index)
+    filename = f"{kind}-{user_index if user_index is not None else 'all'}.{file_format}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    mimetype = exporter.FORMATS[file_format]
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
@@ -1,7 +1,8 @@
 """
 与消息有关的页面。\n
-包括：查看消息列表和消息详情；添加和删除帖子和评论；查看一个用户的帖子和评论；
-点赞和取消点赞帖子；查看已点赞的帖子。
+包括：查看最新和热门消息列表以及消息详情；添加和删除帖子和评论；查看一个用户的帖子和评论；
+点赞和取消点赞帖子；查看已点赞的帖子。\n
+消息详情和用户的消息也会读取已归档的消息（见 `MusicList.archive`）。
 """
 
 
@@ -9,8 +10,29 @@ from datetime import datetime
 from flask import request, flash, redirect, url_for, render_template
 from flask_login import current_user, login_required
 
-from MusicList import app, db
-from MusicList.model import User, List, Message, Comment, FavoriteMessage
+from MusicList import app, archive, db, fragments, trending
+from MusicList.database import retry_on_locked
+from MusicList.favorites import favorite_buffer
+from MusicList.model import (
+    User,
+    List,
+    Message,
+    MessageScore,
+    Comment,
+    CommentArchive,
+    FavoriteMessage,
+)
+from MusicList.pagination import paginate
+
+# 消息列表中显示的列（点赞数和评论数为冗余计数，不需要额外的查询）
+FEED_COLUMNS = [
+    Message.index,
+    Message.time,
+    Message.title,
+    Message.owner,
+    Message.like_count,
+    Message.comment_count,
+]
 
 
 @app.route("/message_list", methods=["GET"])
@@ -20,20 +42,40 @@ def message_list():
     GET: 最新帖子页面 \n
     """
     per_page = 30
-    page = request.args.get("page", 1, type=int)
-    columns = [Message.index, Message.time, Message.title, Message.owner, User.username]
-    messages = (
+    columns = [*FEED_COLUMNS, User.username]
+    query = (
         Message.query.join(User, Message.owner == User.index)  # 合并两个数据表
         .with_entities(*columns)  # 选择所需要的列
-        .order_by(Message.time.desc())  # 按照时间排序
-        .paginate(page, per_page, error_out=False)  # 进行分页
     )
-    data = dict(messages=messages, info="最新消息", is_current_user=True)
+    # 按照时间排序并分页，渲染结果会被缓存
+    items = fragments.render_feed("all", query, [Message.time, Message.index], per_page)
+    data = dict(items=items, info="最新消息", is_current_user=True, feeds=True)
+    return render_template("message/message_list.html", **data)
+
+
+@app.route("/hot_message_list", methods=["GET"])
+@login_required
+def hot_message_list():
+    """
+    GET: 热门帖子页面，按照随时间衰减的点赞和评论热度排序 \n
+    """
+    per_page = 30
+    columns = [*FEED_COLUMNS, User.username, MessageScore.score, MessageScore.message_id]
+    query = (
+        MessageScore.query.join(Message, Message.index == MessageScore.message_id)
+        .join(User, Message.owner == User.index)
+        .with_entities(*columns)
+    )
+    # 按照热度排序并分页，渲染结果会被缓存
+    key = [MessageScore.score, MessageScore.message_id]
+    items = fragments.render_feed("hot", query, key, per_page)
+    data = dict(items=items, info="热门消息", is_current_user=True, feeds=True)
     return render_template("message/message_list.html", **data)
 
 
 @app.route("/new_message", methods=["GET", "POST"])
 @login_required
+@retry_on_locked
 def new_message():
     """
     GET: 发送消息页面 \n
@@ -70,12 +112,14 @@ def new_message():
         }
         db.session.add(Message(**data))
         db.session.commit()
+        fragments.message_created(current_user.index)
         flash("发送成功")
         return redirect(url_for("message_list"))
 
 
 @app.route("/message_detail/<int:message_index>", methods=["GET", "POST"])
 @login_required
+@retry_on_locked
 def message_detail(message_index):
     """
     GET: 消息详情页面，包含消息，时间，发送者，关联的歌单，评论 \n
@@ -85,8 +129,11 @@ def message_detail(message_index):
         # 获取页码
         per_page = 30
         page = request.args.get("page", 1, type=int)
-        # 从数据库中获取消息并检查
+        # 从数据库中获取消息并检查，不存在时查找已归档的消息
         message = Message.query.filter(Message.index == message_index).first()
+        archived = message is None
+        if archived:
+            message = archive.find_message(message_index)
         if message == None:
             flash("发生错误，请重试")
             return redirect(url_for("message_list"))
@@ -101,23 +148,24 @@ def message_detail(message_index):
             flash("发生错误，请重试")
             return redirect(url_for("message_list"))
         # 获取评论
-        cols = [Comment.index, Comment.text, Comment.time, Comment.owner, User.username]
-        comments = (
-            Comment.query.join(User, User.index == Comment.owner)
-            .filter(Comment.parent_massage == message_index)
-            .with_entities(*cols)
-            .order_by(Comment.time.desc())
-            .paginate(page, per_page, error_out=False)
-        )
-        # 检查用户是否为消息点赞
-        favorite_message = (
-            FavoriteMessage.query.filter(FavoriteMessage.message_id == message_index)
-            .filter(FavoriteMessage.user_id == current_user.index)
-            .first()
-        )
-        favorite = False
-        if favorite_message:
-            favorite = True
+        if archived:
+            columns = ["index", "text", "time", "owner"]
+            query = archive.comments(message_index, columns)
+            order = CommentArchive.time.desc()
+        else:
+            cols = [Comment.index, Comment.text, Comment.time, Comment.owner, User.username]
+            query = (
+                Comment.query.join(User, User.index == Comment.owner)
+                .filter(Comment.parent_massage == message_index)
+                .with_entities(*cols)
+            )
+            order = Comment.time.desc()
+        comments = query.order_by(order).paginate(page, per_page, error_out=False)
+        # 检查用户是否为消息点赞（包括尚未写入的点赞）
+        if archived:
+            favorite = archive.is_favorite(current_user.index, message_index)
+        else:
+            favorite = favorite_buffer.is_favorite("message", current_user.index, message_index)
         # 返回网页
         data = {
             "user": user,
@@ -125,6 +173,7 @@ def message_detail(message_index):
             "comments": comments,
             "music_list": music_list,
             "favorite": favorite,
+            "archived": archived,
         }
         return render_template("message/message_detail.html", **data)
     elif request.method == "POST":
@@ -136,6 +185,10 @@ def message_detail(message_index):
         if message_index is None:
             flash("试图评论的消息不存在")
             return redirect(url_for("message_list"))
+        if parent_message is None:
+            # 已归档的消息不能再评论
+            flash("试图评论的消息不存在或已归档")
+            return redirect(url_for("message_detail", message_index=message_index))
         if text is None or text == "":
             flash("请输入评论内容")
             return redirect(url_for(message_detail), message_index=message_index)
@@ -147,13 +200,17 @@ def message_detail(message_index):
             "parent_massage": message_index,
         }
         db.session.add(Comment(**data))
+        trending.record(message_index, trending.COMMENT_WEIGHT, data["time"])
         db.session.commit()
+        fragments.message_counts_changed(message_index)
+        fragments.trending_changed()
         flash("发送成功")
         return redirect(url_for("message_detail", message_index=message_index))
 
 
 @app.route("/delete_message/<int:message_index>", methods=["GET"])
 @login_required
+@retry_on_locked
 def delete_message(message_index):
     """
     GET: 删除消息
@@ -166,17 +223,18 @@ def delete_message(message_index):
     if not message.owner == current_user.index:
         flash("发生错误，请重试")
         return redirect(url_for("message_list"))
-    db.session.delete(message)
-    # 检索和删除评论
-    Comment.query.filter(Comment.parent_massage == message_index).delete()
+    # 删除帖子，评论和点赞记录通过外键级联删除
+    Message.query.filter(Message.index == message_index).delete(synchronize_session=False)
     # 提交删除指令和返回成功信息
     db.session.commit()
+    fragments.message_deleted(message_index)
     flash("删除成功")
     return redirect(url_for("message_list"))
 
 
 @app.route("/delete_comment/<int:comment_index>", methods=["GET"])
 @login_required
+@retry_on_locked
 def delete_comment(comment_index):
     """
     GET: 删除评论
@@ -191,7 +249,10 @@ def delete_comment(comment_index):
         flash("发生错误，请重试")
         return redirect(url_for("message_detail", message_index=comment_parent))
     db.session.delete(comment)
+    trending.record(comment_parent, -trending.COMMENT_WEIGHT, comment.time)
     db.session.commit()
+    fragments.message_counts_changed(comment_parent)
+    fragments.trending_changed()
     # 提交删除指令和返回成功信息
     flash("删除成功")
     return redirect(url_for("message_detail", message_index=comment_parent))
@@ -212,16 +273,20 @@ def user_message(user_index):
     info = f"{user.username}的消息"
     # 获取消息
     per_page = 30
-    page = request.args.get("page", 1, type=int)
-    columns = [Message.index, Message.time, Message.title, Message.owner, User.username]
-    messages = (
-        Message.query.join(User, Message.owner == User.index)  # 合并两个数据表
-        .filter(Message.owner == user_index)  # 过滤用户
-        .with_entities(*columns)  # 选择所需要的列
-        .order_by(Message.time.desc())  # 按照时间排序
-        .paginate(page, per_page, error_out=False)  # 进行分页
-    )
-    data = dict(messages=messages, info=info, is_current_user=is_current_user)
+    if archive.has_messages(user_index):
+        # 包括已归档的消息
+        query, key = archive.user_feed(user_index, [c.key for c in FEED_COLUMNS])
+    else:
+        columns = [*FEED_COLUMNS, User.username]
+        query = (
+            Message.query.join(User, Message.owner == User.index)  # 合并两个数据表
+            .filter(Message.owner == user_index)  # 过滤用户
+            .with_entities(*columns)  # 选择所需要的列
+        )
+        key = [Message.time, Message.index]
+    feed = f"user:{user_index}"
+    items = fragments.render_feed(feed, query, key, per_page)
+    data = dict(items=items, info=info, is_current_user=is_current_user)
     return render_template("message/message_list.html", **data)
 
 
@@ -239,24 +304,25 @@ def user_comment(user_index):
     info = f"{user.username}的评论"
     # 获取消息
     per_page = 30
-    page = request.args.get("page", 1, type=int)
     columns = [
         Comment.index,
         Comment.time,
         Comment.owner,
         Comment.text,
         Comment.parent_massage,
-        User.username,
-        Message.title,
     ]
-    comments = (
-        Comment.query.join(User, Comment.owner == User.index)  # 合并两个数据表
-        .join(Message, Message.index == Comment.parent_massage)
-        .filter(Comment.owner == user_index)  # 过滤用户
-        .with_entities(*columns)  # 选择所需要的列
-        .order_by(Comment.time.desc())  # 按照时间排序
-        .paginate(page, per_page, error_out=False)  # 进行分页
-    )
+    if archive.has_comments(user_index):
+        # 包括已归档的评论
+        query, key = archive.user_comments(user_index, [c.key for c in columns])
+    else:
+        query = (
+            Comment.query.join(User, Comment.owner == User.index)  # 合并两个数据表
+            .join(Message, Message.index == Comment.parent_massage)
+            .filter(Comment.owner == user_index)  # 过滤用户
+            .with_entities(*columns, User.username, Message.title)  # 选择所需要的列
+        )
+        key = [Comment.time, Comment.index]
+    comments = paginate(query, key, per_page)  # 按照时间排序并分页
     return render_template("message/comment_list.html", comments=comments, info=info)
 
 
@@ -274,21 +340,21 @@ def favorite_message_list(user_index):
     info = f"{user.username}喜欢的消息"
     # 获取消息
     per_page = 30
-    page = request.args.get("page", 1, type=int)
-    columns = [Message.index, Message.time, Message.title, Message.owner, User.username]
-    messages = (
+    columns = [*FEED_COLUMNS, User.username]
+    query = (
         Message.query.join(User, Message.owner == User.index)
         .join(FavoriteMessage, FavoriteMessage.message_id == Message.index)
         .filter(FavoriteMessage.user_id == user_index)  # 过滤用户
         .with_entities(*columns)  # 选择所需要的列
-        .order_by(Message.time.desc())  # 按照时间排序
-        .paginate(page, per_page, error_out=False)  # 进行分页
     )
-    data = dict(messages=messages, info=info, is_current_user=False)
+    feed = f"favorite:{user_index}"
+    items = fragments.render_feed(feed, query, [Message.time, Message.index], per_page)
+    data = dict(items=items, info=info, is_current_user=False)
     return render_template("message/message_list.html", **data)
 
 
 @app.route("/favorite_message/<int:user_index>/<int:message_index>", methods=["GET"])
+@retry_on_locked
 def favorite_message(user_index, message_index):
     # 检查用户和消息是否存在
     user = User.query.filter(User.index == user_index).first()
@@ -299,14 +365,9 @@ def favorite_message(user_index, message_index):
     if not message:
         flash("发生错误，请重试（用户不存在）")
         return redirect(url_for("message_detail", message_index=message_index))
-    # 检查是否已经喜欢该消息
-    data = dict(message_id=message_index, user_id=user_index)
-    favorite = FavoriteMessage.query.filter_by(**data).first()
-    if favorite:
-        flash("已取消点赞")
-        db.session.delete(favorite)
-    else:
+    # 切换点赞状态，由 `favorite_buffer` 合并后批量写入
+    if favorite_buffer.toggle("message", user_index, message_index):
         flash("已点赞消息")
-        db.session.add(FavoriteMessage(**data))
-    db.session.commit()
+    else:
+        flash("已取消点赞")
     return redirect(url_for("message_detail", message_index=message_index))
@@ -0,0 +1,13 @@
+"""运行指标页面，供 Prometheus 采集。"""
+
+from flask import Response, abort
+
+from MusicList import app, metrics
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """GET: 以 Prometheus 文本格式输出运行指标（访问限制见 `metrics.is_allowed`）"""
+    if not metrics.is_allowed():
+        abort(404)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,13 +1,15 @@
 """
 包含了与搜索歌曲相关的页面和操作。\n
-包括：搜索歌曲的页面和结果页面；添加歌曲；歌曲详情。
+包括：搜索歌曲的页面和结果页面；输入时的自动补全；添加歌曲；歌曲详情；艺术家列表和艺术家页面。
 """
 
-from flask import request, flash, redirect, url_for, render_template
+from flask import request, flash, redirect, url_for, render_template, jsonify, abort
 from flask_login import current_user, login_required
 
-from MusicList import app, db
-from MusicList.model import Music, List
+from MusicList import app, db, search, recommend, artists
+from MusicList.autocomplete import TOP_K, suggestions
+from MusicList.model import Music, List, Artist, insert_music, music_content_key
+from MusicList.pagination import paginate
 
 
 @app.route("/search_music", methods=["GET", "POST"])
@@ -19,10 +21,7 @@ def search_music():
     """
     if request.method == "GET":
         per_page = 30  # 每页中最大内容数
-        page = request.args.get("page", 1, type=int)
-        musics = Music.query.order_by(Music.index.desc()).paginate(
-            page, per_page, error_out=False
-        )
+        musics = paginate(Music.query, [Music.index], per_page)
         return render_template("music_list/search_music.html", musics=musics)
     elif request.method == "POST":
         keyword = request.form.get("keyword")
@@ -32,6 +31,28 @@ def search_music():
         return redirect(url_for("search_result", keyword=keyword))
 
 
+@app.route("/autocomplete", methods=["GET"])
+@login_required
+def autocomplete():
+    """
+    GET: 自动补全（JSON），返回歌曲名或艺术家与 `q` 匹配的热度最高的歌曲 \n
+    `limit`: 返回的歌曲数，最多 `TOP_K` 首
+    """
+    prefix = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", TOP_K, type=int), 1), TOP_K)
+    items = [
+        {
+            "index": index,
+            "music_name": music_name,
+            "artist": artist,
+            "popularity": popularity,
+            "url": url_for("music_detail", index=index),
+        }
+        for index, music_name, artist, popularity in suggestions.suggest(prefix, limit)
+    ]
+    return jsonify(query=prefix, items=items)
+
+
 @app.route("/search_result/<string:keyword>", methods=["GET", "POST"])
 @login_required
 def search_result(keyword):
@@ -40,8 +61,11 @@ def search_result(keyword):
     POST: 添加歌曲
     """
     if request.method == "GET":
-        musics = Music.query.filter(Music.music_name == keyword).all()
-        data = dict(keyword=keyword, musics=musics)
+        per_page = 30  # 每页中最大内容数
+        page = request.args.get("page", 1, type=int)
+        musics = search.search_music(keyword, page, per_page)
+        lists = List.query.filter_by(owner=current_user.index).all()
+        data = dict(keyword=keyword, musics=musics, lists=lists[::-1])
         return render_template("music_list/search_result.html", **data)
     elif request.method == "POST":
         # 从前端获取数据
@@ -53,14 +77,18 @@ def search_result(keyword):
             return redirect(url_for("search_result", keyword=keyword))
         if not link:
             link = ""
-        # 检查歌曲是否已经存在
+        # 添加歌曲，如果歌曲已经存在则不会插入
         music_info = dict(music_name=music_name, artist=artist, link=link)
-        if Music.query.filter_by(**music_info).first() is not None:
-            flash("歌曲信息已存在")
-            return redirect(url_for("search_result", keyword=keyword))
-        # 添加歌曲
-        db.session.add(Music(**music_info))
+        content_key = music_content_key(**music_info)
+        statement = insert_music().values(content_key=content_key, **music_info)
+        result = db.session.execute(statement)
+        if result.rowcount:
+            artists.link_songs([(result.inserted_primary_key[0], artist)])
         db.session.commit()
+        if result.rowcount == 0:
+            flash("歌曲信息已存在")
+        else:
+            suggestions.sync()
         return redirect(url_for("search_result", keyword=keyword))
 
 
@@ -68,12 +96,40 @@ def search_result(keyword):
 @login_required
 def music_detail(index):
     """
-    GET: 歌曲详情页面；页面中也可以将歌曲添加到列表
+    GET: 歌曲详情页面；页面中也可以将歌曲添加到列表，并推荐经常一起收录的歌曲
     """
     music = Music.query.filter(Music.index == index).first()
-    lists = List.query.filter_by(owner=current_user.index).all()
-    data = dict(music=music, lists=lists[::-1])
     if not music:
-        flash("歌曲不存在")
-        return redirect(url_for("search_music"))
+        abort(404)
+    lists = List.query.filter_by(owner=current_user.index).all()
+    similar = recommend.similar_musics(index)
+    credits = artists.credits(index)
+    data = dict(music=music, lists=lists[::-1], similar=similar, credits=credits)
     return render_template("music_list/music_detail.html", **data)
+
+
+@app.route("/artists", methods=["GET"])
+@login_required
+def artist_list():
+    """
+    GET: 艺术家列表，按歌曲被歌单收录的次数排序
+    """
+    per_page = 30  # 每页中最大内容数
+    query = Artist.query.filter(Artist.song_count > 0)
+    artist_items = paginate(query, [Artist.list_count, Artist.index], per_page)
+    return render_template("music_list/artist_list.html", artists=artist_items)
+
+
+@app.route("/artist/<int:index>", methods=["GET"])
+@login_required
+def artist_detail(index):
+    """
+    GET: 艺术家页面，包括歌曲数、被歌单收录的次数和艺术家的歌曲（最近添加的在前）
+    """
+    artist = Artist.query.filter(Artist.index == index).first()
+    if not artist:
+        flash("艺术家不存在")
+        return redirect(url_for("artist_list"))
+    per_page = 30  # 每页中最大内容数
+    musics = paginate(artists.songs(index), artists.SONG_ORDER, per_page)
+    return render_template("music_list/artist_detail.html", artist=artist, musics=musics)
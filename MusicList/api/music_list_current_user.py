@@ -1,13 +1,18 @@
 """
 保存了查看自身歌单的操作。\n
-包括：添加和删除歌单；更改歌单私密性；查看当前用户歌单列表；查看当前用户歌单详情；将歌曲从列表中添加和删除。
+包括：添加和删除歌单；更改歌单私密性；查看当前用户歌单列表；查看当前用户歌单详情（包括分页获取歌曲的 JSON 接口）；调整歌曲的顺序；将歌曲从列表中添加和删除（包括批量操作）。
 """
 
-from flask import request, flash, redirect, url_for, render_template
+from flask import request, flash, redirect, url_for, render_template, jsonify
 from flask_login import current_user, login_required
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from MusicList import app, db
+from MusicList import app, db, playlists
+from MusicList.database import retry_on_locked
 from MusicList.model import User, Music, List, MusicList, FavoriteList
+from MusicList.pagination import next_page_args
+
+MAX_BULK_MUSICS = 5000  # 批量操作时一次最多处理的歌曲数
 
 
 @app.route("/my_lists", methods=["GET", "POST"])
@@ -57,12 +62,8 @@ def list_detail(list_index):
         if music_list.share == 0 and not music_list.owner == current_user.index:
             flash("发生错误，请重试（歌单未公开）")
             return redirect(url_for("music_lists"))
-        # 获取歌曲并返回
-        musics = (
-            Music.query.join(MusicList, MusicList.music_id == Music.index)
-            .filter(MusicList.list_id == list_index)
-            .all()
-        )
+        # 按顺序分页获取歌曲并返回
+        musics = playlists.page(list_index)
         return render_template(
             "music_list/list_detail.html", musics=musics, list=music_list
         )
@@ -98,8 +99,100 @@ def list_detail(list_index):
         return redirect(url_for("list_detail", list_index=list_index))
 
 
+@app.route("/list_musics/<int:list_index>", methods=["GET"])
+@login_required
+def list_musics(list_index):
+    """
+    GET: 按顺序分页获取歌单中的歌曲（JSON），用于加载歌单的后续页面 \n
+    参数 `per_page` 为每页的歌曲数，`next` 为下一页的地址，没有下一页时为 `null`。
+    """
+    music_list = List.query.filter(List.index == list_index).first()
+    if music_list is None:
+        return jsonify(error="歌单不存在"), 404
+    if music_list.share == 0 and not music_list.owner == current_user.index:
+        return jsonify(error="歌单未公开"), 403
+    per_page = request.args.get("per_page", playlists.PAGE_SIZE, type=int)
+    per_page = min(max(per_page, 1), playlists.MAX_PAGE_SIZE)
+    musics = playlists.page(list_index, per_page)
+    args = next_page_args(musics)
+    next_url = None
+    if args is not None:
+        next_url = url_for("list_musics", list_index=list_index, per_page=per_page, **args)
+    items = [playlists.to_dict(row) for row in musics.items]
+    return jsonify(list=list_index, items=items, next=next_url)
+
+
+@app.route("/move_music/<int:list_index>", methods=["POST"])
+@login_required
+@retry_on_locked
+def move_music(list_index):
+    """
+    POST: 调整歌曲在歌单中的顺序（拖动排序，返回 JSON）\n
+    `entry`: 被移动的记录（`MusicList.index`）\n
+    `after` / `before`: 移动到这条记录之后或之前，都为空时移动到开头
+    """
+    music_list = List.query.filter(List.index == list_index).first()
+    if music_list is None or not music_list.owner == current_user.index:
+        return jsonify(error="操作的歌单不存在或操作的歌单与当前用户不符"), 403
+    entry = request.form.get("entry", type=int)
+    if entry is None:
+        return jsonify(error="请选择歌曲"), 400
+    after = request.form.get("after", type=int)
+    before = request.form.get("before", type=int)
+    try:
+        _, gap = playlists.move(list_index, entry, after=after, before=before)
+    except ValueError as error:
+        db.session.rollback()
+        return jsonify(error=str(error)), 400
+    db.session.commit()
+    if gap is not None and gap < playlists.REBALANCE_GAP:
+        playlists.rebalancer.schedule(list_index)
+    return jsonify(entry=entry)
+
+
+@app.route("/move_music_range/<int:list_index>", methods=["POST"])
+@login_required
+@retry_on_locked
+def move_music_range(list_index):
+    """
+    POST: 将歌单中第 `first` 首到第 `last` 首歌曲整体移动到第 `after` 首之后（`0` 表示开头）
+    """
+    music_list = List.query.filter(List.index == list_index).first()
+    if music_list is None or not music_list.owner == current_user.index:
+        flash("发生错误，请重试（操作的歌单不存在或操作的歌单与当前用户不符）")
+        return redirect(url_for("music_lists"))
+    first = request.form.get("first", type=int)
+    last = request.form.get("last", type=int)
+    after = request.form.get("after", type=int)
+    if first is None or last is None or after is None:
+        flash("请输入歌曲的序号")
+        return redirect(url_for("list_detail", list_index=list_index))
+    first, last = min(first, last), max(first, last)
+    if first <= after <= last:
+        flash("不能移动到所选的歌曲之间")
+        return redirect(url_for("list_detail", list_index=list_index))
+    first_entry = playlists.entry_at(list_index, first)
+    last_entry = playlists.entry_at(list_index, last)
+    after_entry = playlists.entry_at(list_index, after)
+    if first_entry is None or last_entry is None or (after and after_entry is None):
+        flash("歌曲的序号超出了范围")
+        return redirect(url_for("list_detail", list_index=list_index))
+    try:
+        _, gap = playlists.move_range(list_index, first_entry, last_entry, after=after_entry)
+    except ValueError as error:
+        db.session.rollback()
+        flash(str(error))
+        return redirect(url_for("list_detail", list_index=list_index))
+    db.session.commit()
+    if gap is not None and gap < playlists.REBALANCE_GAP:
+        playlists.rebalancer.schedule(list_index)
+    flash(f"已移动 {last - first + 1} 首歌曲")
+    return redirect(url_for("list_detail", list_index=list_index))
+
+
 @app.route("/add_music_to_list/<int:music_id>/<int:list_id>", methods=["GET"])
 @login_required
+@retry_on_locked
 def add_music_to_list(music_id, list_id):
     """
     GET: 将歌曲添加到列表
@@ -127,8 +220,61 @@ def add_music_to_list(music_id, list_id):
     return redirect(url_for("music_detail", index=music_id))
 
 
+@app.route("/bulk_music_list", methods=["POST"])
+@login_required
+@retry_on_locked
+def bulk_music_list():
+    """
+    POST: 批量将歌曲添加到列表或从列表中删除 \n
+    `list_index`: 列表的 `index` \n
+    `action`: `add` 或 `delete` \n
+    `music_ids`: 歌曲的 `index`，可以有多个；也可以在 `music_id_text` 中用空格或逗号分隔
+    """
+    # 获取表单数据
+    list_index = request.form.get("list_index", type=int)
+    action = request.form.get("action")
+    raw_ids = request.form.getlist("music_ids")
+    raw_ids += request.form.get("music_id_text", "").replace(",", " ").split()
+    music_ids = {int(music_id) for music_id in raw_ids if music_id.isdigit()}
+    if action not in ("add", "delete") or list_index is None:
+        flash("发生错误，请重试")
+        return redirect(url_for("music_lists"))
+    if not music_ids:
+        flash("请选择歌曲")
+        return redirect(url_for("list_detail", list_index=list_index))
+    if len(music_ids) > MAX_BULK_MUSICS:
+        flash(f"一次最多操作 {MAX_BULK_MUSICS} 首歌曲")
+        return redirect(url_for("list_detail", list_index=list_index))
+    # 检测列表的正确性
+    music_list = List.query.filter(List.index == list_index).first()
+    if music_list is None or not music_list.owner == current_user.index:
+        flash("发生错误，请重试（操作的歌单不存在或操作的歌单与当前用户不符）")
+        return redirect(url_for("music_lists"))
+    if action == "add":
+        # 只添加存在的歌曲；已经在列表中的歌曲（包括并发添加的）由唯一索引忽略
+        query = db.session.query(Music.index).filter(Music.index.in_(music_ids))
+        found = [music_id for (music_id,) in query]
+        added = 0
+        if found:
+            records = [dict(list_id=list_index, music_id=music_id) for music_id in found]
+            statement = sqlite_insert(MusicList.__table__).on_conflict_do_nothing()
+            added = db.session.execute(statement, records).rowcount
+        db.session.commit()
+        flash(f"添加了 {added} 首歌曲，{len(found) - added} 首已在列表中")
+    else:
+        deleted = (
+            MusicList.query.filter(MusicList.list_id == list_index)
+            .filter(MusicList.music_id.in_(music_ids))
+            .delete(synchronize_session=False)
+        )
+        db.session.commit()
+        flash(f"删除了 {deleted} 首歌曲")
+    return redirect(url_for("list_detail", list_index=list_index))
+
+
 @app.route("/delete_list/<int:list_index>", methods=["GET"])
 @login_required
+@retry_on_locked
 def delete_list(list_index):
     """
     GET: 删除列表
@@ -138,10 +284,8 @@ def delete_list(list_index):
     if music_list is None or not music_list.owner == current_user.index:
         flash("发生错误，请重试（操作的歌单不存在或操作的歌单与当前用户不符）")
         return redirect(url_for("music_lists"))
-    # 删除列表中的所有歌曲
-    db.session.query(MusicList).filter(list_index == list_index).delete()
-    # 删除列表
-    db.session.delete(music_list)
+    # 删除列表，列表中的歌曲和收藏记录通过外键级联删除
+    List.query.filter(List.index == list_index).delete(synchronize_session=False)
     db.session.commit()
     flash("删除成功")
     return redirect(url_for("music_lists"))
@@ -151,6 +295,7 @@ def delete_list(list_index):
     "/delete_music_from_list/<int:music_index>/<int:list_index>", methods=["GET"]
 )
 @login_required
+@retry_on_locked
 def delete_music_from_list(music_index, list_index):
     """
     GET: 从列表中删除歌曲
@@ -6,8 +6,10 @@
 from flask import flash, redirect, url_for, render_template
 from flask_login import current_user, login_required
 
-from MusicList import app, db
-from MusicList.model import User, Music, List, MusicList, FavoriteList
+from MusicList import app, playlists, recommend
+from MusicList.database import retry_on_locked
+from MusicList.favorites import favorite_buffer
+from MusicList.model import User, List, FavoriteList
 
 
 @app.route("/user_lists/<int:user_index>", methods=["GET"])
@@ -36,24 +38,15 @@ def user_list_detail(list_index):
         flash("发生错误，请重试（歌单不存在）")
         return redirect(url_for("index"))
     if music_list.owner == current_user.index:
-        return redirect(url_for("list_detail"))
-    # 获取音乐
-    musics = (
-        Music.query.join(MusicList, MusicList.music_id == Music.index)
-        .filter(MusicList.list_id == list_index)
-        .all()
-    )
-    # 获取收藏情况
-    favorite_list = (
-        FavoriteList.query.filter(FavoriteList.list_id == list_index)
-        .filter(FavoriteList.user_id == current_user.index)
-        .first()
-    )
-    favorite = False
-    if favorite_list:
-        favorite = True
+        return redirect(url_for("list_detail", list_index=list_index))
+    # 按顺序分页获取音乐
+    musics = playlists.page(list_index)
+    # 获取收藏情况（包括尚未写入的收藏）
+    favorite = favorite_buffer.is_favorite("list", current_user.index, list_index)
+    # 获取相似的歌单
+    similar = recommend.similar_lists(list_index)
     # 返回页面
-    data = dict(musics=musics, list=music_list, favorite=favorite)
+    data = dict(musics=musics, list=music_list, favorite=favorite, similar=similar)
     return render_template("music_list_other_user/user_list_detail.html", **data)
 
 
@@ -70,7 +63,7 @@ def favorite_music_lists(user_index):
         return redirect(url_for("message_list"))
     info = f"{user.username}收藏的歌单"
     # 获取歌单
-    columns = [List.index, List.list_name, User.username]
+    columns = [List.index, List.list_name, List.music_count, List.favorite_count, User.username]
     music_lists = (
         List.query.join(User, User.index == List.owner) # 连接 User 表获取用户名
         .join(FavoriteList, FavoriteList.list_id == List.index) # 连接 FavoriteList 表，以供筛选收藏
@@ -83,17 +76,15 @@ def favorite_music_lists(user_index):
 
 
 @app.route("/favorite_music_list/<int:user_index>/<int:list_index>", methods=["GET"])
+@retry_on_locked
 def favorite_music_list(user_index, list_index):
     """
     `GET`: 收藏和取消歌单 API
     """
     # 检查是否已经收藏该歌单
-    data = dict(list_id=list_index, user_id=user_index)
-    favorite = FavoriteList.query.filter_by(**data).first()
-    if favorite:
+    if favorite_buffer.is_favorite("list", user_index, list_index):
         flash("已取消收藏")
-        db.session.delete(favorite)
-        db.session.commit()
+        favorite_buffer.set("list", user_index, list_index, False)
         return redirect(url_for("user_list_detail", list_index=list_index))
     # 检查歌单是否存在
     music_list = List.query.filter(List.index == list_index).first()
@@ -111,7 +102,6 @@ def favorite_music_list(user_index, list_index):
     if not user:
         flash("发生错误，请重试（用户不存在）")
         return redirect(url_for("user_list_detail", list_index=list_index))
-    db.session.add(FavoriteList(**data))
-    db.session.commit()
+    favorite_buffer.set("list", user_index, list_index, True)
     flash("已收藏歌单")
     return redirect(url_for("user_list_detail", list_index=list_index))
@@ -3,8 +3,16 @@
 from flask import request, flash, redirect, url_for, render_template
 from flask_login import current_user, login_required, login_user, logout_user
 
-from MusicList import app, db
+from MusicList import app, db, fragments, user_cache
 from MusicList.model import User
+from MusicList.passwords import HashQueueFull
+
+
+@app.errorhandler(HashQueueFull)
+def password_hash_queue_full(error):
+    """等待计算的密码哈希过多时，提示用户稍后重试"""
+    flash("服务器繁忙，请稍后重试")
+    return redirect(request.referrer or url_for("index"))
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -24,6 +32,11 @@ def login():
         if not user or not user.validate_password(password):
             flash("用户名或密码错误")
             return redirect(url_for("login"))
+        # 哈希参数已经过时的，使用新参数重新计算哈希
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
+            user_cache.invalidate(user.index)
         # 进行登录，返回成功信息，跳转页面
         login_user(user)
         flash(f"{username}登录成功")
@@ -103,12 +116,13 @@ def change_password():
         flash("请输入想要更改的密码")
         return redirect(url_for("user_info"))
     # 检查两次输入的密码是否一致
-    if password == confirm_password:
+    if password != confirm_password:
         flash("两次输入的密码不一致")
         return redirect(url_for("user_info"))
     # 更改当前用户的密码
     current_user.set_password(password)
     db.session.commit()
+    user_cache.invalidate(current_user.index)
     # 返回成功信息
     flash("密码更改成功")
     return redirect(url_for("index"))
@@ -132,5 +146,7 @@ def change_username():
     # 更改用户名
     current_user.username = username
     db.session.commit()
+    user_cache.invalidate(current_user.index)
+    fragments.username_changed(current_user.index)
     # 跳转到主页
     return redirect(url_for("user_info"))
@@ -0,0 +1,221 @@
+"""
+旧消息的归档。\n
+`message` 和 `comment` 会不断增长，而绝大多数访问集中在最近的帖子上。`archive` 把很久没有动态
+（消息本身和它的所有评论都早于指定时间）的消息连同评论和点赞记录分批移动到
+`message_archive`、`comment_archive` 和 `favorite_message_archive`，使得消息列表、热门消息、
+计数触发器等使用的表保持较小。\n
+归档表与原表位于同一个数据库文件中，每批的移动在一个事务中完成，不会出现只移动了一半的消息。
+已归档的消息是只读的：`message_detail` 和 `user_message` 在原表中找不到时读取归档表，
+不能再评论或点赞。\n
+`message` 和 `comment` 使用 `AUTOINCREMENT`，新的记录不会使用已归档的记录的 `index`，
+因此原表和归档表中的 `index` 不会重复。
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from MusicList import app, db
+from MusicList.database import backoff_delays, is_locked_error
+from MusicList.model import (
+    Comment,
+    CommentArchive,
+    FavoriteMessageArchive,
+    Message,
+    MessageArchive,
+    User,
+)
+
+MESSAGE_COLUMNS = "\"index\", title, text, owner, time, list_index, like_count, comment_count"
+COMMENT_COLUMNS = "\"index\", text, owner, time, parent_massage"
+
+# 可以归档的消息：早于 `cutoff` 且之后没有新的评论。
+# 使用 `AUTOINCREMENT` 之前的数据库中可能已有 `index` 与归档表重复的记录，这些记录保留在原表中
+CANDIDATES = text(
+    """
+    SELECT "index" FROM message
+    WHERE "index" > :after AND time < :cutoff
+    AND NOT EXISTS (SELECT 1 FROM message_archive WHERE "index" = message."index")
+    AND NOT EXISTS (
+        SELECT 1 FROM comment WHERE parent_massage = message."index"
+        AND (
+            time >= :cutoff
+            OR EXISTS (SELECT 1 FROM comment_archive WHERE "index" = comment."index")
+        )
+    )
+    ORDER BY "index" LIMIT :limit
+    """
+)
+
+MOVE_STATEMENTS = [
+    f"INSERT INTO message_archive ({MESSAGE_COLUMNS}) "
+    f"SELECT {MESSAGE_COLUMNS} FROM message WHERE \"index\" IN ({{ids}})",
+    f"INSERT INTO comment_archive ({COMMENT_COLUMNS}) "
+    f"SELECT {COMMENT_COLUMNS} FROM comment WHERE parent_massage IN ({{ids}})",
+    "INSERT OR IGNORE INTO favorite_message_archive (message_id, user_id) "
+    "SELECT message_id, user_id FROM favorite_message WHERE message_id IN ({ids})",
+    # 外键的级联删除同样会删除以下记录，这里显式删除以兼容没有外键约束的旧数据库
+    "DELETE FROM comment WHERE parent_massage IN ({ids})",
+    "DELETE FROM favorite_message WHERE message_id IN ({ids})",
+    "DELETE FROM message_score WHERE message_id IN ({ids})",
+    'DELETE FROM message WHERE "index" IN ({ids})',
+]
+
+
+def ensure_schema():
+    """
+    为已有的数据库创建归档表和索引，并把 `message` 和 `comment` 重建为使用 `AUTOINCREMENT` 的表，
+    返回重建的数据表名。
+    """
+    from MusicList import schema
+
+    for model in (MessageArchive, CommentArchive, FavoriteMessageArchive):
+        model.__table__.create(bind=db.engine, checkfirst=True)
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    return schema.upgrade_autoincrement()
+
+
+def _move(ids):
+    """在一个事务中移动一批消息，返回移动的 `(消息, 评论, 点赞)` 数量"""
+    params = {"ids": ", ".join(str(int(i)) for i in ids)}
+    counts = [
+        db.session.execute(text(statement.format(**params))).rowcount
+        for statement in MOVE_STATEMENTS[:3]
+    ]
+    for statement in MOVE_STATEMENTS[3:]:
+        db.session.execute(text(statement.format(**params)))
+    db.session.commit()
+    return counts
+
+
+def archive(older_than, batch_size=500, pause=0.0):
+    """
+    分批归档最后的动态早于 `older_than`（`timedelta` 或 `datetime`）的消息，每批一个事务；
+    数据库被锁定时等待后重试该批。\n
+    `pause`: 每批之间等待的秒数，让其他请求有机会写入 \n
+    返回统计信息：`messages`、`comments`、`favorites`、`seconds`。
+    """
+    ensure_schema()
+    if isinstance(older_than, timedelta):
+        cutoff = datetime.now() - older_than
+    else:
+        cutoff = older_than
+    stats = {"messages": 0, "comments": 0, "favorites": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    after = 0
+    while True:
+        params = {"after": after, "cutoff": cutoff, "limit": batch_size}
+        ids = [row[0] for row in db.session.execute(CANDIDATES, params)]
+        if not ids:
+            break
+        delays = backoff_delays(
+            app.config["SQLITE_LOCK_RETRIES"], app.config["SQLITE_LOCK_BACKOFF"]
+        )
+        while True:
+            try:
+                counts = _move(ids)
+                break
+            except OperationalError as error:
+                db.session.rollback()
+                delay = next(delays, None)
+                if not is_locked_error(error) or delay is None:
+                    raise
+                app.logger.warning("数据库被锁定，%.3f 秒后重新归档该批消息", delay)
+                time.sleep(delay)
+        for key, count in zip(("messages", "comments", "favorites"), counts):
+            stats[key] += count
+        after = ids[-1]
+        if pause:
+            time.sleep(pause)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def find_message(message_index):
+    """
+    已归档的消息，不存在时返回 `None`。
+    """
+    return MessageArchive.query.filter(MessageArchive.index == message_index).first()
+
+
+def comments(message_index, columns):
+    """
+    已归档的消息的评论（未排序），`columns` 为 `Comment` 的列名。
+    """
+    return (
+        CommentArchive.query.join(User, User.index == CommentArchive.owner)
+        .filter(CommentArchive.parent_massage == message_index)
+        .with_entities(*[getattr(CommentArchive, c) for c in columns], User.username)
+    )
+
+
+def is_favorite(user_index, message_index):
+    """
+    用户是否点赞了已归档的消息。
+    """
+    query = FavoriteMessageArchive.query.filter_by(message_id=message_index, user_id=user_index)
+    return db.session.query(query.exists()).scalar()
+
+
+def has_messages(owner):
+    """
+    用户是否有已归档的消息。
+    """
+    query = MessageArchive.query.filter(MessageArchive.owner == owner)
+    return db.session.query(query.exists()).scalar()
+
+
+def has_comments(owner):
+    """
+    用户是否有已归档的评论。
+    """
+    query = CommentArchive.query.filter(CommentArchive.owner == owner)
+    return db.session.query(query.exists()).scalar()
+
+
+def user_feed(owner, columns):
+    """
+    用户的所有消息（包括已归档的消息），`columns` 为 `Message` 的列名。\n
+    返回 `(查询, 分页的排序键)`，排序键为 `(time, index)`。
+    """
+
+    def select(model):
+        return (
+            db.session.query(
+                *[getattr(model, c).label(c) for c in columns], User.username.label("username")
+            )
+            .join(User, User.index == model.owner)
+            .filter(model.owner == owner)
+        )
+
+    feed = select(Message).union_all(select(MessageArchive)).subquery("feed")
+    return db.session.query(feed), [feed.c.time, feed.c.index]
+
+
+def user_comments(owner, columns):
+    """
+    用户的所有评论（包括已归档的评论）及其消息的标题，`columns` 为 `Comment` 的列名。\n
+    返回 `(查询, 分页的排序键)`，排序键为 `(time, index)`。
+    """
+
+    def select(model, message):
+        return (
+            db.session.query(
+                *[getattr(model, c).label(c) for c in columns],
+                User.username.label("username"),
+                message.title.label("title"),
+            )
+            .join(User, User.index == model.owner)
+            .join(message, message.index == model.parent_massage)
+            .filter(model.owner == owner)
+        )
+
+    comments = (
+        select(Comment, Message)
+        .union_all(select(CommentArchive, MessageArchive))
+        .subquery("comments")
+    )
+    return db.session.query(comments), [comments.c.time, comments.c.index]
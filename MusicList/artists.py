@@ -0,0 +1,280 @@
+"""
+艺术家。\n
+歌曲的 `Music.artist` 是用户输入的文本，可能包含多位艺术家（如 `A & B`、`A feat. B`）。
+`split_artists` 将其拆分并规范化，每位艺术家在 `Artist` 中只有一条记录，
+歌曲和艺术家的对应关系保存在 `MusicArtist` 中，`Music.artist_id` 指向第一位艺术家。\n
+`Artist.song_count`（歌曲数）和 `Artist.list_count`（歌曲被歌单收录的次数，同一个歌单收录了
+同一位艺术家的多首歌曲时分别计数）由 `music_artist` 和 `music_list` 上的触发器在同一个事务中增减，
+艺术家页面直接读取，不需要统计。\n
+添加歌曲和批量导入时立即关联艺术家；`link_pending` 为已有的歌曲（或没有经过这些入口添加的歌曲）补充关联，
+`reconcile` 重新统计计数并删除没有歌曲的艺术家。
+"""
+
+import re
+
+from sqlalchemy import DDL, bindparam, event, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from MusicList import db, search
+from MusicList.model import Artist, Music, MusicArtist, normalize_text
+
+MAX_CREDITS = 10  # 每首歌曲最多关联的艺术家数
+NAME_LENGTH = 100
+
+# 分隔多位艺术家的符号和词；`/` 常出现在艺术家的名字中（如 `AC/DC`），不作为分隔符
+SEPARATORS = re.compile(
+    r"\s*(?:[&＆,，、;；]|\b(?:feat\.?|ft\.|featuring)(?=\s|$))\s*", re.IGNORECASE
+)
+BRACKETS = " ()（）[]【】"
+
+# 歌曲的艺术家变化时，该歌曲在歌单中的每条记录都计入（移出）艺术家的收录次数
+CREATE_STATEMENTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS music_artist_insert AFTER INSERT ON music_artist BEGIN
+        UPDATE artist SET song_count = song_count + 1,
+        list_count = list_count + (
+            SELECT count(*) FROM music_list WHERE music_id = new.music_id
+        ) WHERE "index" = new.artist_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS music_artist_delete AFTER DELETE ON music_artist BEGIN
+        UPDATE artist SET song_count = song_count - 1,
+        list_count = list_count - (
+            SELECT count(*) FROM music_list WHERE music_id = old.music_id
+        ) WHERE "index" = old.artist_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS music_artist_update
+    AFTER UPDATE OF music_id, artist_id ON music_artist BEGIN
+        UPDATE artist SET song_count = song_count - 1,
+        list_count = list_count - (
+            SELECT count(*) FROM music_list WHERE music_id = old.music_id
+        ) WHERE "index" = old.artist_id;
+        UPDATE artist SET song_count = song_count + 1,
+        list_count = list_count + (
+            SELECT count(*) FROM music_list WHERE music_id = new.music_id
+        ) WHERE "index" = new.artist_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS music_list_artist_insert AFTER INSERT ON music_list BEGIN
+        UPDATE artist SET list_count = list_count + 1 WHERE "index" IN (
+            SELECT artist_id FROM music_artist WHERE music_id = new.music_id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS music_list_artist_delete AFTER DELETE ON music_list BEGIN
+        UPDATE artist SET list_count = list_count - 1 WHERE "index" IN (
+            SELECT artist_id FROM music_artist WHERE music_id = old.music_id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS music_list_artist_update AFTER UPDATE OF music_id ON music_list
+    WHEN old.music_id IS NOT new.music_id BEGIN
+        UPDATE artist SET list_count = list_count - 1 WHERE "index" IN (
+            SELECT artist_id FROM music_artist WHERE music_id = old.music_id
+        );
+        UPDATE artist SET list_count = list_count + 1 WHERE "index" IN (
+            SELECT artist_id FROM music_artist WHERE music_id = new.music_id
+        );
+    END
+    """,
+]
+
+DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS music_artist_insert",
+    "DROP TRIGGER IF EXISTS music_artist_delete",
+    "DROP TRIGGER IF EXISTS music_artist_update",
+    "DROP TRIGGER IF EXISTS music_list_artist_insert",
+    "DROP TRIGGER IF EXISTS music_list_artist_delete",
+    "DROP TRIGGER IF EXISTS music_list_artist_update",
+]
+
+# `db.create_all()` 和 `db.drop_all()` 时自动创建和删除触发器（两张表都存在后才能创建）
+for statement in CREATE_STATEMENTS:
+    event.listen(db.metadata, "after_create", DDL(statement))
+for statement in DROP_STATEMENTS:
+    event.listen(db.metadata, "before_drop", DDL(statement))
+
+# 艺术家的歌曲的排序键：值与 `Music.index` 相同，但可以直接按 `music_artist` 的索引的顺序读取
+SONG_ORDER = [MusicArtist.music_id.label("index")]
+
+UPDATE_MUSIC_ARTIST = (
+    Music.__table__.update()
+    .where(Music.__table__.c.index == bindparam("music"))
+    .values(artist_id=bindparam("primary"))
+)
+
+
+def split_artists(value):
+    """
+    拆分歌曲的艺术家，返回去重后的 `(名字, 规范化的名字)` 列表，顺序与原文相同。\n
+    例如 `A & B feat. C` 拆分为 `A`、`B` 和 `C`。
+    """
+    credits = {}
+    for part in SEPARATORS.split(value or ""):
+        name = " ".join(part.strip(BRACKETS).split())[:NAME_LENGTH]
+        key = normalize_text(name)
+        if key and key not in credits:
+            credits[key] = name
+        if len(credits) >= MAX_CREDITS:
+            break
+    return [(name, key) for key, name in credits.items()]
+
+
+def ensure_schema():
+    """
+    为已有的数据库添加 `Music.artist_id`、艺术家的表、索引和触发器。
+    """
+    Artist.__table__.create(bind=db.engine, checkfirst=True)
+    MusicArtist.__table__.create(bind=db.engine, checkfirst=True)
+    columns = {c["name"] for c in inspect(db.engine).get_columns("music")}
+    if "artist_id" not in columns:
+        db.session.execute(
+            text(
+                'ALTER TABLE music ADD COLUMN artist_id INTEGER '
+                'REFERENCES artist ("index") ON DELETE SET NULL'
+            )
+        )
+        db.session.commit()
+    for table in (Artist.__table__, MusicArtist.__table__, Music.__table__):
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    # 关联艺术家时会更新 `music` 表，搜索索引只需要在歌曲名和艺术家变化时更新
+    search.ensure_schema()
+    for statement in CREATE_STATEMENTS:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def _artist_ids(keys):
+    """规范化的名字 -> 艺术家的 `index`"""
+    found = {}
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        found.update(
+            db.session.query(Artist.name_key, Artist.index).filter(
+                Artist.name_key.in_(keys[start:start + 500])
+            )
+        )
+    return found
+
+
+def link_songs(rows, cache=None):
+    """
+    为歌曲关联艺术家（不存在的艺术家会被创建），不提交事务。\n
+    `rows`: `(Music.index, Music.artist)` \n
+    `cache`: 规范化的名字 -> 艺术家的 `index`，批量处理时在多次调用之间共用 \n
+    返回新增的对应关系数量。
+    """
+    cache = {} if cache is None else cache
+    credits = [(index, split_artists(artist)) for index, artist in rows]
+    names = {}
+    for _, artists in credits:
+        for name, key in artists:
+            if key not in cache:
+                names.setdefault(key, name)
+    if names:
+        statement = sqlite_insert(Artist.__table__).on_conflict_do_nothing(
+            index_elements=["name_key"]
+        )
+        db.session.execute(statement, [dict(name=n, name_key=k) for k, n in names.items()])
+        cache.update(_artist_ids(names))
+    links = [
+        dict(music_id=index, artist_id=cache[key], position=position)
+        for index, artists in credits
+        for position, (_, key) in enumerate(artists)
+    ]
+    if not links:
+        return 0
+    statement = sqlite_insert(MusicArtist.__table__).on_conflict_do_nothing()
+    added = db.session.execute(statement, links).rowcount
+    db.session.execute(
+        UPDATE_MUSIC_ARTIST,
+        [
+            dict(music=index, primary=cache[artists[0][1]])
+            for index, artists in credits
+            if artists
+        ],
+    )
+    return added
+
+
+def link_pending(batch_size=10000, after=0):
+    """
+    为 `index` 大于 `after` 且还没有关联艺术家的歌曲关联艺术家，每批一个事务，返回处理的歌曲数。
+    """
+    cache = {}
+    count = 0
+    while True:
+        rows = (
+            db.session.query(Music.index, Music.artist)
+            .filter(Music.artist_id.is_(None), Music.index > after)
+            .order_by(Music.index)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return count
+        link_songs(rows, cache)
+        db.session.commit()
+        count += len(rows)
+        after = rows[-1][0]
+
+
+def credits(music_id):
+    """
+    歌曲的艺术家，按署名的顺序排列。
+    """
+    return (
+        Artist.query.join(MusicArtist, MusicArtist.artist_id == Artist.index)
+        .filter(MusicArtist.music_id == music_id)
+        .order_by(MusicArtist.position)
+        .all()
+    )
+
+
+def songs(artist_id):
+    """
+    艺术家的歌曲（未排序），按 `SONG_ORDER` 分页。
+    """
+    return Music.query.join(MusicArtist, MusicArtist.music_id == Music.index).filter(
+        MusicArtist.artist_id == artist_id
+    )
+
+
+def reconcile(batch_size=10000):
+    """
+    按 `index` 分批重新统计艺术家的歌曲数和收录次数，每批一个事务，然后删除没有歌曲的艺术家。\n
+    返回 `(修正的行数, 删除的艺术家数)`。
+    """
+    ensure_schema()
+    statement = text(
+        """
+        UPDATE artist SET song_count = counts.songs, list_count = counts.lists
+        FROM (
+            SELECT artist."index" AS artist_id,
+            (SELECT count(*) FROM music_artist WHERE artist_id = artist."index") AS songs,
+            (
+                SELECT count(*) FROM music_artist
+                JOIN music_list ON music_list.music_id = music_artist.music_id
+                WHERE music_artist.artist_id = artist."index"
+            ) AS lists
+            FROM artist WHERE artist."index" > :low AND artist."index" <= :high
+        ) AS counts
+        WHERE artist."index" = counts.artist_id
+        AND (artist.song_count, artist.list_count) IS NOT (counts.songs, counts.lists)
+        """
+    )
+    last = db.session.execute(text('SELECT max("index") FROM artist')).scalar() or 0
+    fixed = 0
+    for low in range(0, last, batch_size):
+        fixed += db.session.execute(statement, {"low": low, "high": low + batch_size}).rowcount
+        db.session.commit()
+    removed = db.session.execute(text("DELETE FROM artist WHERE song_count = 0")).rowcount
+    db.session.commit()
+    return fixed, removed
@@ -0,0 +1,277 @@
+"""
+歌曲自动补全。\n
+在内存中为规范化后的 `Music.music_name` 和 `Music.artist`（以及其中从每个词开始的后缀）建立有序的前缀索引：
+所有的键排序后保存在一个列表中，与某个前缀匹配的键是其中连续的一段，用二分查找定位。
+结果按照歌曲的热度（被多少个歌单收录）排序：匹配的键不多时直接在这一段中选出前 k 首，
+匹配的键很多的前缀在建立索引时预先计算好前 `TOP_K` 首。\n
+索引在第一次使用时建立，之后每隔 `AUTOCOMPLETE_SYNC_INTERVAL` 秒按 `index` 增量加入新添加的歌曲，
+每隔 `AUTOCOMPLETE_REFRESH_INTERVAL` 秒在后台重新建立（更新热度，移除已删除的歌曲）。
+每个进程各自维护一份索引。
+"""
+
+import bisect
+import heapq
+import sys
+import threading
+import time
+from array import array
+
+from sqlalchemy import func
+
+from MusicList import app, db
+from MusicList.model import Music, MusicList, normalize_text
+
+app.config.setdefault("AUTOCOMPLETE_SYNC_INTERVAL", 5)
+app.config.setdefault("AUTOCOMPLETE_REFRESH_INTERVAL", 600)
+
+TOP_K = 10
+SCAN_LIMIT = 128  # 匹配的键不超过该数量时直接扫描
+MAX_WORDS = 5  # 每个字段最多为前几个词建立后缀
+KEY_LENGTH = 48  # 键的最大长度，更长的部分不参与匹配
+END = chr(0x10FFFF)  # 大于任何键中的字符，`prefix + END` 是前缀匹配的上界
+
+
+def song_keys(music_name, artist):
+    """
+    一首歌曲的所有键：歌曲名和艺术家规范化后从每个词开始的后缀，例如 `a b` 的键为 `a b` 和 `b`。
+    """
+    keys = set()
+    for value in (music_name, artist):
+        words = normalize_text(value).split(" ")
+        for i in range(min(len(words), MAX_WORDS)):
+            key = " ".join(words[i:])[:KEY_LENGTH]
+            if key:
+                keys.add(key)
+    return keys
+
+
+class PrefixIndex:
+    """
+    前缀索引（线程安全）。\n
+    歌曲按加入的顺序编号（槽位），`keys` 与 `slots` 一一对应并按键排序，
+    `heads` 保存匹配的键超过 `SCAN_LIMIT` 的前缀的前 `TOP_K` 个槽位。
+    """
+
+    def __init__(self, rows, popularity):
+        """
+        `rows`: 按 `index` 升序排列的 `(index, music_name, artist)` \n
+        `popularity`: 歌曲的 `index` -> 热度
+        """
+        self.music_ids = array("q")
+        self.names = []
+        self.artists = []
+        self.popularity = array("q")
+        self.last_index = 0
+        pairs = []
+        for index, music_name, artist in rows:
+            slot = self._append(index, music_name, artist, popularity.get(index, 0))
+            pairs.extend((key, slot) for key in song_keys(music_name, artist))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.slots = array("q", (slot for _, slot in pairs))
+        del pairs
+        self.heads = self._build_heads()
+        self.memory = self._measure()
+        self._lock = threading.Lock()
+
+    def _append(self, index, music_name, artist, popularity):
+        self.music_ids.append(index)
+        self.names.append(music_name)
+        self.artists.append(artist)
+        self.popularity.append(popularity)
+        self.last_index = max(self.last_index, index)
+        return len(self.music_ids) - 1
+
+    def _rank(self, slot):
+        """热度高的在前，热度相同时先添加的在前"""
+        return self.popularity[slot], -self.music_ids[slot]
+
+    def _top(self, lo, hi, k):
+        return heapq.nlargest(k, set(self.slots[lo:hi]), key=self._rank)
+
+    def _build_heads(self):
+        heads = {}
+        keys = self.keys
+        stack = [("", 0, len(keys))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= SCAN_LIMIT:
+                continue
+            if prefix:
+                heads[prefix] = tuple(self._top(lo, hi, TOP_K))
+            # 与前缀相同的键排在最前面，其余的键按下一个字符分组
+            depth = len(prefix)
+            while lo < hi and len(keys[lo]) == depth:
+                lo += 1
+            while lo < hi:
+                child = keys[lo][: depth + 1]
+                end = bisect.bisect_left(keys, child + END, lo, hi)
+                stack.append((child, lo, end))
+                lo = end
+        return heads
+
+    def _measure(self):
+        """估计索引占用的内存（字节）"""
+        size = sum(
+            sys.getsizeof(container)
+            for container in (
+                self.keys,
+                self.slots,
+                self.music_ids,
+                self.names,
+                self.artists,
+                self.popularity,
+                self.heads,
+            )
+        )
+        size += sum(sys.getsizeof(key) for key in self.keys)
+        size += sum(sys.getsizeof(value) for value in self.names)
+        size += sum(sys.getsizeof(value) for value in self.artists)
+        size += sum(sys.getsizeof(p) + sys.getsizeof(t) for p, t in self.heads.items())
+        return size
+
+    def add(self, index, music_name, artist, popularity=0):
+        """
+        加入一首新的歌曲（`index` 必须大于已有的歌曲），返回是否加入。
+        """
+        with self._lock:
+            if index <= self.last_index:
+                return False
+            slot = self._append(index, music_name, artist, popularity)
+            self.memory += 2 * 8 + sys.getsizeof(music_name) + sys.getsizeof(artist)
+            for key in song_keys(music_name, artist):
+                position = bisect.bisect_right(self.keys, key)
+                self.keys.insert(position, key)
+                self.slots.insert(position, slot)
+                self.memory += 2 * 8 + sys.getsizeof(key)
+                # 预先计算的结果中歌曲不足 `TOP_K` 首时补充新的歌曲
+                for length in range(1, len(key) + 1):
+                    head = self.heads.get(key[:length])
+                    if head is not None and len(head) < TOP_K:
+                        self.heads[key[:length]] = tuple(
+                            heapq.nlargest(TOP_K, {*head, slot}, key=self._rank)
+                        )
+            return True
+
+    def search(self, prefix, k=TOP_K):
+        """
+        与 `prefix` 匹配的热度最高的 `k` 首歌曲，每一项为 `(index, music_name, artist, popularity)`。
+        """
+        prefix = normalize_text(prefix)[:KEY_LENGTH]
+        if not prefix:
+            return []
+        with self._lock:
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_left(self.keys, prefix + END, lo)
+            head = self.heads.get(prefix) if hi - lo > SCAN_LIMIT and k <= TOP_K else None
+            slots = head[:k] if head is not None else self._top(lo, hi, k)
+            return [
+                (self.music_ids[s], self.names[s], self.artists[s], self.popularity[s])
+                for s in slots
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "songs": len(self.music_ids),
+                "keys": len(self.keys),
+                "heads": len(self.heads),
+                "memory_bytes": self.memory,
+            }
+
+
+class Autocomplete:
+    """
+    管理当前进程的前缀索引：第一次使用时建立，定期增量同步和在后台重新建立。
+    """
+
+    def __init__(self):
+        self.builds = 0
+        self.build_seconds = 0.0
+        self._index = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._rebuilding = False
+
+    def _build(self):
+        """在当前的应用上下文中读取所有歌曲和热度并建立索引"""
+        start = time.perf_counter()
+        popularity = dict(
+            db.session.query(MusicList.music_id, func.count()).group_by(MusicList.music_id)
+        )
+        rows = (
+            db.session.query(Music.index, Music.music_name, Music.artist)
+            .order_by(Music.index)
+            .yield_per(10000)
+        )
+        index = PrefixIndex(rows, popularity)
+        with self._lock:
+            self.builds += 1
+            self.build_seconds = time.perf_counter() - start
+            self._built_at = self._synced_at = time.monotonic()
+        return index
+
+    def index(self):
+        """当前的索引，还没有建立时立即建立（其他线程等待建立完成）"""
+        if self._index is None:
+            with self._build_lock:
+                if self._index is None:
+                    self._index = self._build()
+        return self._index
+
+    def sync(self):
+        """
+        将新添加的歌曲（`index` 大于索引中最大的 `index`）加入索引，返回加入的数量。
+        还没有建立索引时不做任何事。
+        """
+        index = self._index
+        if index is None:
+            return 0
+        self._synced_at = time.monotonic()
+        rows = (
+            db.session.query(Music.index, Music.music_name, Music.artist)
+            .filter(Music.index > index.last_index)
+            .order_by(Music.index)
+            .all()
+        )
+        return sum(index.add(*row) for row in rows)
+
+    def _rebuild(self):
+        try:
+            with app.app_context():
+                self._index = self._build()
+                self.sync()
+        except Exception:
+            app.logger.exception("重新建立自动补全索引失败")
+        finally:
+            self._rebuilding = False
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._synced_at >= app.config["AUTOCOMPLETE_SYNC_INTERVAL"]:
+            self.sync()
+        if now - self._built_at >= app.config["AUTOCOMPLETE_REFRESH_INTERVAL"]:
+            with self._lock:
+                if self._rebuilding:
+                    return
+                self._rebuilding = True
+            threading.Thread(target=self._rebuild, name="autocomplete-rebuild", daemon=True).start()
+
+    def suggest(self, prefix, k=TOP_K):
+        """
+        与 `prefix` 匹配的热度最高的 `k` 首歌曲，见 `PrefixIndex.search`。
+        """
+        index = self.index()
+        self._refresh()
+        return index.search(prefix, k)
+
+    def stats(self):
+        index = self._index
+        stats = index.stats() if index is not None else {}
+        stats.update(builds=self.builds, build_seconds=self.build_seconds)
+        return stats
+
+
+suggestions = Autocomplete()
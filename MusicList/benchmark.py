@@ -0,0 +1,769 @@
+"""
+性能测试工具。\n
+`seed`: 生成指定规模的测试数据，热门的用户、歌曲、歌单和帖子会被更频繁地引用（Zipf 分布）；\n
+`run_benchmark`: 通过测试客户端请求各个页面，统计响应时间的分位数和 SQL 语句数量，
+并与保存的基准结果进行比较；\n
+`login_benchmark`: 在浏览帖子的同时并发登录，比较不同的密码哈希线程池配置下的登录吞吐量和页面响应时间；\n
+`playlist_check`: 在临时数据库中对很长的歌单进行大量随机移动，检查顺序是否正确以及每次移动更新的记录数；\n
+`autocomplete_benchmark`: 建立自动补全索引，统计建立的耗时、占用的内存和查询的耗时。
+"""
+
+import bisect
+import itertools
+import json
+import math
+import os
+import random
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, func, text
+from sqlalchemy.orm import sessionmaker
+
+from MusicList import app, artists, autocomplete, db, passwords, playlists, trending
+from MusicList.model import (
+    User,
+    Music,
+    List,
+    MusicList,
+    Message,
+    Comment,
+    FavoriteList,
+    FavoriteMessage,
+    Artist,
+    insert_music,
+    music_content_key,
+)
+
+SEED_PASSWORD = "password"
+BENCH_MARK = "[bench]"  # 性能测试中创建的帖子、评论、歌单和歌曲的标记，测试结束后删除
+BENCH_LIST_SIZE = 30  # 测试用歌单中的歌曲数
+
+
+class Zipf:
+    """
+    按照 Zipf 分布从 `items` 中抽样，排在前面的元素更容易被抽到。
+    """
+
+    def __init__(self, items, rng, s=1.1):
+        self.items = list(items)
+        self.rng = rng
+        self.cum_weights = list(
+            itertools.accumulate(1 / (rank ** s) for rank in range(1, len(self.items) + 1))
+        )
+
+    def __call__(self):
+        x = self.rng.random() * self.cum_weights[-1]
+        return self.items[bisect.bisect(self.cum_weights, x)]
+
+
+def _insert(model, rows, batch_size=5000, statement=None):
+    """批量插入，返回插入的行数。`statement` 默认为普通的 `INSERT`"""
+    statement = model.__table__.insert() if statement is None else statement
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            count += db.session.execute(statement, batch).rowcount
+            batch = []
+    if batch:
+        count += db.session.execute(statement, batch).rowcount
+    db.session.commit()
+    return count
+
+
+def _new_indexes(model, count):
+    """返回插入 `count` 行后新记录的 `index`"""
+    last = db.session.query(func.max(model.index)).scalar() or 0
+    return range(last - count + 1, last + 1)
+
+
+def seed(
+    users=200,
+    musics=5000,
+    lists=500,
+    songs_per_list=30,
+    messages=5000,
+    comments=20000,
+    favorite_lists=2000,
+    favorite_messages=10000,
+    random_seed=0,
+):
+    """
+    生成测试数据，返回各表插入的行数。所有生成的用户的密码均为 `SEED_PASSWORD`。
+    """
+    rng = random.Random(random_seed)
+    now = datetime.now()
+    counts = {}
+    # 所有用户共用同一个密码哈希，避免生成数据时大量计算哈希
+    password = User(password="")
+    password.set_password(SEED_PASSWORD)
+    first = (db.session.query(func.max(User.index)).scalar() or 0) + 1
+    counts["user"] = _insert(
+        User,
+        (
+            dict(username=f"user{i}", password=password.password, level=0)
+            for i in range(first, first + users)
+        ),
+    )
+    user_ids = _new_indexes(User, users)
+    pick_user = Zipf(user_ids, rng)
+
+    artist_names = [f"Artist {i}" for i in range(max(1, musics // 10))]
+    pick_artist = Zipf(artist_names, rng)
+
+    # 歌曲的编号从当前最大的 `index` 之后开始，重复生成数据时不会与已有的歌曲重复
+    first = (db.session.query(func.max(Music.index)).scalar() or 0) + 1
+
+    def music_rows():
+        for i in range(first, first + musics):
+            link = f"https://example.com/{i}"
+            artist = pick_artist()
+            # 一部分歌曲由两位艺术家合作
+            if rng.random() < 0.1:
+                artist = f"{artist} & {pick_artist()}"
+            row = dict(music_name=f"Song {i}", artist=artist, link=link)
+            row["content_key"] = music_content_key(**row)
+            yield row
+
+    known_artists = Artist.query.count()
+    counts["music"] = _insert(Music, music_rows(), statement=insert_music())
+    artists.link_pending(after=first - 1)
+    counts["artist"] = Artist.query.count() - known_artists
+    pick_music = Zipf(_new_indexes(Music, counts["music"]), rng)
+
+    list_owners = [pick_user() for _ in range(lists)]
+    counts["list"] = _insert(
+        List,
+        (
+            dict(list_name=f"List {i}", owner=owner, share=int(rng.random() < 0.7))
+            for i, owner in enumerate(list_owners)
+        ),
+    )
+    list_ids = list(_new_indexes(List, lists))
+    owner_lists = {}
+    for list_id, owner in zip(list_ids, list_owners):
+        owner_lists.setdefault(owner, []).append(list_id)
+    pick_list = Zipf(list_ids, rng)
+
+    def music_list_rows():
+        for list_id in list_ids:
+            size = min(counts["music"], max(1, int(rng.expovariate(1 / songs_per_list))))
+            for music_id in {pick_music() for _ in range(size)}:
+                yield dict(list_id=list_id, music_id=music_id)
+
+    counts["music_list"] = _insert(MusicList, music_list_rows())
+
+    message_owners = [pick_user() for _ in range(messages)]
+    message_times = sorted(now - timedelta(days=365 * rng.random()) for _ in range(messages))
+    counts["message"] = _insert(
+        Message,
+        (
+            dict(
+                title=f"Message {i}",
+                text="\n".join(f"Line {j}" for j in range(rng.randint(1, 5))),
+                owner=owner,
+                time=message_time,
+                list_index=rng.choice(owner_lists[owner])
+                if owner in owner_lists and rng.random() < 0.2
+                else 0,
+            )
+            for i, (owner, message_time) in enumerate(zip(message_owners, message_times))
+        ),
+    )
+    message_ids = list(_new_indexes(Message, messages))
+    message_time_by_id = dict(zip(message_ids, message_times))
+    # 热门的帖子是较新的帖子
+    pick_message = Zipf(reversed(message_ids), rng)
+
+    def comment_rows():
+        for i in range(comments):
+            parent = pick_message()
+            parent_time = message_time_by_id[parent]
+            delay = min(now - parent_time, timedelta(days=rng.expovariate(1)))
+            yield dict(
+                text=f"Comment {i}",
+                owner=pick_user(),
+                time=parent_time + delay,
+                parent_massage=parent,
+            )
+
+    counts["comment"] = _insert(Comment, comment_rows())
+
+    list_owner_by_id = dict(zip(list_ids, list_owners))
+    pairs = set()
+    for _ in range(favorite_lists * 3):
+        if len(pairs) >= favorite_lists:
+            break
+        list_id, user_id = pick_list(), rng.choice(user_ids)
+        if list_owner_by_id[list_id] != user_id:
+            pairs.add((list_id, user_id))
+    public = {row[0] for row in db.session.query(List.index).filter(List.share == 1)}
+    counts["favorite_list"] = _insert(
+        FavoriteList,
+        (dict(list_id=l, user_id=u) for l, u in pairs if l in public),
+    )
+
+    pairs = set()
+    for _ in range(favorite_messages * 3):
+        if len(pairs) >= favorite_messages:
+            break
+        pairs.add((pick_message(), rng.choice(user_ids)))
+
+    def like_time(message_id):
+        message_time = message_time_by_id[message_id]
+        return message_time + min(now - message_time, timedelta(days=rng.expovariate(1)))
+
+    counts["favorite_message"] = _insert(
+        FavoriteMessage,
+        (dict(message_id=m, user_id=u, time=like_time(m)) for m, u in pairs),
+    )
+    counts["message_score"] = trending.rebuild(days=365)
+    return counts
+
+
+def percentile(values, p):
+    """返回 `values` 的第 `p` 百分位数（最近秩法）"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _sample_ids():
+    """
+    选择用于测试的数据：拥有歌单最多的用户作为登录用户，以及热门的帖子、歌曲和其他用户的公开歌单。
+    """
+    (owner,) = (
+        db.session.query(List.owner)
+        .group_by(List.owner)
+        .order_by(func.count().desc())
+        .first()
+    )
+    user = User.query.get(owner)
+    own_list = List.query.filter_by(owner=owner).first()
+    other_list = List.query.filter(List.owner != owner, List.share == 1).first()
+    (message,) = (
+        db.session.query(Comment.parent_massage)
+        .group_by(Comment.parent_massage)
+        .order_by(func.count().desc())
+        .first()
+    )
+    (music,) = (
+        db.session.query(MusicList.music_id)
+        .group_by(MusicList.music_id)
+        .order_by(func.count().desc())
+        .first()
+    )
+    music_name = Music.query.get(music).music_name
+    artist = db.session.query(func.max(Artist.index)).filter(Artist.song_count > 0).scalar()
+    free_music = (
+        db.session.query(Music.index)
+        .filter(
+            ~Music.index.in_(
+                db.session.query(MusicList.music_id).filter(
+                    MusicList.list_id == own_list.index
+                )
+            )
+        )
+        .first()[0]
+    )
+    return dict(
+        user=user.index,
+        username=user.username,
+        other=other_list.owner,
+        own_list=own_list.index,
+        other_list=other_list.index,
+        message=message,
+        music=music,
+        keyword=music_name.split()[0],
+        free_music=free_music,
+        artist=Music.query.get(music).artist_id or artist,
+    )
+
+
+def _create_targets(ids, count):
+    """
+    为删除等破坏性的操作预先创建 `count` 个目标（在计时之前创建，不计入统计）：
+    帖子、评论和包含 `BENCH_LIST_SIZE` 首歌曲的歌单，以及一个用于调整顺序、改名和更改私密性的私密歌单。
+    目标的 `index` 以迭代器的形式加入 `ids`。
+    """
+    user, message = ids["user"], ids["message"]
+    now = datetime.now()
+    songs = [
+        row[0]
+        for row in db.session.query(Music.index).order_by(Music.index).limit(BENCH_LIST_SIZE)
+    ]
+    messages = [
+        Message(title=BENCH_MARK, text=BENCH_MARK, owner=user, time=now, list_index=0)
+        for _ in range(count)
+    ]
+    comments = [
+        Comment(text=BENCH_MARK, owner=user, time=now, parent_massage=message)
+        for _ in range(count)
+    ]
+    lists = [List(list_name=f"{BENCH_MARK} {i}", owner=user, share=0) for i in range(count + 1)]
+    db.session.add_all(messages + comments + lists)
+    db.session.flush()
+    for _ in comments:
+        trending.record(message, trending.COMMENT_WEIGHT, now)
+    db.session.execute(
+        MusicList.__table__.insert(),
+        [dict(list_id=l.index, music_id=m) for l in lists for m in songs],
+    )
+    db.session.commit()
+    bench_list = lists.pop().index
+    entries = [
+        row[0]
+        for row in db.session.query(MusicList.index)
+        .filter(MusicList.list_id == bench_list)
+        .order_by(MusicList.position)
+        .limit(2)
+    ]
+    ids.update(
+        messages=iter([m.index for m in messages]),
+        comments=iter([c.index for c in comments]),
+        lists=iter([l.index for l in lists]),
+        bench_list=bench_list,
+        entries=entries,
+    )
+
+
+def _remove_targets(ids):
+    """删除性能测试中创建的记录（包括没有用完的目标），恢复用户名"""
+    user = User.query.get(ids["user"])
+    if user.username != ids["username"]:
+        user.username = ids["username"]
+    comments = Comment.query.filter(Comment.owner == ids["user"], Comment.text == BENCH_MARK)
+    for comment in comments:
+        trending.record(comment.parent_massage, -trending.COMMENT_WEIGHT, comment.time)
+    comments.delete(synchronize_session=False)
+    Message.query.filter(Message.owner == ids["user"], Message.title == BENCH_MARK).delete(
+        synchronize_session=False
+    )
+    List.query.filter(
+        List.owner == ids["user"], List.list_name.like(f"{BENCH_MARK}%")
+    ).delete(synchronize_session=False)
+    Music.query.filter(Music.music_name.like(f"{BENCH_MARK}%")).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def routes(ids):
+    """
+    测试的页面：`(名称, [(方法, 地址, 表单)])`，地址和表单可以是每次请求时调用的函数。\n
+    写操作成对执行（如点赞后取消点赞、改名后改回），删除操作使用 `_create_targets` 预先创建的目标，
+    新建的帖子、评论和歌曲带有 `BENCH_MARK` 标记，测试结束后由 `_remove_targets` 删除，数据保持不变。
+    """
+
+    def get(url):
+        return [("GET", url, None)]
+
+    def post(url, data):
+        return [("POST", url, data)]
+
+    def target(kind, url):
+        return lambda: url.format(next(ids[kind]))
+
+    bulk = dict(list_index=ids["own_list"], music_ids=[ids["free_music"]])
+    bench_list = ids["bench_list"]
+    first, second = ids["entries"]
+    songs = itertools.count()
+    new_song = lambda: dict(music_name=f"{BENCH_MARK} {next(songs)}", artist="Artist 0", link="")
+    login = dict(username=ids["username"], password=SEED_PASSWORD)
+    password = dict(password=SEED_PASSWORD, confirm_password=SEED_PASSWORD)
+
+    return [
+        ("index", get("/")),
+        ("login", get("/login")),
+        ("register", get("/register")),
+        ("user_info", get("/user_info")),
+        ("other_user_info", get(f"/other_user_info/{ids['other']}")),
+        ("search_music", get("/search_music")),
+        ("search_result", get(f"/search_result/{ids['keyword']}")),
+        ("add_music", post(f"/search_result/{ids['keyword']}", new_song)),
+        ("autocomplete", get(f"/autocomplete?q={ids['keyword'][:2]}")),
+        ("music_detail", get(f"/music_detail/{ids['music']}")),
+        ("artist_list", get("/artists")),
+        ("artist_detail", get(f"/artist/{ids['artist']}")),
+        ("music_lists", get("/my_lists")),
+        ("list_detail", get(f"/list_detail/{ids['own_list']}")),
+        ("list_musics", get(f"/list_musics/{ids['own_list']}")),
+        (
+            "rename_list",
+            post(f"/list_detail/{bench_list}", dict(list_index=bench_list, list_name=BENCH_MARK))
+            + post(
+                f"/list_detail/{bench_list}",
+                dict(list_index=bench_list, list_name=f"{BENCH_MARK} list"),
+            ),
+        ),
+        (
+            "move_music",
+            post(f"/move_music/{bench_list}", dict(entry=first, after=second))
+            + post(f"/move_music/{bench_list}", dict(entry=first, before=second)),
+        ),
+        (
+            "move_music_range",
+            post(f"/move_music_range/{bench_list}", dict(first=1, last=1, after=2)) * 2,
+        ),
+        ("change_privacy", get(f"/change_privacy/{bench_list}") * 2),
+        ("delete_list", get(target("lists", "/delete_list/{}"))),
+        ("user_lists", get(f"/user_lists/{ids['other']}")),
+        ("user_list_detail", get(f"/user_list_detail/{ids['other_list']}")),
+        ("favorite_music_lists", get(f"/favorite_music_lists/{ids['user']}")),
+        ("message_list", get("/message_list")),
+        ("hot_message_list", get("/hot_message_list")),
+        ("new_message", get("/new_message")),
+        (
+            "post_message",
+            post("/new_message", dict(title=BENCH_MARK, text=BENCH_MARK, list_index="0")),
+        ),
+        ("delete_message", get(target("messages", "/delete_message/{}"))),
+        ("message_detail", get(f"/message_detail/{ids['message']}")),
+        (
+            "post_comment",
+            post(
+                f"/message_detail/{ids['message']}",
+                dict(message_index=ids["message"], text=BENCH_MARK),
+            ),
+        ),
+        ("delete_comment", get(target("comments", "/delete_comment/{}"))),
+        ("user_message", get(f"/user_message/{ids['user']}")),
+        ("user_comment", get(f"/user_comment/{ids['user']}")),
+        ("favorite_message_list", get(f"/favorite_message_list/{ids['user']}")),
+        ("export", get("/export/messages.jsonl")),
+        ("metrics", get("/metrics")),
+        (
+            "change_username",
+            post("/change_username", dict(username=f"{ids['username']}{BENCH_MARK}"))
+            + post("/change_username", dict(username=ids["username"])),
+        ),
+        ("change_password", post("/change_password", password)),
+        ("logout", get("/logout") + post("/login", login)),
+        (
+            "favorite_message",
+            get(f"/favorite_message/{ids['user']}/{ids['message']}") * 2,
+        ),
+        (
+            "favorite_music_list",
+            get(f"/favorite_music_list/{ids['user']}/{ids['other_list']}") * 2,
+        ),
+        (
+            "add_music_to_list",
+            get(f"/add_music_to_list/{ids['free_music']}/{ids['own_list']}")
+            + get(f"/delete_music_from_list/{ids['free_music']}/{ids['own_list']}"),
+        ),
+        (
+            "bulk_music_list",
+            [
+                ("POST", "/bulk_music_list", dict(bulk, action=action))
+                for action in ("add", "delete")
+            ],
+        ),
+    ]
+
+
+def _open(client, method, url, data):
+    """请求页面，地址和表单为函数时先调用"""
+    url = url() if callable(url) else url
+    data = data() if callable(data) else data
+    return client.open(url, method=method, data=data)
+
+
+def run_benchmark(iterations=20):
+    """
+    对每个页面请求 `iterations` 次（之前先预热一次），返回每个页面的统计信息：
+    响应时间的 `p50`、`p95`、`p99`（毫秒）和每次请求的平均 SQL 语句数 `queries`。
+    """
+    ids = _sample_ids()
+    client = app.test_client()
+    # `/metrics` 需要令牌，没有配置时在测试期间使用临时的令牌
+    previous_token = app.config["METRICS_TOKEN"]
+    token = previous_token or secrets.token_hex(16)
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    response = client.post(
+        "/login", data=dict(username=ids["username"], password=SEED_PASSWORD)
+    )
+    if response.status_code != 302 or "/login" in response.headers.get("Location", ""):
+        raise RuntimeError("无法登录测试用户，请先使用 `flask seed` 生成测试数据")
+    _create_targets(ids, iterations + 1)
+    app.config["METRICS_TOKEN"] = token
+    statements = [0]
+
+    def count_statement(*args):
+        statements[0] += 1
+
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+    results = {}
+    try:
+        for name, requests in routes(ids):
+            for method, url, data in requests:
+                _open(client, method, url, data)
+            latencies = []
+            statements[0] = 0
+            for _ in range(iterations):
+                start = time.perf_counter()
+                for method, url, data in requests:
+                    response = _open(client, method, url, data)
+                    response.get_data()
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[name] = {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "queries": statements[0] / iterations,
+            }
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count_statement)
+        app.config["METRICS_TOKEN"] = previous_token
+        _remove_targets(ids)
+    return results
+
+
+def login_benchmark(workers, login_threads=8, feed_threads=4, logins=20):
+    """
+    `login_threads` 个线程各自登录 `logins` 次，同时 `feed_threads` 个线程不断请求帖子页面。\n
+    `workers` 为密码哈希线程数（`0` 表示在请求线程中计算）。返回登录吞吐量（次/秒）、
+    被拒绝的登录次数和同时期页面响应时间的分位数（毫秒）。
+    """
+    usernames = [
+        row[0]
+        for row in db.session.query(User.username)
+        .filter(User.username.like("user%"))
+        .order_by(User.index)
+        .limit(login_threads)
+    ]
+    if len(usernames) < login_threads:
+        raise RuntimeError("测试用户不足，请先使用 `flask seed` 生成测试数据")
+    ids = _sample_ids()
+    feed_urls = ["/message_list", f"/message_detail/{ids['message']}"]
+    previous = app.config["PASSWORD_HASH_WORKERS"]
+    app.config["PASSWORD_HASH_WORKERS"] = workers
+    try:
+        feed_clients = []
+        for _ in range(feed_threads):
+            client = app.test_client()
+            client.post("/login", data=dict(username=ids["username"], password=SEED_PASSWORD))
+            feed_clients.append(client)
+        pool = passwords.get_pool()
+        rejected_before = pool.stats()["rejected"] if pool else 0
+        stop = threading.Event()
+        latencies = []
+        lock = threading.Lock()
+
+        def browse(client):
+            local = []
+            for url in itertools.cycle(feed_urls):
+                if stop.is_set():
+                    break
+                start = time.perf_counter()
+                client.get(url).get_data()
+                local.append((time.perf_counter() - start) * 1000)
+            with lock:
+                latencies.extend(local)
+
+        def log_in(username):
+            client = app.test_client()
+            for _ in range(logins):
+                client.post("/login", data=dict(username=username, password=SEED_PASSWORD))
+
+        browsers = [threading.Thread(target=browse, args=(c,)) for c in feed_clients]
+        for thread in browsers:
+            thread.start()
+        start = time.perf_counter()
+        login_workers = [threading.Thread(target=log_in, args=(u,)) for u in usernames]
+        for thread in login_workers:
+            thread.start()
+        for thread in login_workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in browsers:
+            thread.join()
+    finally:
+        app.config["PASSWORD_HASH_WORKERS"] = previous
+    total = login_threads * logins
+    return {
+        "workers": workers,
+        "logins": total,
+        "seconds": elapsed,
+        "login_rate": total / elapsed if elapsed else 0.0,
+        "rejected": (pool.stats()["rejected"] if pool else 0) - rejected_before,
+        "feed_requests": len(latencies),
+        "feed_p50": percentile(latencies, 50) if latencies else 0.0,
+        "feed_p95": percentile(latencies, 95) if latencies else 0.0,
+    }
+
+
+def playlist_check(size=50000, operations=2000, rebalance_every=50, seed=0):
+    """
+    在临时数据库中创建一个有 `size` 首歌曲的歌单，随机进行 `operations` 次移动：
+    单首移动到随机位置、整段移动，以及反复移动到同一处以耗尽间隔。
+    同时在内存中按相同的操作维护期望的顺序，定期与数据库中的顺序比较。\n
+    需要重新编号的歌单每 `rebalance_every` 次操作重新编号一次，模拟后台线程的延迟。
+    """
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp()
+    engine = create_engine("sqlite:///" + os.path.join(directory, "playlist.db"))
+    db.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    stats = {
+        "size": size,
+        "moves": 0,
+        "range_moves": 0,
+        "single_row_moves": 0,
+        "rebalances": 0,
+        "scheduled": 0,
+        "checks": 0,
+        "mismatches": 0,
+    }
+    timings = []
+    try:
+        session.execute(User.__table__.insert(), [dict(username="playlist", level=0)])
+        session.execute(List.__table__.insert(), [dict(owner=1, list_name="check", share=0)])
+        session.execute(
+            Music.__table__.insert(),
+            [dict(music_name=f"song {i}", artist="", link="") for i in range(size)],
+        )
+        session.execute(
+            MusicList.__table__.insert(),
+            [dict(list_id=1, music_id=i + 1) for i in range(size)],
+        )
+        session.commit()
+        rows = session.execute(text('SELECT "index" FROM music_list ORDER BY "index"'))
+        order = [row[0] for row in rows]
+        hotspot = order[size // 2]
+        pending = False
+
+        def check():
+            actual = session.execute(
+                text('SELECT "index" FROM music_list WHERE list_id = 1 ORDER BY position, "index"')
+            )
+            stats["checks"] += 1
+            if [row[0] for row in actual] != order:
+                stats["mismatches"] += 1
+
+        for number in range(1, operations + 1):
+            kind = rng.random()
+            if kind < 0.2:
+                # 整段移动
+                length = rng.randint(1, 100)
+                start = rng.randrange(size - length)
+                block = order[start:start + length]
+                rest = order[:start] + order[start + length:]
+                target = rng.randrange(len(rest) + 1)  # 移动到 `rest[target - 1]` 之后
+                after = rest[target - 1] if target else None
+                began = time.perf_counter()
+                _, gap = playlists.move_range(1, block[0], block[-1], after=after, session=session)
+                order[:] = rest[:target] + block + rest[target:]
+                stats["range_moves"] += 1
+            else:
+                entry = rng.choice(order)
+                if kind < 0.5 and entry != hotspot:
+                    after, before = hotspot, None  # 反复移动到同一处
+                elif rng.random() < 0.5:
+                    after, before = rng.choice(order), None
+                else:
+                    after, before = None, rng.choice(order)
+                if entry in (after, before):
+                    continue
+                began = time.perf_counter()
+                updated, gap = playlists.move(1, entry, after=after, before=before, session=session)
+                order.remove(entry)
+                if before is not None:
+                    order.insert(order.index(before), entry)
+                else:
+                    order.insert(order.index(after) + 1 if after else 0, entry)
+                stats["moves"] += 1
+                if updated == 1:
+                    stats["single_row_moves"] += 1
+                else:
+                    stats["rebalances"] += 1
+            session.commit()
+            timings.append((time.perf_counter() - began) * 1000)
+            if gap is not None and gap < playlists.REBALANCE_GAP and not pending:
+                pending = True
+                stats["scheduled"] += 1
+            if pending and number % rebalance_every == 0:
+                playlists.rebalance(1, session)
+                session.commit()
+                pending = False
+            if number % 500 == 0:
+                check()
+        check()
+        stats["p50"] = percentile(timings, 50)
+        stats["p95"] = percentile(timings, 95)
+        stats["max"] = max(timings)
+    finally:
+        session.close()
+        engine.dispose()
+        shutil.rmtree(directory, ignore_errors=True)
+    return stats
+
+
+def autocomplete_benchmark(queries=10000, seed=0):
+    """
+    用当前数据库中的歌曲建立自动补全索引，并用 `queries` 个随机前缀（歌曲名或艺术家的前 1 到 8 个字符）查询，
+    返回索引的规模、建立的耗时、占用的内存和查询耗时的分位数（微秒）。
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    suggestions = autocomplete.Autocomplete()
+    index = suggestions.index()
+    stats = index.stats()
+    stats["build_seconds"] = time.perf_counter() - start
+    if not index.keys:
+        return stats
+    prefixes = []
+    for _ in range(queries):
+        key = index.keys[rng.randrange(len(index.keys))]
+        prefixes.append(key[: rng.randint(1, 8)])
+    timings = []
+    for prefix in prefixes:
+        began = time.perf_counter_ns()
+        index.search(prefix)
+        timings.append((time.perf_counter_ns() - began) / 1000)
+    stats.update(
+        queries=queries,
+        p50=percentile(timings, 50),
+        p99=percentile(timings, 99),
+        max=max(timings),
+    )
+    return stats
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    与基准结果比较，返回退化的页面及原因的列表。\n
+    `p95` 超过基准的 `1 + tolerance` 倍（且至少慢 2 毫秒），或 SQL 语句数增加时视为退化。
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        limit = max(base["p95"] * (1 + tolerance), base["p95"] + 2)
+        if stats["p95"] > limit:
+            regressions.append((name, f"p95 {base['p95']:.2f}ms -> {stats['p95']:.2f}ms"))
+        if stats["queries"] > base["queries"]:
+            regressions.append(
+                (name, f"queries {base['queries']:.1f} -> {stats['queries']:.1f}")
+            )
+    return regressions
+
+
+def load_baseline(path):
+    """读取基准结果"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results, path):
+    """保存基准结果"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
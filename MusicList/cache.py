@@ -0,0 +1,162 @@
+"""
+进程内缓存。\n
+提供带有容量上限（LRU 淘汰）和过期时间的缓存，并统计命中和未命中次数；
+`TaggedCache` 还可以为条目添加标签，按标签批量失效。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存。\n
+    `maxsize`: 最多保存的条目数，超出时淘汰最久未使用的条目 \n
+    `ttl`: 条目的有效时间（秒），为 `None` 时不过期
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        获取缓存的值；不存在或已过期时返回 `default`。
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        保存一个值。
+        """
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key):
+        """
+        删除一个值。
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """
+        清空缓存。
+        """
+        with self._lock:
+            for key in list(self._data):
+                self._discard(key)
+
+    def _store(self, key, value):
+        """保存一个条目并淘汰超出容量的条目，调用时需要持有锁"""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._discard(next(iter(self._data)))
+            self.evictions += 1
+
+    def _discard(self, key):
+        """删除一个条目，调用时需要持有锁"""
+        self._data.pop(key, None)
+
+    def stats(self):
+        """
+        返回缓存的统计信息。
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+class TaggedCache(LRUCache):
+    """
+    可以按标签失效的 LRU 缓存。\n
+    保存值时可以附带若干标签，`invalidate_tag(tag)` 会删除所有带有该标签的条目。\n
+    为了避免保存在失效之前读取到的旧数据，可以在读取数据前记下 `generation`，
+    保存时通过 `since` 传入；期间条目的某个标签被失效过时不会保存，其他标签的失效不受影响。
+    每个标签最后一次失效时的 `generation` 最多记录 `maxsize * 4` 个，更早的记录被淘汰后，
+    `since` 早于被淘汰的记录的保存一律放弃。
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        super().__init__(maxsize, ttl)
+        self.invalidations = 0
+        self.generation = 0  # 每次按标签失效时加一
+        self._tags = {}  # 标签 -> 条目的键
+        self._key_tags = {}  # 条目的键 -> 标签
+        self._invalidated = OrderedDict()  # 标签 -> 最后一次失效时的 `generation`
+        self._floor = 0  # 被淘汰的失效记录中最大的 `generation`
+
+    def _changed_since(self, tags, since):
+        """`since` 之后 `tags` 中是否有标签失效过，调用时需要持有锁"""
+        if since < self._floor:
+            return True
+        return any(self._invalidated.get(tag, 0) > since for tag in tags)
+
+    def set(self, key, value, tags=(), since=None):
+        """
+        保存一个值，并为其添加标签。
+        """
+        tags = frozenset(tags)
+        with self._lock:
+            if since is not None and self._changed_since(tags, since):
+                return
+            self._discard(key)
+            self._key_tags[key] = tags
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._store(key, value)
+
+    def invalidate_tag(self, tag):
+        """
+        删除所有带有 `tag` 标签的条目，返回删除的条目数。
+        """
+        with self._lock:
+            self.generation += 1
+            self._invalidated[tag] = self.generation
+            self._invalidated.move_to_end(tag)
+            while len(self._invalidated) > self.maxsize * 4:
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._discard(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def _discard(self, key):
+        super()._discard(key)
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        stats = super().stats()
+        stats["invalidations"] = self.invalidations
+        return stats
@@ -2,10 +2,33 @@
 命令行相关工具，用于后台管理数据库等操作。
 """
 
+import os
+import re
+import time
+from datetime import timedelta
+
 import click
+from sqlalchemy import inspect
 
-from MusicList import app, db
-from MusicList.model import User
+from MusicList import (
+    app,
+    db,
+    search,
+    schema,
+    database,
+    importer,
+    exporter,
+    benchmark,
+    recommend,
+    trending,
+    slowlog,
+    counters,
+    playlists,
+    artists,
+    archive,
+    maintenance,
+)
+from MusicList.model import User, Artist, Message, Comment
 
 
 @app.cli.command()
@@ -30,3 +53,564 @@ def admin(username, password):
         user.set_password(password)
         db.session.commit()
         click.echo("操作成功。")
+
+
+@app.cli.command("import-music")
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="File format (default: by extension).",
+)
+@click.option("--batch-size", default=10000, help="Rows per transaction.")
+def import_music(paths, file_format, batch_size):
+    """从 CSV 或 JSONL 文件批量导入歌曲"""
+    for path in paths:
+        stats = None
+        errors = importer.RowErrors()
+        rows = importer.read_rows(path, file_format, errors)
+        for stats in importer.import_rows(rows, batch_size):
+            click.echo(
+                f"{path}: 已读取 {stats['read']} 行，新增 {stats['inserted']} 首，"
+                f"{stats['rate']:.0f} 行/秒"
+            )
+        if errors.count:
+            click.echo(f"{path}: 跳过无效的行 {errors.count} 行")
+            for number, reason in errors.samples:
+                click.echo(f"  第 {number} 行：{reason}")
+            if errors.count > len(errors.samples):
+                click.echo(f"  ……（另有 {errors.count - len(errors.samples)} 行）")
+        if stats is None:
+            click.echo(f"{path}: 没有可导入的歌曲")
+            continue
+        skipped = stats["read"] - stats["inserted"]
+        click.echo(
+            f"{path}: 导入完成，新增 {stats['inserted']} 首，跳过重复 {skipped} 首，"
+            f"用时 {stats['seconds']:.2f} 秒"
+        )
+
+
+@app.cli.command("export")
+@click.argument("kinds", nargs=-1, type=click.Choice(exporter.KINDS))
+@click.option("--user", "user_index", type=int, help="Only export this user's data.")
+@click.option(
+    "--format", "file_format", default="jsonl", type=click.Choice(list(exporter.FORMATS))
+)
+@click.option(
+    "--output-dir", default=".", type=click.Path(file_okay=False), help="Output directory."
+)
+def export(kinds, user_index, file_format, output_dir):
+    """流式导出歌单、消息和评论（默认导出全部类型和全部用户）"""
+    os.makedirs(output_dir, exist_ok=True)
+    for kind in kinds or exporter.KINDS:
+        path = os.path.join(output_dir, f"{kind}.{file_format}")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for chunk in exporter.iter_export(kind, file_format, user_index):
+                f.write(chunk)
+        click.echo(f"已导出 {path}")
+
+
+@app.cli.command("rebuild-search")
+def rebuild_search():
+    """重建歌曲搜索索引"""
+    count = search.rebuild_index()
+    click.echo(f"搜索索引重建成功，共 {count} 首歌曲。")
+
+
+@app.cli.command("recommend")
+@click.option("--full", is_flag=True, help="Recompute everything instead of changed items.")
+@click.option("--top-k", default=recommend.TOP_K, help="Recommendations kept per item.")
+@click.option("--batch-size", default=500, help="Items per transaction.")
+def build_recommendations(full, top_k, batch_size):
+    """计算“经常一起收录的歌曲”和“相似的歌单”（默认只更新有变化的部分）"""
+    start = time.perf_counter()
+    stats = recommend.rebuild(full, top_k, batch_size)
+    click.echo(
+        f"已更新 {stats['musics']} 首歌曲（{stats['similar_music']} 条推荐）和 "
+        f"{stats['lists']} 个歌单（{stats['similar_list']} 条推荐），"
+        f"用时 {time.perf_counter() - start:.2f} 秒。"
+    )
+
+
+@app.cli.command("trending-refresh")
+@click.option("--rebuild", is_flag=True, help="Recompute all scores from comments and likes.")
+@click.option("--days", default=30, help="Activity window used by --rebuild.")
+@click.option("--min-score", default=0.01, help="Drop posts whose decayed score is lower.")
+def trending_refresh(rebuild, days, min_score):
+    """删除热度已经衰减的帖子（定期运行）；使用 --rebuild 重新计算所有帖子的热度"""
+    if rebuild:
+        count = trending.rebuild(days)
+        click.echo(f"已重新计算 {count} 个帖子的热度")
+    removed = trending.refresh(min_score)
+    click.echo(f"已移除 {removed} 个热度衰减的帖子")
+
+
+@app.cli.command("reconcile-counters")
+@click.option("--batch-size", default=10000, help="Rows per transaction.")
+def reconcile_counters(batch_size):
+    """重新统计帖子和歌单的点赞、评论、收藏和歌曲数以及艺术家的歌曲数和收录次数，修正不一致的计数"""
+    added = counters.ensure_schema()
+    for column in added:
+        click.echo(f"已添加计数列 {column}")
+    for column, count in counters.reconcile(batch_size).items():
+        click.echo(f"{column}: 修正了 {count} 行")
+    fixed, removed = artists.reconcile(batch_size)
+    click.echo(f"artist: 修正了 {fixed} 行，删除了 {removed} 位没有歌曲的艺术家")
+    click.echo("计数校对完成。")
+
+
+@app.cli.command("migrate-list-positions")
+def migrate_list_positions():
+    """为已有的数据库添加歌单中歌曲的顺序，为还没有位置的记录设置位置"""
+    count = playlists.ensure_schema()
+    click.echo(f"已为 {count} 条歌单记录设置位置")
+
+
+@app.cli.command("migrate-artists")
+@click.option("--batch-size", default=10000, help="Songs per transaction.")
+def migrate_artists(batch_size):
+    """为已有的数据库添加艺术家，拆分已有歌曲的艺术家并统计歌曲数和收录次数"""
+    start = time.perf_counter()
+    artists.ensure_schema()
+    count = artists.link_pending(batch_size)
+    total = Artist.query.count()
+    click.echo(
+        f"已为 {count} 首歌曲关联艺术家，共 {total} 位艺术家，"
+        f"用时 {time.perf_counter() - start:.2f} 秒。"
+    )
+
+
+@app.cli.command("rebalance-lists")
+@click.option("--min-gap", default=playlists.REBALANCE_GAP, help="Renumber lists with a smaller gap.")
+def rebalance_lists(min_gap):
+    """重新编号相邻歌曲间隔过小的歌单"""
+    crowded = playlists.crowded_lists(min_gap)
+    for list_index in crowded:
+        playlists.rebalance(list_index)
+        db.session.commit()
+    click.echo(f"重新编号了 {len(crowded)} 个歌单")
+
+
+@app.cli.command("check-playlists")
+@click.option("--size", default=50000, help="Songs in the test list.")
+@click.option("--operations", default=2000, help="Random moves to perform.")
+@click.option("--seed", "random_seed", default=0, help="Random seed.")
+def check_playlists(size, operations, random_seed):
+    """在临时数据库中对很长的歌单进行随机移动，检查顺序和每次移动更新的记录数"""
+    stats = benchmark.playlist_check(size, operations, seed=random_seed)
+    click.echo(
+        f"歌单 {stats['size']} 首：单首移动 {stats['moves']} 次"
+        f"（{stats['single_row_moves']} 次只更新一条记录，{stats['rebalances']} 次先重新编号），"
+        f"整段移动 {stats['range_moves']} 次，安排后台重新编号 {stats['scheduled']} 次"
+    )
+    click.echo(
+        f"耗时 p50 {stats['p50']:.2f}ms  p95 {stats['p95']:.2f}ms  最长 {stats['max']:.2f}ms"
+    )
+    if stats["mismatches"]:
+        click.echo(f"{stats['checks']} 次检查中有 {stats['mismatches']} 次顺序不一致")
+        raise SystemExit(1)
+    click.echo(f"{stats['checks']} 次检查的顺序均正确。")
+
+
+@app.cli.command("bench-autocomplete")
+@click.option("--queries", default=10000, help="Random prefixes to look up.")
+@click.option("--seed", "random_seed", default=0, help="Random seed.")
+def bench_autocomplete(queries, random_seed):
+    """建立自动补全索引，报告建立的耗时、占用的内存和查询的耗时"""
+    stats = benchmark.autocomplete_benchmark(queries, random_seed)
+    songs = stats["songs"]
+    click.echo(
+        f"{songs} 首歌曲，{stats['keys']} 个键，{stats['heads']} 个预先计算的前缀，"
+        f"建立耗时 {stats['build_seconds']:.2f}s"
+    )
+    memory = stats["memory_bytes"]
+    click.echo(
+        f"占用内存约 {memory / 1024 / 1024:.1f} MiB"
+        f"（每首歌曲 {memory / songs if songs else 0:.0f} 字节）"
+    )
+    if "queries" in stats:
+        click.echo(
+            f"{stats['queries']} 次查询：p50 {stats['p50']:.1f}us  "
+            f"p99 {stats['p99']:.1f}us  最长 {stats['max']:.1f}us"
+        )
+
+
+@app.cli.command("migrate-indexes")
+def migrate_indexes():
+    """为已有的数据库补建索引"""
+    created, removed, skipped = schema.upgrade_indexes()
+    for table, count in removed.items():
+        if count:
+            click.echo(f"{table}: 删除了 {count} 条重复记录")
+    for name in created:
+        click.echo(f"已创建索引 {name}")
+    for name in skipped:
+        click.echo(f"存在重复数据或缺少列，跳过索引 {name}")
+    click.echo("索引迁移完成。")
+
+
+@app.cli.command("dedupe-music")
+@click.option("--batch-size", default=10000, help="Rows per transaction.")
+def dedupe_music(batch_size):
+    """计算歌曲的去重键，合并重复的歌曲并创建唯一索引"""
+    updated = schema.add_music_content_key(batch_size)
+    click.echo(f"已为 {updated} 首歌曲计算去重键")
+    removed = schema.merge_duplicate_music()
+    click.echo(f"已合并 {removed} 首重复的歌曲")
+
+
+@app.cli.command("gc-orphans")
+@click.option("--batch-size", default=10000, help="Rows per transaction.")
+def gc_orphans(batch_size):
+    """分批删除引用了不存在的歌单、歌曲、帖子或用户的记录"""
+    removed = schema.remove_orphans(batch_size)
+    for table, count in removed.items():
+        click.echo(f"{table}: 删除了 {count} 条孤立记录")
+    click.echo("孤立记录清理完成。")
+
+
+@app.cli.command("migrate-foreign-keys")
+def migrate_foreign_keys():
+    """为已有的数据库添加外键约束（先清理孤立记录，再重建缺少外键的数据表）"""
+    removed, rebuilt = schema.upgrade_foreign_keys()
+    for table, count in removed.items():
+        if count:
+            click.echo(f"{table}: 删除了 {count} 条孤立记录")
+    for table in rebuilt:
+        click.echo(f"已重建数据表 {table}")
+    click.echo("外键迁移完成。")
+
+
+@app.cli.command("upgrade-db")
+@click.option("--batch-size", default=10000, help="Rows per transaction.")
+def upgrade_db(batch_size):
+    """按顺序执行所有迁移，把已有的数据库升级到当前的结构（可以重复执行）"""
+    start = time.perf_counter()
+    tables = set(inspect(db.engine).get_table_names())
+    if not tables:
+        db.create_all()
+        click.echo("数据库为空，已创建所有数据表。")
+        return
+    # 搜索索引
+    if search.FTS_TABLE in tables:
+        if search.ensure_schema():
+            click.echo("已使用 trigram 分词重建搜索索引")
+    else:
+        click.echo(f"已建立搜索索引（{search.rebuild_index()} 首歌曲）")
+    # 歌曲去重键和唯一索引
+    updated = schema.add_music_content_key(batch_size)
+    removed = schema.merge_duplicate_music()
+    click.echo(f"已为 {updated} 首歌曲计算去重键，合并了 {removed} 首重复的歌曲")
+    # 外键约束（重建的数据表同时获得模型中新增的列）
+    orphans, rebuilt = schema.upgrade_foreign_keys()
+    for table, count in orphans.items():
+        if count:
+            click.echo(f"{table}: 删除了 {count} 条孤立记录")
+    for table in rebuilt:
+        click.echo(f"已重建数据表 {table}（外键约束）")
+    # 计数列和触发器；上一步重建的数据表中的计数列为 0，因此总是重新统计
+    for column in counters.ensure_schema():
+        click.echo(f"已添加计数列 {column}")
+    fixed = sum(counters.reconcile(batch_size).values())
+    click.echo(f"已重新统计计数，修正了 {fixed} 行")
+    # 歌单中歌曲的顺序，以及推荐结果表和触发器
+    click.echo(f"已为 {playlists.ensure_schema()} 条歌单记录设置位置")
+    # 艺术家
+    artists.ensure_schema()
+    linked = artists.link_pending(batch_size)
+    fixed, removed = artists.reconcile(batch_size)
+    click.echo(f"已为 {linked} 首歌曲关联艺术家，删除了 {removed} 位没有歌曲的艺术家")
+    # 点赞时间和热度
+    trending.ensure_schema()
+    if "message_score" not in tables:
+        click.echo(f"已计算 {trending.rebuild()} 个帖子的热度")
+    # 归档表，以及使用 `AUTOINCREMENT` 的 `message` 和 `comment`
+    for table in archive.ensure_schema():
+        click.echo(f"已重建数据表 {table}（AUTOINCREMENT）")
+    # 最后补建索引，此时所有的列都已存在
+    created, duplicates, skipped = schema.upgrade_indexes()
+    for table, count in duplicates.items():
+        if count:
+            click.echo(f"{table}: 删除了 {count} 条重复记录")
+    for name in created:
+        click.echo(f"已创建索引 {name}")
+    for name in skipped:
+        click.echo(f"存在重复数据或缺少列，跳过索引 {name}")
+    if "similar_music" not in tables:
+        click.echo("推荐结果表是新建的，请运行 `flask recommend` 计算推荐。")
+    missing = schema.missing_schema()
+    if missing:
+        click.echo(f"仍然缺少：{', '.join(missing)}")
+        raise SystemExit(1)
+    click.echo(f"数据库升级完成，用时 {time.perf_counter() - start:.2f} 秒。")
+
+
+@app.cli.command("index-audit")
+def index_audit():
+    """检查页面查询的查询计划，标记仍然需要全表扫描的查询"""
+    flagged = []
+    for name, query in schema.route_queries():
+        plan = schema.explain(query)
+        scans = [detail for detail in plan if schema.is_full_scan(detail)]
+        click.echo(f"{'[SCAN]' if scans else '[OK]  '} {name}")
+        for detail in plan:
+            click.echo(f"        {detail}")
+        if scans:
+            flagged.append(name)
+    if flagged:
+        click.echo(f"共 {len(flagged)} 个查询需要全表扫描：{'，'.join(flagged)}")
+        raise SystemExit(1)
+    click.echo("所有查询均使用了索引。")
+
+
+def parse_age(ctx, param, value):
+    """将 `30d`、`12w`、`1y` 形式的时长（没有单位时为天）转换为 `timedelta`"""
+    match = re.fullmatch(r"\s*(\d+)\s*([dwy]?)\s*", value or "")
+    if match is None:
+        raise click.BadParameter("格式应为数字加单位 d（天）、w（周）或 y（年），例如 365d")
+    days = int(match.group(1)) * {"": 1, "d": 1, "w": 7, "y": 365}[match.group(2)]
+    return timedelta(days=days)
+
+
+@app.cli.command("archive")
+@click.option(
+    "--older-than",
+    required=True,
+    callback=parse_age,
+    help="Archive posts without activity for this long, e.g. 365d, 52w, 1y.",
+)
+@click.option("--batch-size", default=500, help="Posts per transaction.")
+@click.option("--pause", default=0.0, help="Seconds to wait between batches.")
+def archive_messages(older_than, batch_size, pause):
+    """将很久没有动态的帖子及其评论和点赞分批移动到归档表"""
+    stats = archive.archive(older_than, batch_size, pause)
+    click.echo(
+        f"已归档 {stats['messages']} 个帖子、{stats['comments']} 条评论和 "
+        f"{stats['favorites']} 个点赞，用时 {stats['seconds']:.2f} 秒。"
+    )
+    click.echo(f"当前帖子 {Message.query.count()} 个，评论 {Comment.query.count()} 条。")
+
+
+@app.cli.command("slow-queries")
+@click.option("--limit", default=20, help="Number of statements to show.")
+@click.option("--raw", is_flag=True, help="Print every recorded query instead of a summary.")
+@click.option("--clear", is_flag=True, help="Delete the recorded queries.")
+def slow_queries(limit, raw, clear):
+    """显示记录的慢查询及其查询计划，标记需要全表扫描的语句"""
+    if clear:
+        count = slowlog.clear_entries()
+        click.echo(f"已删除 {count} 个慢查询日志文件。")
+        return
+    entries = slowlog.load_entries()
+    if not entries:
+        click.echo("没有记录到慢查询。")
+        return
+    if raw:
+        for entry in entries[-limit:]:
+            click.echo(
+                f"{entry['time']} {entry['seconds'] * 1000:.1f}ms {entry['route'] or '-'}"
+            )
+            click.echo(f"    {' '.join(entry['statement'].split())}")
+            click.echo(f"    参数：{entry['parameters']}")
+            for detail in entry["plan"]:
+                click.echo(f"        {detail}")
+        return
+    for group in slowlog.summarize(entries)[:limit]:
+        scans = any(schema.is_full_scan(detail) for detail in group["plan"])
+        click.echo(
+            f"{'[SCAN]' if scans else '[OK]  '} {group['count']} 次  "
+            f"共 {group['total'] * 1000:.1f}ms  最长 {group['max'] * 1000:.1f}ms  "
+            f"{', '.join(sorted(group['routes']))}"
+        )
+        click.echo(f"        {' '.join(group['statement'].split())}")
+        for detail in group["plan"]:
+            click.echo(f"            {detail}")
+
+
+@app.cli.command("db-stress")
+@click.option("--threads", default=8, help="Number of concurrent workers.")
+@click.option("--operations", default=200, help="Operations per worker.")
+@click.option("--write-ratio", default=0.3, help="Fraction of operations that write.")
+@click.option("--retries", default=5, help="Retries on 'database is locked' (every profile).")
+def db_stress(threads, operations, write_ratio, retries):
+    """比较不同数据库引擎配置在并发读写下的吞吐量（使用相同的重试策略）"""
+    results = {}
+    for profile in database.PROFILES:
+        stats = database.stress_test(profile, threads, operations, write_ratio, retries)
+        results[profile] = stats
+        click.echo(
+            f"{profile:<12} {stats['throughput']:>10.1f} ops/s  失败 {stats['errors']}  "
+            f"读 {stats['reads']}  写 {stats['writes']}  重试 {stats['retries']}  "
+            f"用时 {stats['seconds']:.2f}s"
+        )
+    baseline = results["default"]["throughput"]
+    if baseline:
+        ratio = results["production"]["throughput"] / baseline
+        click.echo(
+            f"production / default = {ratio:.2f}x"
+            f"（失败 {results['production']['errors']} / {results['default']['errors']}）"
+        )
+
+
+@app.cli.command()
+@click.option("--users", default=200, help="Number of users.")
+@click.option("--musics", default=5000, help="Number of songs.")
+@click.option("--lists", default=500, help="Number of lists.")
+@click.option("--songs-per-list", default=30, help="Average songs per list.")
+@click.option("--messages", default=5000, help="Number of messages.")
+@click.option("--comments", default=20000, help="Number of comments.")
+@click.option("--favorite-lists", default=2000, help="Number of favorited lists.")
+@click.option("--favorite-messages", default=10000, help="Number of liked messages.")
+@click.option("--random-seed", default=0, help="Seed for the random generator.")
+def seed(**options):
+    """生成测试数据（所有测试用户的密码为 password）"""
+    start = time.perf_counter()
+    counts = benchmark.seed(**options)
+    for table, count in counts.items():
+        click.echo(f"{table}: {count}")
+    click.echo(f"测试数据生成完成，用时 {time.perf_counter() - start:.2f} 秒。")
+
+
+@app.cli.command()
+@click.option("--iterations", default=20, help="Requests per route.")
+@click.option("--baseline", default="benchmark_baseline.json", help="Baseline file.")
+@click.option("--save-baseline", is_flag=True, help="Save the results as the new baseline.")
+@click.option("--tolerance", default=0.25, help="Allowed p95 slowdown before failing.")
+def bench(iterations, baseline, save_baseline, tolerance):
+    """测试各个页面的响应时间和 SQL 语句数，并与基准结果比较"""
+    results = benchmark.run_benchmark(iterations)
+    click.echo(f"{'route':<24}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}")
+    for name, stats in results.items():
+        click.echo(
+            f"{name:<24}{stats['p50']:>9.2f}{stats['p95']:>9.2f}"
+            f"{stats['p99']:>9.2f}{stats['queries']:>9.1f}"
+        )
+    if save_baseline:
+        benchmark.save_baseline(results, baseline)
+        click.echo(f"基准结果已保存到 {baseline}")
+        return
+    if not os.path.exists(baseline):
+        click.echo(f"没有找到基准结果 {baseline}，使用 --save-baseline 保存。")
+        return
+    regressions = benchmark.compare(results, benchmark.load_baseline(baseline), tolerance)
+    for name, reason in regressions:
+        click.echo(f"[退化] {name}: {reason}")
+    if regressions:
+        raise SystemExit(1)
+    click.echo("与基准结果相比没有退化。")
+
+
+@app.cli.command("bench-login")
+@click.option(
+    "--workers",
+    multiple=True,
+    type=int,
+    help="Password hashing threads to compare (0 hashes in the request thread).",
+)
+@click.option("--threads", default=8, help="Concurrent login threads.")
+@click.option("--feed-threads", default=4, help="Concurrent threads browsing messages.")
+@click.option("--logins", default=20, help="Logins per thread.")
+def bench_login(workers, threads, feed_threads, logins):
+    """测试并发登录时的登录吞吐量和浏览帖子的响应时间"""
+    for count in workers or (0, app.config["PASSWORD_HASH_WORKERS"]):
+        stats = benchmark.login_benchmark(count, threads, feed_threads, logins)
+        click.echo(
+            f"workers={stats['workers']:<3} 登录 {stats['login_rate']:>7.1f} 次/秒  "
+            f"拒绝 {stats['rejected']}  "
+            f"页面 p50 {stats['feed_p50']:.2f}ms  p95 {stats['feed_p95']:.2f}ms  "
+            f"({stats['feed_requests']} 次请求)"
+        )
+
+
+def format_size(size):
+    """以 MiB 表示文件大小"""
+    return f"{size / 1024 / 1024:.2f} MiB"
+
+
+def echo_size_change(before, after):
+    click.echo(
+        f"文件大小 {format_size(before)} -> {format_size(after)}"
+        f"（{(after - before) / 1024 / 1024:+.2f} MiB）"
+    )
+
+
+@app.cli.command("backup")
+@click.argument("path", required=False, type=click.Path(dir_okay=False))
+@click.option("--pages", default=maintenance.BACKUP_PAGES, help="Pages copied per step.")
+@click.option("--sleep", default=maintenance.BACKUP_SLEEP, help="Seconds to wait between steps.")
+@click.option("--verify", is_flag=True, help="Run quick_check on the backup.")
+def backup(path, pages, sleep, verify):
+    """在线备份数据库（默认保存到数据库所在目录的 backups/ 中），备份期间应用可以继续读写"""
+    reported = [0]
+
+    def progress(remaining, total):
+        # 每复制约 10% 输出一次进度
+        done = (total - remaining) * 10 // max(total, 1)
+        if done > reported[0]:
+            reported[0] = done
+            click.echo(f"已复制 {total - remaining}/{total} 页")
+
+    stats = maintenance.backup(path, pages, sleep, verify, progress)
+    click.echo(
+        f"已备份到 {stats['path']}：{stats['pages']} 页，{stats['steps']} 步，"
+        f"用时 {stats['seconds']:.2f} 秒。"
+    )
+    if stats["snapshot"]:
+        click.echo("WAL 模式：备份的是开始时的快照，期间的写入不受影响。")
+    elif stats["restarts"]:
+        click.echo(f"备份期间数据库被修改，重新开始了 {stats['restarts']} 次。")
+    click.echo(
+        f"数据库 {format_size(stats['source_bytes'])}，备份 {format_size(stats['backup_bytes'])}"
+    )
+    if verify:
+        click.echo(f"备份检查：{stats['check']}")
+        if stats["check"] != "ok":
+            raise SystemExit(1)
+
+
+@app.cli.command("analyze")
+@click.option("--limit", type=int, help="Approximate rows sampled per index (analysis_limit).")
+def analyze(limit):
+    """更新查询优化器使用的统计信息（ANALYZE）"""
+    stats = maintenance.analyze(limit)
+    click.echo(f"已更新 {stats['tables']} 个表的统计信息，用时 {stats['seconds']:.2f} 秒。")
+    echo_size_change(stats["before_bytes"], stats["after_bytes"])
+
+
+@app.cli.command("vacuum")
+@click.option("--pages", default=maintenance.VACUUM_PAGES, help="Pages freed per transaction.")
+@click.option("--max-pages", type=int, help="Stop after freeing this many pages.")
+@click.option("--full", is_flag=True, help="Rebuild the whole database with VACUUM.")
+@click.option("--pause", default=0.0, help="Seconds to wait between transactions.")
+def vacuum(pages, max_pages, full, pause):
+    """释放空闲页、缩小数据库文件；第一次运行时切换为 auto_vacuum = INCREMENTAL（需要完整的 VACUUM）"""
+    stats = maintenance.vacuum(pages, max_pages, full, pause)
+    if stats["full"]:
+        click.echo(f"已执行完整的 VACUUM（原 auto_vacuum = {stats['mode']}）")
+    click.echo(
+        f"释放了 {stats['freed']} 页，剩余空闲页 {stats['free_pages']}，"
+        f"用时 {stats['seconds']:.2f} 秒。"
+    )
+    echo_size_change(stats["before_bytes"], stats["after_bytes"])
+
+
+@app.cli.command("integrity-check")
+@click.option("--quick", is_flag=True, help="Use quick_check (skips index consistency).")
+@click.option("--max-errors", default=100, help="Maximum problems to report.")
+def integrity_check(quick, max_errors):
+    """检查数据库的完整性和外键约束"""
+    stats = maintenance.integrity_check(quick, max_errors)
+    click.echo(f"检查用时 {stats['seconds']:.2f} 秒，数据库 {format_size(stats['bytes'])}。")
+    for error in stats["errors"]:
+        click.echo(f"    {error}")
+    for table, rowid, parent in stats["foreign_keys"]:
+        click.echo(f"    {table} 第 {rowid} 行引用了 {parent} 中不存在的记录")
+    if not stats["ok"]:
+        click.echo(
+            f"发现 {len(stats['errors'])} 个完整性问题和 {len(stats['foreign_keys'])} 个外键问题。"
+        )
+        raise SystemExit(1)
+    click.echo("数据库完整性检查通过。")
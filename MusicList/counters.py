@@ -0,0 +1,97 @@
+"""
+冗余计数。\n
+`Message.like_count`、`Message.comment_count`、`List.favorite_count` 和 `List.music_count`
+由关联表上的触发器在同一个事务中增减，页面直接读取，不需要对每一行执行 `COUNT` 子查询。
+批量插入、级联删除等不经过视图函数的写操作同样会更新计数。\n
+`reconcile` 分批重新统计，修正不一致的计数（例如在添加触发器之前的数据）。
+"""
+
+from sqlalchemy import DDL, event, inspect, text
+
+from MusicList import db
+
+# (被计数的表, 计数列, 关联表, 关联表中指向被计数的表的列)
+COUNTERS = [
+    ("message", "like_count", "favorite_message", "message_id"),
+    ("message", "comment_count", "comment", "parent_massage"),
+    ("list", "favorite_count", "favorite_list", "list_id"),
+    ("list", "music_count", "music_list", "list_id"),
+]
+
+
+def _trigger_statements(table, column, child, key):
+    prefix = f"{child}_{column}"
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_insert AFTER INSERT ON {child} BEGIN
+            UPDATE {table} SET {column} = {column} + 1 WHERE "index" = new.{key};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_delete AFTER DELETE ON {child} BEGIN
+            UPDATE {table} SET {column} = {column} - 1 WHERE "index" = old.{key};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_update AFTER UPDATE OF {key} ON {child}
+        WHEN old.{key} IS NOT new.{key} BEGIN
+            UPDATE {table} SET {column} = {column} - 1 WHERE "index" = old.{key};
+            UPDATE {table} SET {column} = {column} + 1 WHERE "index" = new.{key};
+        END
+        """,
+    ]
+
+
+def _drop_statements(column, child):
+    prefix = f"{child}_{column}"
+    return [f"DROP TRIGGER IF EXISTS {prefix}_{action}" for action in ("insert", "delete", "update")]
+
+
+# `db.create_all()` 和 `db.drop_all()` 时自动创建和删除触发器
+for table, column, child, key in COUNTERS:
+    for statement in _trigger_statements(table, column, child, key):
+        event.listen(db.metadata.tables[child], "after_create", DDL(statement))
+    for statement in _drop_statements(column, child):
+        event.listen(db.metadata.tables[child], "before_drop", DDL(statement))
+
+
+def ensure_schema():
+    """
+    为已有的数据库添加计数列和触发器，返回新添加的列。
+    """
+    inspector = inspect(db.engine)
+    added = []
+    for table, column, child, key in COUNTERS:
+        columns = {c["name"] for c in inspector.get_columns(table)}
+        if column not in columns:
+            db.session.execute(
+                text(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            )
+            added.append(f"{table}.{column}")
+        for statement in _trigger_statements(table, column, child, key):
+            db.session.execute(text(statement))
+    db.session.commit()
+    return added
+
+
+def reconcile(batch_size=10000):
+    """
+    按 `index` 分批重新统计所有计数，每批一个事务，返回各计数修正的行数。
+    """
+    ensure_schema()
+    fixed = {}
+    for table, column, child, key in COUNTERS:
+        actual = f'(SELECT count(*) FROM {child} WHERE {child}.{key} = {table}."index")'
+        statement = text(
+            f"""
+            UPDATE {table} SET {column} = {actual}
+            WHERE "index" > :low AND "index" <= :high AND {column} IS NOT {actual}
+            """
+        )
+        last = db.session.execute(text(f'SELECT max("index") FROM {table}')).scalar() or 0
+        fixed[f"{table}.{column}"] = 0
+        for low in range(0, last, batch_size):
+            result = db.session.execute(statement, {"low": low, "high": low + batch_size})
+            db.session.commit()
+            fixed[f"{table}.{column}"] += result.rowcount
+    return fixed
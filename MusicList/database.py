@@ -0,0 +1,252 @@
+"""
+数据库引擎配置。\n
+通过配置项 `DATABASE_PROFILE`（或环境变量 `DATABASE_PROFILE`）选择引擎配置：\n
+`default`: SQLAlchemy 的默认设置（只开启外键约束），每次请求新建连接；\n
+`production`: 开启 WAL 日志模式，连接时设置 `synchronous`、`cache_size`、`mmap_size` 和
+`busy_timeout` 等参数，并使用连接池。\n
+连接时还会注册 `SQL_FUNCTIONS` 中的自定义 SQL 函数。\n
+另外提供了在数据库被锁定时进行退避重试的装饰器，以及比较两种配置的并发压力测试。
+"""
+
+import functools
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app, session as flask_session
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+PROFILES = {
+    "default": {
+        "pragmas": {"foreign_keys": "ON"},
+        "engine_options": {},
+    },
+    "production": {
+        # 按顺序执行，`busy_timeout` 需要最先设置，切换日志模式时才会等待其他连接
+        "pragmas": {
+            "busy_timeout": 5000,
+            "foreign_keys": "ON",
+            # 只对新建的数据库生效，已有的数据库由 `flask vacuum` 切换（见 `MusicList.maintenance`）
+            "auto_vacuum": "INCREMENTAL",
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",  # WAL 模式下只在检查点时同步，断电不会损坏数据库
+            "cache_size": -32000,  # 负数表示 KiB，即每个连接 32 MiB 页缓存
+            "mmap_size": 256 * 1024 * 1024,
+            "temp_store": "MEMORY",
+        },
+        "engine_options": {
+            # WAL 模式下读操作可以并发，连接池大小与工作线程数相当即可
+            "poolclass": QueuePool,
+            "pool_size": min(32, (os.cpu_count() or 1) * 2),
+            "max_overflow": 8,
+            "pool_timeout": 30,
+            "connect_args": {"check_same_thread": False, "timeout": 5},
+        },
+    },
+}
+
+
+def logaddexp(a, b):
+    """`log(exp(a) + exp(b))`，用于在对数空间中累加；任一参数为 `NULL` 时返回另一个"""
+    if a is None or b is None:
+        return b if a is None else a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def logsubexp(a, b):
+    """`log(exp(a) - exp(b))`，结果不为正数时返回 `NULL`"""
+    if a is None or b is None:
+        return a
+    if b >= a:
+        return None
+    return a + math.log1p(-math.exp(b - a))
+
+
+# 连接时注册的 SQL 函数：名称 -> (参数个数, 函数)
+SQL_FUNCTIONS = {
+    "logaddexp": (2, logaddexp),
+    "logsubexp": (2, logsubexp),
+}
+
+
+def configure(app):
+    """
+    根据 `DATABASE_PROFILE` 填充数据库相关的配置项（已经设置的配置项不会被覆盖）。
+    """
+    profile = PROFILES[app.config.setdefault("DATABASE_PROFILE", "default")]
+    app.config.setdefault("SQLITE_PRAGMAS", dict(profile["pragmas"]))
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", dict(profile["engine_options"]))
+    app.config.setdefault("SQLITE_LOCK_RETRIES", 5)
+    app.config.setdefault("SQLITE_LOCK_BACKOFF", 0.05)
+
+
+def install_pragmas(engine, pragmas):
+    """
+    在 `engine` 每次新建连接时执行 `PRAGMA` 语句。
+    """
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f"PRAGMA {key} = {value}")
+        cursor.close()
+
+
+def install_functions(engine, functions=SQL_FUNCTIONS):
+    """
+    在 `engine` 每次新建连接时注册自定义 SQL 函数。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def create_functions(dbapi_connection, connection_record):
+        for name, (arity, function) in functions.items():
+            dbapi_connection.create_function(name, arity, function, deterministic=True)
+
+
+class Database(SQLAlchemy):
+    """
+    在创建引擎时加入配置项 `SQLITE_PRAGMAS` 中的参数，并注册自定义 SQL 函数。\n
+    `engine_hooks` 中的函数会在引擎创建后以引擎为参数调用，用于注册事件等。
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.engine_hooks = []
+        super().__init__(*args, **kwargs)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        install_pragmas(engine, self.get_app().config.get("SQLITE_PRAGMAS"))
+        install_functions(engine)
+        for hook in self.engine_hooks:
+            hook(engine)
+        return engine
+
+
+def is_locked_error(error):
+    """
+    判断是否为数据库被锁定的错误。
+    """
+    return isinstance(error, OperationalError) and "locked" in str(error.orig)
+
+
+def backoff_delays(retries, base):
+    """
+    指数退避的等待时间（加入随机抖动，避免多个请求同时重试）。
+    """
+    for attempt in range(retries):
+        yield base * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def retry_on_locked(func):
+    """
+    视图函数装饰器：数据库被锁定时回滚并重新执行整个视图函数。\n
+    重试前会恢复本次请求中已经添加的提示信息，避免重复显示。
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from MusicList import db
+
+        flashes = list(flask_session.get("_flashes", []))
+        delays = backoff_delays(
+            current_app.config["SQLITE_LOCK_RETRIES"],
+            current_app.config["SQLITE_LOCK_BACKOFF"],
+        )
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                delay = next(delays, None)
+                if not is_locked_error(e) or delay is None:
+                    raise
+                current_app.logger.warning("数据库被锁定，%.3f 秒后重试：%s", delay, func.__name__)
+                flask_session["_flashes"] = list(flashes)
+                time.sleep(delay)
+
+    return wrapper
+
+
+def stress_test(profile, threads=8, operations=200, write_ratio=0.3, retries=5):
+    """
+    在临时数据库上模拟并发请求：每个操作使用一个新的会话，写操作发帖，读操作获取最新的 30 条帖子。\n
+    数据库被锁定时最多重试 `retries` 次（所有配置使用相同的重试策略，结果才能比较），仍然失败的操作计入 `errors`，
+    不计入吞吐量。\n
+    返回吞吐量和错误数等统计信息。
+    """
+    from MusicList import db
+    from MusicList.model import Message
+
+    options = PROFILES[profile]
+    directory = tempfile.mkdtemp()
+    engine = create_engine(
+        "sqlite:///" + os.path.join(directory, "stress.db"), **options["engine_options"]
+    )
+    install_pragmas(engine, options["pragmas"])
+    db.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    lock = threading.Lock()
+    stats = {"reads": 0, "writes": 0, "retries": 0, "errors": 0}
+
+    def write(session, worker):
+        message = Message(title="stress", text="", owner=worker, time=datetime.now())
+        session.add(message)
+        session.commit()
+
+    def read(session, worker):
+        query = session.query(Message.index, Message.title)
+        query.order_by(Message.time.desc()).limit(30).all()
+        session.commit()
+
+    def run(worker):
+        rng = random.Random(worker)
+        counts = {"reads": 0, "writes": 0, "retries": 0, "errors": 0}
+        for _ in range(operations):
+            is_write = rng.random() < write_ratio
+            operation = write if is_write else read
+            delays = backoff_delays(retries, 0.01)
+            while True:
+                session = Session()
+                try:
+                    operation(session, worker)
+                    counts["writes" if is_write else "reads"] += 1
+                    break
+                except OperationalError as e:
+                    session.rollback()
+                    delay = next(delays, None)
+                    if not is_locked_error(e) or delay is None:
+                        counts["errors"] += 1
+                        break
+                    counts["retries"] += 1
+                    time.sleep(delay)
+                finally:
+                    session.close()
+        with lock:
+            for key, value in counts.items():
+                stats[key] += value
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(run, range(threads)))
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+    done = stats["reads"] + stats["writes"]
+    stats.update(seconds=elapsed, throughput=done / elapsed if elapsed else 0.0)
+    return stats
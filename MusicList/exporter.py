@@ -0,0 +1,120 @@
+"""
+流式导出歌单、消息和评论。\n
+查询结果通过 `yield_per` 分批从数据库中读取，再逐行转换为 CSV 或 JSONL，
+导出的数据量再大也不会一次性载入内存。消息和评论包括已归档的部分。
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from MusicList import db
+from MusicList.model import (
+    User,
+    Music,
+    List,
+    MusicList,
+    Message,
+    Comment,
+    MessageArchive,
+    CommentArchive,
+)
+
+KINDS = ("lists", "messages", "comments")
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def export_query(kind, user_index=None):
+    """
+    返回导出 `kind` 所使用的查询；`user_index` 为 `None` 时导出所有用户的数据。
+    """
+    if kind == "lists":
+        query = (
+            db.session.query(
+                List.index.label("list_index"),
+                List.list_name,
+                List.share,
+                List.owner,
+                Music.index.label("music_index"),
+                Music.music_name,
+                Music.artist,
+                Music.link,
+            )
+            .outerjoin(MusicList, MusicList.list_id == List.index)
+            .outerjoin(Music, Music.index == MusicList.music_id)
+            .order_by(List.index, MusicList.position, MusicList.index)
+        )
+        owner = List.owner
+    elif kind == "messages":
+
+        def select(model):
+            return db.session.query(
+                model.index,
+                model.title,
+                model.text,
+                model.owner,
+                User.username,
+                model.time,
+                model.list_index,
+            ).join(User, User.index == model.owner)
+
+        return _with_archive(select, (Message, MessageArchive), user_index)
+    elif kind == "comments":
+
+        def select(model):
+            return db.session.query(
+                model.index,
+                model.text,
+                model.owner,
+                model.time,
+                model.parent_massage,
+            )
+
+        return _with_archive(select, (Comment, CommentArchive), user_index)
+    else:
+        raise ValueError(f"unknown export kind: {kind}")
+    if user_index is not None:
+        query = query.filter(owner == user_index)
+    return query
+
+
+def _with_archive(select, models, user_index):
+    """合并 `(原表, 归档表)` 的查询（由 `select` 生成），按 `index` 排序"""
+    parts = []
+    for model in models:
+        query = select(model)
+        if user_index is not None:
+            query = query.filter(model.owner == user_index)
+        parts.append(query)
+    return parts[0].union_all(parts[1]).order_by(models[0].index)
+
+
+def _to_text(value):
+    """将日期转换为 ISO 格式的字符串，其他值不变"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_export(kind, file_format, user_index=None, batch_size=1000):
+    """
+    逐行生成导出的内容（字符串）。CSV 格式的第一行为表头。
+    """
+    query = export_query(kind, user_index)
+    columns = [column["name"] for column in query.column_descriptions]
+    rows = query.yield_per(batch_size)
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([_to_text(value) for value in row])
+        yield buffer.getvalue()
+    elif file_format == "jsonl":
+        for row in rows:
+            record = {key: _to_text(value) for key, value in zip(columns, row)}
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+    else:
+        raise ValueError(f"unknown export format: {file_format}")
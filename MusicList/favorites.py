@@ -0,0 +1,258 @@
+"""
+点赞和收藏的延迟写入。\n
+点赞帖子、收藏歌单时只在内存中记录用户想要的状态（同一用户对同一目标的多次操作会合并），
+由后台线程每隔 `FAVORITE_FLUSH_INTERVAL` 秒（或积累 `FAVORITE_FLUSH_SIZE` 个操作时）
+在一个事务中批量写入 `FavoriteMessage` 和 `FavoriteList`，避免大量很小的写事务争抢 SQLite 的写锁。
+读取状态时先查看尚未写入的操作，用户可以立即看到自己操作的结果。\n
+进程正常退出（包括收到 `SIGTERM`）时会写入剩余的操作。`FAVORITE_WRITE_BEHIND` 为假时在请求中立即写入。
+"""
+
+import atexit
+import signal
+import sys
+import threading
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from MusicList import app, db, fragments, trending
+from MusicList.database import is_locked_error
+from MusicList.model import FavoriteList, FavoriteMessage
+
+app.config.setdefault("FAVORITE_WRITE_BEHIND", True)
+app.config.setdefault("FAVORITE_FLUSH_INTERVAL", 0.5)
+app.config.setdefault("FAVORITE_FLUSH_SIZE", 500)
+
+# 种类 -> (模型, 目标列)
+KINDS = {
+    "message": (FavoriteMessage, "message_id"),
+    "list": (FavoriteList, "list_id"),
+}
+
+# 写入前再次检查目标是否存在（公开歌单且不是自己的歌单），期间被删除的目标会被忽略
+INSERT_STATEMENTS = {
+    "message": text(
+        """
+        INSERT OR IGNORE INTO favorite_message (message_id, user_id, time)
+        SELECT :target, :user, :time
+        WHERE EXISTS (SELECT 1 FROM message WHERE "index" = :target)
+        AND EXISTS (SELECT 1 FROM user WHERE "index" = :user)
+        """
+    ),
+    "list": text(
+        """
+        INSERT OR IGNORE INTO favorite_list (list_id, user_id)
+        SELECT :target, :user
+        WHERE EXISTS (
+            SELECT 1 FROM list WHERE "index" = :target AND share = 1 AND owner != :user
+        )
+        AND EXISTS (SELECT 1 FROM user WHERE "index" = :user)
+        """
+    ),
+}
+
+DELETE_STATEMENTS = {
+    "message": text("DELETE FROM favorite_message WHERE message_id = :target AND user_id = :user"),
+    "list": text("DELETE FROM favorite_list WHERE list_id = :target AND user_id = :user"),
+}
+
+
+class FavoriteBuffer:
+    """
+    合并点赞和收藏操作的缓冲区（线程安全）。\n
+    键为 `(种类, 用户, 目标)`，值为 `(想要的状态, 数据库中原来的状态)`；两者相同时操作被抵消。
+    """
+
+    def __init__(self):
+        self.flushed = 0
+        self.coalesced = 0
+        self._pending = {}
+        self._flushing = {}  # 正在写入的操作，写入完成前读取状态时仍需要参考
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _stored_state(self, kind, user, target):
+        model, column = KINDS[kind]
+        query = model.query.filter(getattr(model, column) == target, model.user_id == user)
+        return db.session.query(query.exists()).scalar()
+
+    def is_favorite(self, kind, user, target):
+        """
+        用户是否点赞（收藏）了目标，包括尚未写入的操作。
+        """
+        key = (kind, user, target)
+        with self._lock:
+            entry = self._pending.get(key) or self._flushing.get(key)
+        if entry is not None:
+            return entry[0]
+        return self._stored_state(kind, user, target)
+
+    def set(self, kind, user, target, value):
+        """
+        记录用户想要的状态。未启用延迟写入时立即写入。
+        """
+        key = (kind, user, target)
+        with self._lock:
+            if key in self._pending:
+                stored = self._pending[key][1]
+            elif key in self._flushing:
+                stored = self._flushing[key][0]  # 正在写入的操作完成后数据库中的状态
+            else:
+                stored = None
+        if stored is None:
+            stored = self._stored_state(kind, user, target)
+        with self._lock:
+            if value == stored:
+                if self._pending.pop(key, None) is not None:
+                    self.coalesced += 1
+                return
+            self._pending[key] = (value, stored)
+            size = len(self._pending)
+        if not app.config["FAVORITE_WRITE_BEHIND"]:
+            self.flush()
+        else:
+            self.start()
+            if size >= app.config["FAVORITE_FLUSH_SIZE"]:
+                self._wakeup.set()
+
+    def toggle(self, kind, user, target):
+        """
+        切换点赞（收藏）状态，返回切换后的状态。
+        """
+        value = not self.is_favorite(kind, user, target)
+        self.set(kind, user, target, value)
+        return value
+
+    def _requeue(self, batch):
+        """把写入失败的操作放回缓冲区：期间的新操作优先，但数据库中原来的状态以未写入的操作为准"""
+        with self._lock:
+            for key, (value, stored) in batch.items():
+                if key in self._pending:
+                    value = self._pending[key][0]
+                if value == stored:
+                    self._pending.pop(key, None)
+                else:
+                    self._pending[key] = (value, stored)
+
+    def flush(self):
+        """
+        在一个事务中写入所有尚未写入的操作，返回实际改变的记录数。\n
+        数据库错误（包括被锁定）时保留这些操作，下次再写入；数据库被锁定时返回 `0`，其他错误重新抛出。
+        其他异常（通常是数据本身的问题，重试也不会成功）时丢弃这些操作并记录到日志。
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            if not batch:
+                return 0
+            changed = []
+            try:
+                now = datetime.now()
+                for (kind, user, target), (value, _) in batch.items():
+                    statements = INSERT_STATEMENTS if value else DELETE_STATEMENTS
+                    params = {"target": target, "user": user, "time": now}
+                    # 取消点赞时撤销的是点赞时增加的热度
+                    liked = None
+                    if kind == "message" and not value:
+                        liked = trending.like_time(target, user)
+                    if db.session.execute(statements[kind], params).rowcount:
+                        changed.append((kind, user, target, value))
+                        if kind == "message":
+                            if value:
+                                trending.record(target, trending.LIKE_WEIGHT, now)
+                            else:
+                                trending.record(target, -trending.LIKE_WEIGHT, liked)
+                db.session.commit()
+            except Exception as error:
+                db.session.rollback()
+                if not isinstance(error, OperationalError):
+                    app.logger.error(
+                        "写入点赞和收藏失败，丢弃 %d 个操作：%s",
+                        len(batch),
+                        [(*key, value) for key, (value, _) in batch.items()],
+                    )
+                    raise
+                self._requeue(batch)
+                if not is_locked_error(error):
+                    raise
+                app.logger.warning("数据库被锁定，%d 个点赞和收藏操作稍后写入", len(batch))
+                return 0
+            finally:
+                # 放回缓冲区之后再清空，期间读取状态时不会看到数据库中旧的状态
+                with self._lock:
+                    self._flushing = {}
+            with self._lock:
+                self.flushed += len(changed)
+        for kind, user, target, _ in changed:
+            if kind == "message":
+                fragments.favorite_changed(user)
+                fragments.message_counts_changed(target)
+        if any(kind == "message" for kind, *_ in changed):
+            fragments.trending_changed()
+        return len(changed)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(app.config["FAVORITE_FLUSH_INTERVAL"])
+            self._wakeup.clear()
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                app.logger.exception("写入点赞和收藏失败")
+
+    def start(self):
+        """
+        启动后台写入线程（只启动一次）。
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="favorite-flush", daemon=True
+            )
+            self._thread.start()
+
+    def shutdown(self):
+        """
+        停止后台线程并写入剩余的操作。
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with app.app_context():
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "coalesced": self.coalesced,
+            }
+
+
+favorite_buffer = FavoriteBuffer()
+atexit.register(favorite_buffer.shutdown)
+
+
+def _exit_on_sigterm(signum, frame):
+    sys.exit(128 + signum)
+
+
+# 默认收到 `SIGTERM` 时进程直接结束，不会执行 `atexit`；改为正常退出，以便写入剩余的操作
+if (
+    threading.current_thread() is threading.main_thread()
+    and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+):
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
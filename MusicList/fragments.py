@@ -0,0 +1,77 @@
+"""
+消息列表的片段缓存。\n
+`message_list`、`hot_message_list`、`user_message` 和 `favorite_message_list` 页面中的消息列表（包括分页）
+渲染后保存在 `feed_cache` 中，页面的其他部分（导航栏、提示信息等）仍然每次渲染。\n
+缓存条目带有以下标签，写操作通过标签精确失效：\n
+`feed`: 所有条目；`feed:<列表>`: 所属的消息列表；
+`message:<index>`: 包含的消息；`owner:<index>`: 包含的消息的发送者。\n
+标签失效只作用于当前进程，其他进程（多个 worker、`flask archive`、`flask import` 等命令）的写操作
+在条目过期（`FEED_CACHE_TTL` 秒）后才会体现出来。
+"""
+
+from flask import render_template, request
+from markupsafe import Markup
+
+from MusicList import app
+from MusicList.cache import TaggedCache
+from MusicList.pagination import paginate
+
+app.config.setdefault("FEED_CACHE_SIZE", 512)
+app.config.setdefault("FEED_CACHE_TTL", 60)
+feed_cache = TaggedCache(app.config["FEED_CACHE_SIZE"], app.config["FEED_CACHE_TTL"])
+
+
+def render_feed(feed, query, columns, per_page):
+    """
+    渲染消息列表片段，缓存未命中时才对 `query` 进行分页查询（参数同 `paginate`）。\n
+    `feed`: 消息列表的名称，如 `all`、`hot`、`user:<index>`、`favorite:<index>`
+    """
+    key = (feed, request.query_string)
+    html = feed_cache.get(key)
+    if html is None:
+        since = feed_cache.generation
+        messages = paginate(query, columns, per_page)
+        html = render_template("message/message_items.html", messages=messages)
+        tags = {"feed", f"feed:{feed}"}
+        for message in messages.items:
+            tags.add(f"message:{message.index}")
+            tags.add(f"owner:{message.owner}")
+        feed_cache.set(key, html, tags, since)
+    return Markup(html)
+
+
+def message_created(owner):
+    """发送新消息后，最新消息和发送者的消息列表失效"""
+    feed_cache.invalidate_tag("feed:all")
+    feed_cache.invalidate_tag(f"feed:user:{owner}")
+
+
+def message_deleted(message_index):
+    """
+    删除消息后，包含该消息的页面失效。\n
+    页码分页时之后的页面都会发生变化，此时所有消息列表都失效。
+    """
+    if app.config["PAGINATION_MODE"] == "keyset":
+        feed_cache.invalidate_tag(f"message:{message_index}")
+    else:
+        feed_cache.invalidate_tag("feed")
+
+
+def message_counts_changed(message_index):
+    """点赞数或评论数改变后，包含该消息的页面失效"""
+    feed_cache.invalidate_tag(f"message:{message_index}")
+
+
+def username_changed(user_index):
+    """更改用户名后，包含该用户的消息的页面失效"""
+    feed_cache.invalidate_tag(f"owner:{user_index}")
+
+
+def favorite_changed(user_index):
+    """点赞或取消点赞后，该用户点赞的消息列表失效"""
+    feed_cache.invalidate_tag(f"feed:favorite:{user_index}")
+
+
+def trending_changed():
+    """点赞或评论后，帖子的热度改变，热门消息列表失效"""
+    feed_cache.invalidate_tag("feed:hot")
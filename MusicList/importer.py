@@ -0,0 +1,124 @@
+"""
+批量导入歌曲。\n
+逐行读取 CSV 或 JSONL 文件，按批次在一个事务中插入，并根据歌曲的去重键去重，
+内存占用与文件大小无关。
+"""
+
+import csv
+import json
+import os
+import time
+
+from sqlalchemy import func
+
+from MusicList import artists, db
+from MusicList.model import Music, insert_music, music_content_key
+
+FIELDS = ("music_name", "artist", "link")
+MAX_REPORTED_ERRORS = 20  # 最多记录原因的无效行数
+
+
+class RowErrors:
+    """
+    无效的行：总数 `count`，以及前 `limit` 行的 `(行号, 原因)`。
+    """
+
+    def __init__(self, limit=MAX_REPORTED_ERRORS):
+        self.limit = limit
+        self.count = 0
+        self.samples = []
+
+    def add(self, number, reason):
+        self.count += 1
+        if len(self.samples) < self.limit:
+            self.samples.append((number, reason))
+
+
+def detect_format(path):
+    """
+    根据扩展名判断文件格式（`csv` 或 `jsonl`）。
+    """
+    extension = os.path.splitext(path)[1].lower()
+    return "jsonl" if extension in (".jsonl", ".ndjson", ".json") else "csv"
+
+
+def _value(value):
+    """字段的值：字符串和数字转换为去掉首尾空白的字符串，其他类型（列表、对象、布尔值）无效"""
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"字段的类型无效（{type(value).__name__}）")
+    return str(value).strip()
+
+
+def _row(record):
+    """将一条记录转换为歌曲，记录无效时抛出 `ValueError`"""
+    if not isinstance(record, dict):
+        raise ValueError("不是 JSON 对象")
+    row = {key: _value(record.get(key)) for key in FIELDS}
+    if not row["music_name"] or not row["artist"]:
+        raise ValueError("缺少歌曲名或艺术家")
+    row["content_key"] = music_content_key(**row)
+    return row
+
+
+def read_rows(path, file_format=None, errors=None):
+    """
+    逐行读取文件中的歌曲，生成包含 `music_name`、`artist` 和 `link` 的字典。\n
+    CSV 文件需要包含表头。无效的行（JSON 无法解析、字段的类型无效、缺少歌曲名或艺术家）会被跳过，
+    `errors`（`RowErrors`）不为 `None` 时记录这些行的行号和原因。
+    """
+    file_format = file_format or detect_format(path)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if file_format == "csv":
+            reader = csv.DictReader(f)
+            records = ((reader.line_num, record) for record in reader)
+        else:
+            records = ((number, line) for number, line in enumerate(f, 1) if line.strip())
+        for number, record in records:
+            try:
+                if file_format != "csv":
+                    try:
+                        record = json.loads(record)
+                    except ValueError as error:
+                        raise ValueError(f"JSON 无法解析（{error}）") from error
+                row = _row(record)
+            except ValueError as error:
+                if errors is not None:
+                    errors.add(number, str(error))
+                continue
+            yield row
+
+
+def batched(rows, size):
+    """
+    将 `rows` 分为大小为 `size` 的批次。
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_rows(rows, batch_size=10000):
+    """
+    分批插入歌曲，每批一个事务；去重键已存在的歌曲会被跳过，新的歌曲在插入后关联艺术家。\n
+    每提交一批生成一次累计的统计信息：`read`、`inserted`、`seconds` 和 `rate`（每秒行数）。
+    """
+    stats = {"read": 0, "inserted": 0, "seconds": 0.0, "rate": 0.0}
+    start = time.perf_counter()
+    last = db.session.query(func.max(Music.index)).scalar() or 0
+    for batch in batched(rows, batch_size):
+        result = db.session.execute(insert_music(), batch)
+        db.session.commit()
+        artists.link_pending(batch_size, after=last)
+        last = db.session.query(func.max(Music.index)).scalar() or 0
+        stats["read"] += len(batch)
+        stats["inserted"] += result.rowcount
+        stats["seconds"] = time.perf_counter() - start
+        stats["rate"] = stats["read"] / stats["seconds"] if stats["seconds"] else 0.0
+        yield dict(stats)
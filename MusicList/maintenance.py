@@ -0,0 +1,197 @@
+"""
+数据库维护。\n
+`backup`: 通过 SQLite 的在线备份 API 每次复制若干页，备份期间应用可以继续读写；\n
+`analyze`: 执行 `ANALYZE`，更新查询优化器使用的统计信息；\n
+`vacuum`: 把数据库切换为 `auto_vacuum = INCREMENTAL`（需要执行一次完整的 `VACUUM`），
+之后每次只释放若干空闲页，不会长时间锁住数据库；\n
+`integrity_check`: 执行 `PRAGMA integrity_check`（或 `quick_check`）和 `foreign_key_check`。\n
+各函数返回的统计信息都包括耗时和数据库文件（包括 WAL 文件）大小的变化。
+"""
+
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+
+from sqlalchemy import text
+
+from MusicList import db
+
+BACKUP_PAGES = 256  # 每一步复制的页数
+BACKUP_SLEEP = 0.005  # 每一步之间等待的秒数，期间其他连接可以写入
+VACUUM_PAGES = 1024  # 每个事务释放的页数
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
+
+def database_path():
+    """
+    当前数据库文件的路径；不是 SQLite 文件数据库时抛出 `ValueError`。
+    """
+    url = db.engine.url
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise ValueError("只支持 SQLite 文件数据库")
+    return os.path.abspath(url.database)
+
+
+def file_size(path):
+    """数据库文件及其 WAL 文件的总大小（字节），文件不存在时为 `0`"""
+    return sum(
+        os.path.getsize(name) for name in (path, path + "-wal") if os.path.exists(name)
+    )
+
+
+def _pragma(connection, name):
+    return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def default_backup_path(path):
+    """`<数据库所在目录>/backups/<文件名>-<时间>.db`"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(os.path.dirname(path), "backups", f"{stem}-{stamp}.db")
+
+
+def backup(target=None, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, verify=False, progress=None):
+    """
+    在线备份数据库到 `target`（默认见 `default_backup_path`），每一步复制 `pages` 页。\n
+    备份先写入临时文件，完成后再重命名，不会留下不完整的备份。\n
+    其他连接在步骤之间修改数据库时 SQLite 会重新开始复制，写入频繁时可能一直无法完成。
+    因此 WAL 模式下在整个备份期间保持一个读事务，复制的是开始时的快照（读事务不会阻塞写入）；
+    其他日志模式下读事务会阻塞写入，只能在步骤之间释放锁，由 SQLite 在需要时重新开始。\n
+    `verify`: 完成后对备份执行 `quick_check` \n
+    `progress`: 每一步之后以 `(剩余页数, 总页数)` 调用 \n
+    返回统计信息：`path`、`pages`、`steps`、`restarts`、`snapshot`（是否使用快照）、`seconds`、
+    `source_bytes`、`backup_bytes`，以及 `verify` 为真时的 `check`。
+    """
+    source_path = database_path()
+    target = os.path.abspath(target or default_backup_path(source_path))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = target + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    stats = {"path": target, "pages": 0, "steps": 0, "restarts": 0}
+    last = [None]
+
+    def step(status, remaining, total):
+        if last[0] is not None and remaining > last[0]:
+            stats["restarts"] += 1
+        last[0] = remaining
+        stats["steps"] += 1
+        stats["pages"] = total
+        if progress is not None:
+            progress(remaining, total)
+
+    start = time.perf_counter()
+    raw = db.engine.raw_connection()
+    source = raw.connection
+    try:
+        stats["snapshot"] = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if stats["snapshot"]:
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        with closing(sqlite3.connect(partial)) as destination:
+            source.backup(destination, pages=pages, progress=step, sleep=sleep)
+            if verify:
+                stats["check"] = destination.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        if source.in_transaction:
+            source.rollback()
+        raw.close()
+    os.replace(partial, target)
+    stats["seconds"] = time.perf_counter() - start
+    stats["source_bytes"] = file_size(source_path)
+    stats["backup_bytes"] = file_size(target)
+    return stats
+
+
+def analyze(limit=None):
+    """
+    执行 `ANALYZE`。`limit` 不为 `None` 时设置 `analysis_limit`，每个索引只抽样大约这么多行。\n
+    返回统计信息：`seconds`、`tables`（有统计信息的表数）、`before_bytes`、`after_bytes`。
+    """
+    path = database_path()
+    before = file_size(path)
+    start = time.perf_counter()
+    with db.engine.connect() as connection:
+        if limit is not None:
+            connection.execute(text(f"PRAGMA analysis_limit = {int(limit)}"))
+        connection.execute(text("ANALYZE"))
+        tables = connection.execute(
+            text("SELECT count(DISTINCT tbl) FROM sqlite_stat1")
+        ).scalar()
+        if limit is not None:
+            connection.execute(text("PRAGMA analysis_limit = 0"))
+    return {
+        "seconds": time.perf_counter() - start,
+        "tables": tables,
+        "before_bytes": before,
+        "after_bytes": file_size(path),
+    }
+
+
+def vacuum(pages=VACUUM_PAGES, max_pages=None, full=False, pause=0.0):
+    """
+    释放数据库中的空闲页，缩小文件。\n
+    数据库还不是 `auto_vacuum = INCREMENTAL` 时（或 `full` 为真时）设置该模式并执行完整的 `VACUUM`，
+    期间数据库被锁住；之后每个事务执行 `incremental_vacuum(pages)`，直到没有空闲页或已释放 `max_pages` 页，
+    事务之间等待 `pause` 秒。\n
+    返回统计信息：`mode`（执行前的模式）、`full`（是否执行了完整的 `VACUUM`）、`freed`（释放的页数）、
+    `free_pages`（剩余的空闲页）、`seconds`、`before_bytes`、`after_bytes`。
+    """
+    path = database_path()
+    before = file_size(path)
+    start = time.perf_counter()
+    stats = {"freed": 0}
+    # `VACUUM` 和 `incremental_vacuum` 不能在事务中执行，直接使用自动提交模式的连接
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        mode = _pragma(connection, "auto_vacuum")
+        stats["mode"] = AUTO_VACUUM_MODES.get(mode, str(mode))
+        stats["full"] = full or mode != 2
+        if stats["full"]:
+            free = _pragma(connection, "freelist_count")
+            connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            connection.execute(text("VACUUM"))
+            stats["freed"] = free
+        while max_pages is None or stats["freed"] < max_pages:
+            free = _pragma(connection, "freelist_count")
+            if not free:
+                break
+            step = free if max_pages is None else min(free, max_pages - stats["freed"])
+            connection.execute(text(f"PRAGMA incremental_vacuum({min(step, pages)})"))
+            stats["freed"] += free - _pragma(connection, "freelist_count")
+            if pause:
+                time.sleep(pause)
+        stats["free_pages"] = _pragma(connection, "freelist_count")
+        # 把 WAL 文件中的内容写回数据库文件并截断，文件大小的变化才能体现出来
+        connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    stats["seconds"] = time.perf_counter() - start
+    stats["before_bytes"] = before
+    stats["after_bytes"] = file_size(path)
+    return stats
+
+
+def integrity_check(quick=False, max_errors=100):
+    """
+    检查数据库的完整性和外键约束。\n
+    `quick`: 使用 `quick_check`（不检查索引与数据是否一致，速度更快） \n
+    返回统计信息：`ok`、`errors`（完整性问题）、`foreign_keys`（违反外键约束的 `(表, rowid, 被引用的表)`）、
+    `seconds`、`bytes`。
+    """
+    path = database_path()
+    start = time.perf_counter()
+    pragma = "quick_check" if quick else "integrity_check"
+    with db.engine.connect() as connection:
+        rows = connection.execute(text(f"PRAGMA {pragma}({int(max_errors)})")).fetchall()
+        errors = [row[0] for row in rows if row[0] != "ok"]
+        foreign_keys = [
+            (row[0], row[1], row[2])
+            for row in connection.execute(text("PRAGMA foreign_key_check")).fetchmany(max_errors)
+        ]
+    return {
+        "ok": not errors and not foreign_keys,
+        "errors": errors,
+        "foreign_keys": foreign_keys,
+        "seconds": time.perf_counter() - start,
+        "bytes": file_size(path),
+    }
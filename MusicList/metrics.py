@@ -0,0 +1,278 @@
+"""
+运行指标。\n
+按页面（endpoint）统计请求耗时的直方图、SQL 语句的数量和耗时，按模板统计渲染耗时，
+并在导出时读取各个缓存的命中率、密码哈希线程池、点赞缓冲区、歌单重新编号、自动补全索引（包括占用的内存）的状态和慢查询的数量，以 Prometheus 文本格式输出（见 `/metrics`）。\n
+一次请求执行的 SQL 语句超过 `METRICS_QUERY_WARNING` 条时记录警告，用于发现 N+1 查询。\n
+请求在 `teardown_request` 中记录，未处理的异常同样计入（状态为 `500`）。\n
+设置了 `METRICS_TOKEN` 时 `/metrics` 只接受带有 `Authorization: Bearer <METRICS_TOKEN>` 的请求；
+否则只接受来自 `METRICS_ALLOWED_ADDRESSES` 的请求（默认为空，即不允许访问）。
+应用通常位于本机的反向代理之后，所有请求都来自 `127.0.0.1`，因此本机地址默认不被信任。
+"""
+
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from MusicList import app, passwords, playlists, user_cache
+from MusicList.autocomplete import suggestions
+from MusicList.favorites import favorite_buffer
+from MusicList.fragments import feed_cache
+from MusicList.slowlog import slow_log
+
+app.config.setdefault("METRICS_QUERY_WARNING", 30)
+app.config.setdefault("METRICS_ALLOWED_ADDRESSES", ())
+app.config.setdefault("METRICS_TOKEN", None)
+
+# 请求耗时直方图的上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """累计直方图，`counts[i]` 为耗时不超过 `BUCKETS[i]` 的次数（不含更小的桶）"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    线程安全的指标集合。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(Histogram)  # endpoint -> 请求耗时
+        self.responses = defaultdict(int)  # (endpoint, status) -> 次数
+        self.queries = defaultdict(int)  # endpoint -> SQL 语句数
+        self.query_seconds = defaultdict(float)  # endpoint -> SQL 耗时
+        self.query_warnings = defaultdict(int)  # endpoint -> 超过阈值的请求数
+        self.templates = defaultdict(lambda: [0, 0.0])  # 模板 -> [次数, 耗时]
+        self.collectors = {}  # (分组, 名称) -> 返回统计信息的函数
+
+    def observe_request(self, endpoint, status, seconds, queries, query_seconds):
+        with self._lock:
+            self.requests[endpoint].observe(seconds)
+            self.responses[(endpoint, status)] += 1
+            self.queries[endpoint] += queries
+            self.query_seconds[endpoint] += query_seconds
+
+    def observe_template(self, name, seconds):
+        with self._lock:
+            stats = self.templates[name]
+            stats[0] += 1
+            stats[1] += seconds
+
+    def warn_queries(self, endpoint):
+        with self._lock:
+            self.query_warnings[endpoint] += 1
+
+    def register(self, group, name, collector):
+        """
+        注册一个在导出时调用的统计函数，返回的字典中的数值作为
+        `musiclist_<group>_<键>{name="<name>"}` 导出。
+        """
+        self.collectors[(group, name)] = collector
+
+    def clear(self):
+        with self._lock:
+            for metric in (
+                self.requests,
+                self.responses,
+                self.queries,
+                self.query_seconds,
+                self.query_warnings,
+                self.templates,
+            ):
+                metric.clear()
+
+
+registry = Registry()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def render():
+    """
+    以 Prometheus 文本格式导出所有指标。
+    """
+    lines = []
+
+    def header(name, kind, text):
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    with registry._lock:
+        name = "musiclist_request_duration_seconds"
+        header(name, "histogram", "Request latency by endpoint.")
+        for endpoint, histogram in sorted(registry.requests.items()):
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), histogram.counts):
+                cumulative += count
+                labels = _labels(endpoint=endpoint, le=bound)
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            labels = _labels(endpoint=endpoint)
+            lines.append(f"{name}_sum{labels} {histogram.sum}")
+            lines.append(f"{name}_count{labels} {histogram.count}")
+
+        header("musiclist_responses_total", "counter", "Responses by endpoint and status.")
+        for (endpoint, status), count in sorted(registry.responses.items()):
+            labels = _labels(endpoint=endpoint, status=status)
+            lines.append(f"musiclist_responses_total{labels} {count}")
+
+        for name, metric, text in (
+            ("musiclist_sql_queries_total", registry.queries, "SQL statements by endpoint."),
+            (
+                "musiclist_sql_duration_seconds_total",
+                registry.query_seconds,
+                "Time spent in SQL statements by endpoint.",
+            ),
+            (
+                "musiclist_sql_query_warnings_total",
+                registry.query_warnings,
+                "Requests that issued more than METRICS_QUERY_WARNING statements.",
+            ),
+        ):
+            header(name, "counter", text)
+            for endpoint, value in sorted(metric.items()):
+                lines.append(f"{name}{_labels(endpoint=endpoint)} {value}")
+
+        name = "musiclist_template_render_seconds"
+        header(name, "summary", "Template render time.")
+        for template, (count, seconds) in sorted(registry.templates.items()):
+            labels = _labels(template=template)
+            lines.append(f"{name}_sum{labels} {seconds}")
+            lines.append(f"{name}_count{labels} {count}")
+
+        collectors = sorted(registry.collectors.items())
+
+    samples = defaultdict(list)
+    for (group, source), collector in collectors:
+        for key, value in collector().items():
+            if isinstance(value, (int, float)):
+                samples[f"musiclist_{group}_{key}"].append((source, value))
+    for name, values in sorted(samples.items()):
+        header(name, "gauge", f"Current value of {name[len('musiclist_'):]}.")
+        for source, value in values:
+            lines.append(f"{name}{_labels(name=source)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _password_pool_stats():
+    pool = passwords.get_pool()
+    return pool.stats() if pool is not None else {}
+
+
+registry.register("cache", "user", user_cache.stats)
+registry.register("cache", "feed", feed_cache.stats)
+registry.register("password_hash", "pool", _password_pool_stats)
+registry.register("slow_query", "log", slow_log.stats)
+registry.register("favorite", "buffer", favorite_buffer.stats)
+registry.register("playlist_rebalance", "rebalancer", playlists.rebalancer.stats)
+registry.register("autocomplete", "songs", suggestions.stats)
+
+
+def _endpoint():
+    return request.endpoint or "none"
+
+
+@app.before_request
+def start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+
+
+@app.after_request
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request(error=None):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    # 未处理的异常不会经过 `after_request`
+    status = 500 if error is not None else g.pop("metrics_status", 500)
+    endpoint = _endpoint()
+    queries = g.metrics_queries
+    registry.observe_request(
+        endpoint,
+        status,
+        time.perf_counter() - start,
+        queries,
+        g.metrics_query_seconds,
+    )
+    limit = app.config["METRICS_QUERY_WARNING"]
+    if limit and queries > limit:
+        registry.warn_queries(endpoint)
+        app.logger.warning("%s %s 执行了 %d 条 SQL 语句", request.method, request.path, queries)
+
+
+def is_allowed():
+    """
+    当前请求是否可以读取指标：设置了 `METRICS_TOKEN` 时必须带有正确的令牌，
+    否则必须来自 `METRICS_ALLOWED_ADDRESSES`。
+    """
+    token = app.config["METRICS_TOKEN"]
+    if token:
+        header = request.headers.get("Authorization", "")
+        return hmac.compare_digest(header.encode(), f"Bearer {token}".encode())
+    return request.remote_addr in app.config["METRICS_ALLOWED_ADDRESSES"]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["metrics_start"].pop()
+    if has_request_context() and "metrics_start" in g:
+        g.metrics_queries += 1
+        g.metrics_query_seconds += time.perf_counter() - start
+
+
+@event.listens_for(Engine, "handle_error")
+def discard_query(context):
+    starts = context.connection.info.get("metrics_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+@before_render_template.connect_via(app)
+def start_template(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("metrics_templates", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def record_template(sender, template, context, **extra):
+    starts = g.get("metrics_templates") if has_request_context() else None
+    if starts:
+        registry.observe_template(template.name or "string", time.perf_counter() - starts.pop())
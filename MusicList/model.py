@@ -1,6 +1,23 @@
 from datetime import datetime
-from MusicList import db
-from werkzeug.security import generate_password_hash, check_password_hash
+import hashlib
+import unicodedata
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from MusicList import db, passwords
+
+
+def normalize_text(value):
+    """
+    经过 NFKC 规范化、折叠大小写和空白后的文本，用于去重和搜索。
+    """
+    return " ".join(unicodedata.normalize("NFKC", value or "").casefold().split())
+
+
+def music_content_key(music_name, artist, link):
+    """
+    歌曲内容的去重键：歌曲名、艺术家和链接经过 `normalize_text` 处理后的 SHA-1。
+    """
+    parts = [normalize_text(value) for value in (music_name, artist, link)]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
 
 
 class User(db.Model):
@@ -9,6 +26,8 @@ class User(db.Model):
     `level`: 表示用户的权限，`0` 表示普通用户，`1` 表示管理员。
     """
 
+    __table_args__ = (db.Index("ix_user_username", "username", unique=True),)
+
     index = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100))
     password = db.Column(db.String(100))
@@ -18,13 +37,19 @@ class User(db.Model):
         """
         设定密码。
         """
-        self.password = generate_password_hash(password)
+        self.password = passwords.hash_password(password)
 
     def validate_password(self, password):
         """
         校验密码。
         """
-        return check_password_hash(self.password, password)
+        return passwords.check_password(self.password, password)
+
+    def password_needs_rehash(self):
+        """
+        密码哈希的参数是否已经过时，需要在用户登录时重新设定。
+        """
+        return passwords.needs_rehash(self.password)
 
     def is_authenticated(self):
         """
@@ -52,26 +77,86 @@ class User(db.Model):
 
 class Music(db.Model):
     """
-    存储歌曲信息。
+    存储歌曲信息。\n
+    `content_key`: 由 `music_content_key` 计算的去重键，内容相同的歌曲只能有一条记录。\n
+    `artist`: 用户输入的艺术家；拆分后的艺术家见 `MusicArtist`，`artist_id` 为其中的第一位
     """
 
+    __table_args__ = (
+        db.Index("ix_music_content_key", "content_key", unique=True),
+        db.Index("ix_music_artist_id", "artist_id"),
+    )
+
     index = db.Column(db.Integer, primary_key=True)
     music_name = db.Column(db.String(100))
     artist = db.Column(db.String(100))
     link = db.Column(db.String(100))
+    content_key = db.Column(db.String(40))
+    artist_id = db.Column(db.Integer, db.ForeignKey("artist.index", ondelete="SET NULL"))
+
+
+class Artist(db.Model):
+    """
+    一位艺术家，由歌曲的 `Music.artist` 拆分得到（见 `MusicList.artists`）。\n
+    `name_key`: 经过 `normalize_text` 处理后的名字，写法不同的同一位艺术家只有一条记录。\n
+    `song_count` / `list_count`: 歌曲数和歌曲被歌单收录的次数，由触发器维护
+    """
+
+    __table_args__ = (
+        db.Index("ix_artist_name_key", "name_key", unique=True),
+        db.Index("ix_artist_list_count", "list_count"),
+    )
+
+    index = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    name_key = db.Column(db.String(100))
+    song_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    list_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class MusicArtist(db.Model):
+    """
+    歌曲和艺术家的对应关系。\n
+    `position`: 艺术家在歌曲署名中的顺序，从 `0` 开始
+    """
+
+    __table_args__ = (db.Index("ix_music_artist_artist_id_music_id", "artist_id", "music_id"),)
+
+    music_id = db.Column(
+        db.Integer, db.ForeignKey("music.index", ondelete="CASCADE"), primary_key=True
+    )
+    artist_id = db.Column(
+        db.Integer, db.ForeignKey("artist.index", ondelete="CASCADE"), primary_key=True
+    )
+    position = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+def insert_music():
+    """
+    插入歌曲的语句（`INSERT ... ON CONFLICT DO NOTHING`），去重键已存在时不插入。\n
+    需要在参数中提供 `content_key`。
+    """
+    return sqlite_insert(Music.__table__).on_conflict_do_nothing(
+        index_elements=["content_key"]
+    )
 
 
 class List(db.Model):
     """
     存储歌单信息。\n
     `owner`: 歌单创建者的用户的 `index`。\n
-    `share`: 表示歌单是否公开，`0` 表示私密，`1`表示公开。
+    `share`: 表示歌单是否公开，`0` 表示私密，`1`表示公开。\n
+    `music_count` / `favorite_count`: 歌曲数和被收藏的次数，由触发器维护（见 `MusicList.counters`）。
     """
 
+    __table_args__ = (db.Index("ix_list_owner_share", "owner", "share"),)
+
     index = db.Column(db.Integer, primary_key=True)
     list_name = db.Column(db.String(100))
     owner = db.Column(db.Integer)
     share = db.Column(db.Integer)
+    music_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
 
 class MusicList(db.Model):
@@ -80,9 +165,19 @@ class MusicList(db.Model):
     如果一条记录出现在数据库中，则表名对应的歌曲在对应的列表中。
     """
 
+    __table_args__ = (
+        db.Index("ix_music_list_list_id_music_id", "list_id", "music_id", unique=True),
+        # 删除歌曲时按外键级联删除歌单中的记录
+        db.Index("ix_music_list_music_id", "music_id"),
+        # 按顺序分页读取歌单中的歌曲
+        db.Index("ix_music_list_list_id_position", "list_id", "position"),
+    )
+
     index = db.Column(db.Integer, primary_key=True)
-    list_id = db.Column(db.Integer)
-    music_id = db.Column(db.Integer)
+    list_id = db.Column(db.Integer, db.ForeignKey("list.index", ondelete="CASCADE"))
+    music_id = db.Column(db.Integer, db.ForeignKey("music.index", ondelete="CASCADE"))
+    # 歌曲在歌单中的顺序，插入时由触发器设置为歌单末尾（见 `MusicList.playlists`）
+    position = db.Column(db.Integer)
 
 
 class Message(db.Model):
@@ -90,27 +185,100 @@ class Message(db.Model):
     一条消息。\n
     `owner`: 消息创建者的用户的 `index`。\n
     `list_index`: 每个消息可以关联一个列表，该字段为列表id \n
+    `like_count` / `comment_count`: 点赞数和评论数，由触发器维护（见 `MusicList.counters`）。\n
+    `index` 使用 `AUTOINCREMENT`，已删除或已归档的消息的 `index` 不会被分配给新的消息。
     """
 
+    __table_args__ = (
+        db.Index("ix_message_time", "time"),
+        db.Index("ix_message_owner_time", "owner", "time"),
+        {"sqlite_autoincrement": True},
+    )
+
     index = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(50))
     text = db.Column(db.String(500))
     owner = db.Column(db.Integer)
     time = db.Column(db.DateTime, default=datetime.now)
     list_index = db.Column(db.Integer)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
 
 class Comment(db.Model):
     """
     一条评论。\n
-    `parent_message`: 原帖的`index`
+    `parent_message`: 原帖的`index` \n
+    `index` 与 `Message.index` 一样使用 `AUTOINCREMENT`。
     """
 
+    __table_args__ = (
+        db.Index("ix_comment_parent_massage_time", "parent_massage", "time"),
+        db.Index("ix_comment_owner_time", "owner", "time"),
+        {"sqlite_autoincrement": True},
+    )
+
     index = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String(500))
     owner = db.Column(db.Integer)
     time = db.Column(db.DateTime, default=datetime.now)
-    parent_massage = db.Column(db.Integer)
+    parent_massage = db.Column(
+        db.Integer, db.ForeignKey("message.index", ondelete="CASCADE")
+    )
+
+
+class MessageArchive(db.Model):
+    """
+    已归档的消息（见 `MusicList.archive`），各列与 `Message` 相同。\n
+    `like_count` / `comment_count`: 归档时的点赞数和评论数，归档后不再变化
+    """
+
+    __table_args__ = (db.Index("ix_message_archive_owner_time", "owner", "time"),)
+
+    index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(50))
+    text = db.Column(db.String(500))
+    owner = db.Column(db.Integer)
+    time = db.Column(db.DateTime)
+    list_index = db.Column(db.Integer)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class CommentArchive(db.Model):
+    """
+    已归档的消息的评论，各列与 `Comment` 相同。
+    """
+
+    __table_args__ = (
+        db.Index("ix_comment_archive_parent_massage_time", "parent_massage", "time"),
+        db.Index("ix_comment_archive_owner_time", "owner", "time"),
+    )
+
+    index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    text = db.Column(db.String(500))
+    owner = db.Column(db.Integer)
+    time = db.Column(db.DateTime)
+    parent_massage = db.Column(
+        db.Integer, db.ForeignKey("message_archive.index", ondelete="CASCADE")
+    )
+
+
+class FavoriteMessageArchive(db.Model):
+    """
+    已归档的消息的点赞记录。
+    """
+
+    __table_args__ = (db.Index("ix_favorite_message_archive_user_id", "user_id"),)
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey("message_archive.index", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.index", ondelete="CASCADE"), primary_key=True
+    )
 
 
 class FavoriteList(db.Model):
@@ -119,17 +287,82 @@ class FavoriteList(db.Model):
     如果一条记录出现在数据库中，则表名对应的用户收藏了对应的列表。
     """
 
+    __table_args__ = (
+        db.Index("ix_favorite_list_list_id_user_id", "list_id", "user_id", unique=True),
+        db.Index("ix_favorite_list_user_id", "user_id"),
+    )
+
     index = db.Column(db.Integer, primary_key=True)
-    list_id = db.Column(db.Integer)
-    user_id = db.Column(db.Integer)
+    list_id = db.Column(db.Integer, db.ForeignKey("list.index", ondelete="CASCADE"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.index", ondelete="CASCADE"))
 
 
 class FavoriteMessage(db.Model):
     """
     存储用户点赞帖子的记录。\n
-    如果一条记录出现在数据库中，则表名对应的用户点赞了对应的帖子。
+    如果一条记录出现在数据库中，则表名对应的用户点赞了对应的帖子。\n
+    `time`: 点赞的时间，取消点赞时用于撤销当时增加的热度（见 `MusicList.trending`），旧的记录为 `NULL`
     """
 
+    __table_args__ = (
+        db.Index(
+            "ix_favorite_message_message_id_user_id", "message_id", "user_id", unique=True
+        ),
+        db.Index("ix_favorite_message_user_id", "user_id"),
+    )
+
     index = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer)
-    user_id = db.Column(db.Integer)
+    message_id = db.Column(
+        db.Integer, db.ForeignKey("message.index", ondelete="CASCADE")
+    )
+    user_id = db.Column(db.Integer, db.ForeignKey("user.index", ondelete="CASCADE"))
+    time = db.Column(db.DateTime, default=datetime.now)
+
+
+class MessageScore(db.Model):
+    """
+    帖子的热度，由 `MusicList.trending` 在点赞和评论时增量更新。\n
+    `score`: 随时间指数衰减的互动权重之和，以对数形式保存（见 `MusicList.trending`），
+    数值越大越热门
+    """
+
+    __table_args__ = (db.Index("ix_message_score_score_message_id", "score", "message_id"),)
+
+    message_id = db.Column(
+        db.Integer, db.ForeignKey("message.index", ondelete="CASCADE"), primary_key=True
+    )
+    score = db.Column(db.Float)
+
+
+class SimilarMusic(db.Model):
+    """
+    经常与一首歌曲出现在同一个歌单中的歌曲，由 `MusicList.recommend` 离线计算。\n
+    `rank`: 从 `0` 开始的排名 \n
+    `score`: 两首歌曲所在歌单的余弦相似度
+    """
+
+    __table_args__ = (db.Index("ix_similar_music_other_id", "other_id"),)
+
+    music_id = db.Column(
+        db.Integer, db.ForeignKey("music.index", ondelete="CASCADE"), primary_key=True
+    )
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, db.ForeignKey("music.index", ondelete="CASCADE"))
+    score = db.Column(db.Float)
+
+
+class SimilarList(db.Model):
+    """
+    与一个歌单相似的公开歌单，由 `MusicList.recommend` 离线计算。\n
+    `rank`: 从 `0` 开始的排名 \n
+    `score`: 两个歌单所含歌曲的余弦相似度
+    """
+
+    __table_args__ = (db.Index("ix_similar_list_other_id", "other_id"),)
+
+    list_id = db.Column(
+        db.Integer, db.ForeignKey("list.index", ondelete="CASCADE"), primary_key=True
+    )
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, db.ForeignKey("list.index", ondelete="CASCADE"))
+    score = db.Column(db.Float)
@@ -0,0 +1,162 @@
+"""
+分页工具。\n
+支持两种分页模式，由配置项 `PAGINATION_MODE` 决定：\n
+`offset`: 使用 Flask-SQLAlchemy 的 `paginate`（`LIMIT/OFFSET` 加 `COUNT(*)`），可以跳转到任意页码；\n
+`keyset`: 游标分页，按照排序键（如 `(time, index)`）定位下一页，不需要统计总数，翻页的开销与页码无关。
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import DateTime, tuple_
+
+from MusicList import app
+
+app.config.setdefault("PAGINATION_MODE", "keyset")
+
+
+class KeysetPagination:
+    """
+    游标分页的结果。\n
+    `items`: 当前页的内容 \n
+    `prev_cursor` / `next_cursor`: 上一页和下一页的游标，没有时为 `None` \n
+    `start`: 当前页第一项的序号，见 `keyset_paginate`
+    """
+
+    keyset = True
+
+    def __init__(self, items, per_page, prev_cursor, next_cursor, start=None):
+        self.items = items
+        self.per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.start = start  # 第一项的序号（从 1 开始），只在 `numbered` 分页中设置
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(values, direction, number=None):
+    """
+    将排序键的值和翻页方向编码为不透明的游标。\n
+    `direction`: `"next"` 表示向后翻页，`"prev"` 表示向前翻页。\n
+    `number`: 游标所在的一项的序号（可选）
+    """
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    cursor = [direction, values] if number is None else [direction, values, number]
+    raw = json.dumps(cursor, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor, columns):
+    """
+    解析游标，返回 `(direction, values, number)`，游标中没有序号时 `number` 为 `None`；
+    游标无效时返回 `None`。
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values, *rest = json.loads(raw)
+        number = rest[0] if rest else None
+        if direction not in ("next", "prev") or len(values) != len(columns) or len(rest) > 1:
+            return None
+        if number is not None and (not isinstance(number, int) or number < 1):
+            return None
+        values = [
+            datetime.fromisoformat(v) if isinstance(c.type, DateTime) else v
+            for c, v in zip(columns, values)
+        ]
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    return direction, values, number
+
+
+def _row_key(row, columns):
+    """获取一行数据的排序键的值"""
+    if hasattr(row, "_mapping"):
+        return [row._mapping[c.key] for c in columns]
+    return [getattr(row, c.key) for c in columns]
+
+
+def seek(query, columns, direction="next", values=None, ascending=False):
+    """
+    为 `query` 加上游标分页的过滤和排序条件。\n
+    `values` 为游标位置的排序键，为 `None` 时从第一页开始。
+    `ascending` 为真时按照 `columns` 升序排列（如歌单中歌曲的顺序）。
+    """
+    forward = (direction == "next") != ascending  # 是否按降序读取
+    if values is not None:
+        key = tuple_(*columns)
+        if forward:
+            query = query.filter(key < tuple(values))
+        else:
+            query = query.filter(key > tuple(values))
+    if forward:
+        return query.order_by(*[c.desc() for c in columns])
+    return query.order_by(*[c.asc() for c in columns])
+
+
+def keyset_paginate(query, columns, cursor, per_page, ascending=False, numbered=False):
+    """
+    对 `query` 进行游标分页，按照 `columns` 降序（`ascending` 为真时升序）排列。\n
+    `columns` 的最后一列必须是唯一的（如主键），以保证顺序稳定。\n
+    `numbered` 为真时游标中同时记录序号，结果的 `start` 为当前页第一项的序号，不需要统计之前的行数；
+    游标中没有序号时（如旧的链接）`start` 为 `None`。序号在翻页之间有增删时可能偏移。
+    """
+    decoded = decode_cursor(cursor, columns)
+    direction = decoded[0] if decoded else "next"
+    query = seek(query, columns, direction, decoded[1] if decoded else None, ascending)
+    # 多取一条，用于判断是否还有更多内容
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == "prev":
+        items.reverse()
+    if not items:
+        return KeysetPagination(items, per_page, None, None)
+    has_prev = has_more if direction == "prev" else decoded is not None
+    has_next = has_more if direction == "next" else True
+    start = None
+    if numbered:
+        number = decoded[2] if decoded else None
+        if not has_prev:
+            start = 1
+        elif number is not None:
+            start = number + 1 if direction == "next" else max(number - len(items), 1)
+    last = start + len(items) - 1 if start is not None else None
+    prev_cursor = encode_cursor(_row_key(items[0], columns), "prev", start) if has_prev else None
+    next_cursor = encode_cursor(_row_key(items[-1], columns), "next", last) if has_next else None
+    return KeysetPagination(items, per_page, prev_cursor, next_cursor, start)
+
+
+def paginate(query, columns, per_page, ascending=False, numbered=False):
+    """
+    根据配置的分页模式对 `query` 进行分页，按照 `columns` 降序（`ascending` 为真时升序）排列。\n
+    页码或游标从请求参数 `page` / `cursor` 中获取；`numbered` 见 `keyset_paginate`。
+    """
+    if app.config["PAGINATION_MODE"] == "keyset":
+        cursor = request.args.get("cursor")
+        return keyset_paginate(query, columns, cursor, per_page, ascending, numbered)
+    page = request.args.get("page", 1, type=int)
+    query = query.order_by(*[c.asc() if ascending else c.desc() for c in columns])
+    return query.paginate(page, per_page, error_out=False)
+
+
+def next_page_args(pagination):
+    """
+    获取下一页的请求参数（`cursor` 或 `page`），没有下一页时返回 `None`。
+    """
+    if not pagination.has_next:
+        return None
+    if getattr(pagination, "keyset", False):
+        return {"cursor": pagination.next_cursor}
+    return {"page": pagination.next_num}
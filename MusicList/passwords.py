@@ -0,0 +1,139 @@
+"""
+密码哈希。\n
+计算密码哈希需要大量 CPU 时间，统一在专用的线程池中执行：同时计算的数量不超过
+`PASSWORD_HASH_WORKERS`，排队的任务超过 `PASSWORD_HASH_QUEUE` 时直接拒绝（`HashQueueFull`），
+避免登录高峰占满处理请求的线程。`PASSWORD_HASH_WORKERS` 为 `0` 时在当前线程中计算。\n
+哈希参数由 `PASSWORD_HASH_METHOD` 指定，参数更改后，用户下次登录时会使用新参数重新计算哈希。
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+
+class HashQueueFull(Exception):
+    """等待计算的密码哈希过多"""
+
+
+class HashPool:
+    """
+    有界的哈希线程池。\n
+    `workers`: 线程数 \n
+    `queue_size`: 最多排队等待的任务数
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args):
+        """
+        在线程池中执行 `func(*args)` 并等待结果；队列已满时抛出 `HashQueueFull`。
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashQueueFull()
+        with self._lock:
+            self._pending += 1
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def stats(self):
+        """
+        返回线程池的统计信息。
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "pending": self._pending,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(app):
+    """
+    填充密码哈希相关的配置项（已经设置的配置项不会被覆盖）。
+    """
+    app.config.setdefault("PASSWORD_HASH_METHOD", f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}")
+    app.config.setdefault("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1))
+    app.config.setdefault("PASSWORD_HASH_QUEUE", 64)
+
+
+def get_pool():
+    """
+    返回哈希线程池，配置项改变后重新创建；`PASSWORD_HASH_WORKERS` 为 `0` 时返回 `None`。
+    """
+    global _pool
+    workers = current_app.config["PASSWORD_HASH_WORKERS"]
+    queue_size = current_app.config["PASSWORD_HASH_QUEUE"]
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None or (_pool.workers, _pool.queue_size) != (workers, queue_size):
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = HashPool(workers, queue_size)
+        return _pool
+
+
+def _run(func, *args):
+    pool = get_pool()
+    return func(*args) if pool is None else pool.run(func, *args)
+
+
+def hash_password(password):
+    """
+    使用 `PASSWORD_HASH_METHOD` 计算密码哈希。
+    """
+    method = current_app.config["PASSWORD_HASH_METHOD"]
+    return _run(generate_password_hash, password, method)
+
+
+def check_password(pwhash, password):
+    """
+    校验密码。
+    """
+    return _run(check_password_hash, pwhash, password)
+
+
+def _normalize_method(method):
+    """补全省略的 PBKDF2 迭代次数，例如 `pbkdf2:sha256` -> `pbkdf2:sha256:260000`"""
+    parts = method.split(":")
+    if parts[0] == "pbkdf2" and len(parts) == 2:
+        parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ":".join(parts)
+
+
+def needs_rehash(pwhash):
+    """
+    判断密码哈希的参数是否与 `PASSWORD_HASH_METHOD` 不同。
+    """
+    method = pwhash.split("$", 1)[0]
+    return _normalize_method(method) != _normalize_method(
+        current_app.config["PASSWORD_HASH_METHOD"]
+    )
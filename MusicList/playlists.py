@@ -0,0 +1,418 @@
+"""
+歌单中歌曲的顺序。\n
+`MusicList.position` 表示歌曲在歌单中的位置。相邻的歌曲之间留有间隔（新添加的歌曲位于末尾，
+与前一首相隔 `GAP`），移动歌曲时只需要把它的位置改为目标处前后两首歌曲位置的中间值，
+只更新被移动的记录，不需要重新编号整个歌单。\n
+同一处反复插入会使间隔越来越小：间隔小于 `REBALANCE_GAP` 时由后台线程重新编号（`rebalance`），
+完全没有间隔时在移动前立即重新编号。\n
+插入时由触发器设置位置，因此批量添加、导入等不经过视图函数的写操作同样有正确的顺序。
+歌单详情按 `(list_id, position)` 索引分页读取，每一页的开销与歌单的大小无关。
+"""
+
+import threading
+import time
+
+from sqlalchemy import DDL, bindparam, event, inspect, text
+from sqlalchemy.exc import OperationalError
+
+from MusicList import app, db, recommend
+from MusicList.database import is_locked_error
+from MusicList.model import Music, MusicList
+from MusicList.pagination import paginate
+
+app.config.setdefault("PLAYLIST_REBALANCE_DELAY", 1.0)
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+GAP = 1 << 24  # 重新编号后相邻歌曲的间隔
+REBALANCE_GAP = 1 << 8  # 间隔小于该值时安排重新编号
+
+CREATE_STATEMENTS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_list_position_insert AFTER INSERT ON music_list
+    WHEN new.position IS NULL BEGIN
+        UPDATE music_list SET position = (
+            SELECT coalesce(max(position), 0) + {GAP} FROM music_list WHERE list_id = new.list_id
+        ) WHERE "index" = new."index";
+    END
+    """,
+]
+
+DROP_STATEMENTS = ["DROP TRIGGER IF EXISTS music_list_position_insert"]
+
+for statement in CREATE_STATEMENTS:
+    event.listen(MusicList.__table__, "after_create", DDL(statement))
+for statement in DROP_STATEMENTS:
+    event.listen(MusicList.__table__, "before_drop", DDL(statement))
+
+# 分页的排序键，`MusicList.index` 保证顺序唯一
+ORDER = [MusicList.position, MusicList.index.label("entry")]
+
+# 按 `(position, index)` 重新编号（需要 SQLite 3.33 以上的 `UPDATE ... FROM`）
+REBALANCE_STATEMENT = f"""
+    UPDATE music_list SET position = ranked.number * {GAP}
+    FROM (
+        SELECT "index" AS entry,
+        row_number() OVER (PARTITION BY list_id ORDER BY position, "index") AS number
+        FROM music_list {{where}}
+    ) AS ranked
+    WHERE music_list."index" = ranked.entry
+"""
+
+# 为还没有位置的记录按添加的先后顺序（`index`）设置位置，排在歌单中已有位置的歌曲之后
+BACKFILL_STATEMENT = f"""
+    UPDATE music_list SET position = ranked.base + ranked.number * {GAP}
+    FROM (
+        SELECT pending."index" AS entry,
+        row_number() OVER (PARTITION BY pending.list_id ORDER BY pending."index") AS number,
+        (
+            SELECT coalesce(max(placed.position), 0) FROM music_list AS placed
+            WHERE placed.list_id = pending.list_id
+        ) AS base
+        FROM music_list AS pending WHERE pending.position IS NULL
+    ) AS ranked
+    WHERE music_list."index" = ranked.entry
+"""
+
+# 与 `(position, index)` 相邻且不在移动范围 `[first, last]` 内的记录
+NEIGHBOR_STATEMENTS = {
+    "next": text(
+        """
+        SELECT position, "index" FROM music_list
+        WHERE list_id = :list AND (position, "index") > (:position, :index)
+        AND NOT ((position, "index") >= (:first_position, :first)
+            AND (position, "index") <= (:last_position, :last))
+        ORDER BY position, "index" LIMIT 1
+        """
+    ),
+    "prev": text(
+        """
+        SELECT position, "index" FROM music_list
+        WHERE list_id = :list AND (position, "index") < (:position, :index)
+        AND NOT ((position, "index") >= (:first_position, :first)
+            AND (position, "index") <= (:last_position, :last))
+        ORDER BY position DESC, "index" DESC LIMIT 1
+        """
+    ),
+}
+
+UPDATE_POSITION = (
+    MusicList.__table__.update()
+    .where(MusicList.__table__.c.index == bindparam("entry"))
+    .values(position=bindparam("position"))
+)
+
+
+def ensure_schema():
+    """
+    为已有的数据库添加 `position` 列、索引和触发器，并为还没有位置的记录设置位置，返回设置的记录数。\n
+    还没有位置的记录按添加的先后顺序（`index`）排列在歌单的末尾；已有位置的记录不会改变，
+    间隔过小的歌单在移动歌曲时再重新编号，因此可以重复执行。
+    """
+    columns = {c["name"] for c in inspect(db.engine).get_columns("music_list")}
+    if "position" not in columns:
+        db.session.execute(text("ALTER TABLE music_list ADD COLUMN position INTEGER"))
+        db.session.commit()
+    recommend.ensure_schema()
+    count = db.session.execute(text(BACKFILL_STATEMENT)).rowcount
+    db.session.commit()
+    for index in MusicList.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+    # 重新创建触发器，以使用当前的 `GAP`
+    for statement in [*DROP_STATEMENTS, *CREATE_STATEMENTS]:
+        db.session.execute(text(statement))
+    db.session.commit()
+    return count
+
+
+def entries(list_index):
+    """
+    歌单中的歌曲（未排序），每一行包括歌曲的各列以及 `position` 和 `entry`（`MusicList.index`）。
+    """
+    return (
+        db.session.query(
+            Music.index,
+            Music.music_name,
+            Music.artist,
+            Music.link,
+            MusicList.position,
+            ORDER[1],
+        )
+        .join(MusicList, MusicList.music_id == Music.index)
+        .filter(MusicList.list_id == list_index)
+    )
+
+
+def page(list_index, per_page=PAGE_SIZE):
+    """
+    按顺序分页读取歌单中的歌曲，页码或游标从请求参数中获取。\n
+    `start` 为当前页第一首歌曲的序号（从 1 开始）。游标分页时序号记录在游标中，
+    只有游标中没有序号时才统计之前的歌曲数。
+    """
+    pagination = paginate(entries(list_index), ORDER, per_page, ascending=True, numbered=True)
+    if not getattr(pagination, "keyset", False):
+        pagination.start = (pagination.page - 1) * per_page + 1
+    elif pagination.start is None:
+        if pagination.items:
+            first = pagination.items[0]
+            pagination.start = ordinal(list_index, first.position, first.entry)
+        else:
+            pagination.start = 1
+    return pagination
+
+
+def to_dict(row):
+    """JSON 接口中的一首歌曲"""
+    return {
+        "index": row.index,
+        "entry": row.entry,
+        "music_name": row.music_name,
+        "artist": row.artist,
+        "link": row.link,
+        "position": row.position,
+    }
+
+
+def ordinal(list_index, position, entry, session=None):
+    """
+    位置为 `(position, entry)` 的歌曲在歌单中的序号（从 1 开始），只读取索引。
+    """
+    session = session or db.session
+    before = session.execute(
+        text(
+            """
+            SELECT count(*) FROM music_list
+            WHERE list_id = :list AND (position, "index") < (:position, :entry)
+            """
+        ),
+        {"list": list_index, "position": position, "entry": entry},
+    ).scalar()
+    return before + 1
+
+
+def entry_at(list_index, number, session=None):
+    """
+    歌单中第 `number` 首（从 1 开始）歌曲的 `MusicList.index`，不存在时返回 `None`。
+    """
+    if number < 1:
+        return None
+    session = session or db.session
+    return session.execute(
+        text(
+            """
+            SELECT "index" FROM music_list WHERE list_id = :list
+            ORDER BY position, "index" LIMIT 1 OFFSET :offset
+            """
+        ),
+        {"list": list_index, "offset": number - 1},
+    ).scalar()
+
+
+def _lock(session, list_index):
+    """
+    在读取位置之前获得写锁：SQLite 的事务在第一次写入时才加锁，
+    否则并发的移动或重新编号可能基于已经过期的位置进行写入。
+    """
+    session.execute(
+        text('UPDATE list SET share = share WHERE "index" = :list'), {"list": list_index}
+    )
+
+
+def _key(session, list_index, entry):
+    row = session.execute(
+        text('SELECT position, "index" FROM music_list WHERE "index" = :entry AND list_id = :list'),
+        {"entry": entry, "list": list_index},
+    ).first()
+    if row is None:
+        raise ValueError("歌曲不在歌单中")
+    return tuple(row)
+
+
+def _neighbor(session, list_index, key, direction, block):
+    params = {
+        "list": list_index,
+        "position": key[0],
+        "index": key[1],
+        "first_position": block[0][0],
+        "first": block[0][1],
+        "last_position": block[-1][0],
+        "last": block[-1][1],
+    }
+    row = session.execute(NEIGHBOR_STATEMENTS[direction], params).first()
+    return tuple(row) if row is not None else None
+
+
+def _bounds(session, list_index, block, after, before):
+    """移动后 `block` 前后两首歌曲的位置，在开头或末尾时为 `None`"""
+    if before is not None:
+        high = _key(session, list_index, before)
+        if block[0] <= high <= block[-1]:
+            raise ValueError("不能移动到所选的歌曲之间")
+        low = _neighbor(session, list_index, high, "prev", block)
+    elif after is not None:
+        low = _key(session, list_index, after)
+        if block[0] <= low <= block[-1]:
+            raise ValueError("不能移动到所选的歌曲之间")
+        high = _neighbor(session, list_index, low, "next", block)
+    else:
+        low = None
+        high = _neighbor(session, list_index, (float("-inf"), 0), "next", block)
+    return (low[0] if low else None), (high[0] if high else None)
+
+
+def _block(session, list_index, first, last):
+    """从 `first` 到 `last`（包括两端）的连续一段歌曲，按顺序排列的 `(position, index)`"""
+    first_key = _key(session, list_index, first)
+    last_key = _key(session, list_index, last)
+    first_key, last_key = min(first_key, last_key), max(first_key, last_key)
+    rows = session.execute(
+        text(
+            """
+            SELECT position, "index" FROM music_list
+            WHERE list_id = :list AND (position, "index") >= (:first_position, :first)
+            AND (position, "index") <= (:last_position, :last)
+            ORDER BY position, "index"
+            """
+        ),
+        {
+            "list": list_index,
+            "first_position": first_key[0],
+            "first": first_key[1],
+            "last_position": last_key[0],
+            "last": last_key[1],
+        },
+    )
+    return [tuple(row) for row in rows]
+
+
+def _place(session, list_index, first, last, after, before):
+    """
+    将从 `first` 到 `last` 的一段歌曲移动到 `after` 之后或 `before` 之前，
+    两者都为 `None` 时移动到开头。返回 `(updated, gap)`：更新的记录数，移动后最小的间隔。
+    """
+    _lock(session, list_index)
+    block = _block(session, list_index, first, last)
+    count = len(block)
+    updated = 0
+    for attempt in range(2):
+        low, high = _bounds(session, list_index, block, after, before)
+        if low is None and high is None:
+            return updated, None  # 歌单中只有要移动的歌曲
+        if low is None:
+            low = high - (count + 1) * GAP
+        if high is None:
+            high = low + (count + 1) * GAP
+        step = (high - low) // (count + 1)
+        if step >= 1:
+            break
+        if attempt or count >= GAP:
+            raise ValueError("要移动的歌曲过多")
+        # 没有间隔，先重新编号（`block` 中的位置随之改变）
+        updated += rebalance(list_index, session)
+        block = _block(session, list_index, first, last)
+    params = [
+        {"entry": entry, "position": low + step * (i + 1)} for i, (_, entry) in enumerate(block)
+    ]
+    session.execute(UPDATE_POSITION, params)
+    return updated + count, step
+
+
+def move(list_index, entry, after=None, before=None, session=None):
+    """
+    将歌单中的一首歌曲（`MusicList.index`）移动到 `after` 之后或 `before` 之前（都为 `None` 时移动到开头）。
+    通常只更新一条记录。不提交事务，返回 `(updated, gap)`，`gap` 小于 `REBALANCE_GAP` 时应安排重新编号。
+    """
+    session = session or db.session
+    return _place(session, list_index, entry, entry, after, before)
+
+
+def move_range(list_index, first, last, after=None, before=None, session=None):
+    """
+    将歌单中从 `first` 到 `last`（包括两端）的连续一段歌曲整体移动，参数和返回值同 `move`。
+    """
+    session = session or db.session
+    return _place(session, list_index, first, last, after, before)
+
+
+def rebalance(list_index, session=None):
+    """
+    按现有的顺序将歌单重新编号为 `GAP` 的倍数（不提交事务），返回更新的记录数。
+    """
+    session = session or db.session
+    statement = text(REBALANCE_STATEMENT.format(where="WHERE list_id = :list"))
+    return session.execute(statement, {"list": list_index}).rowcount
+
+
+def crowded_lists(min_gap=REBALANCE_GAP):
+    """
+    相邻歌曲的间隔小于 `min_gap` 的歌单（需要扫描整个 `music_list` 表）。
+    """
+    rows = db.session.execute(
+        text(
+            """
+            SELECT DISTINCT list_id FROM (
+                SELECT list_id, position - lag(position) OVER (
+                    PARTITION BY list_id ORDER BY position, "index"
+                ) AS gap FROM music_list
+            ) WHERE gap < :min_gap
+            """
+        ),
+        {"min_gap": min_gap},
+    )
+    return [row[0] for row in rows]
+
+
+class Rebalancer:
+    """
+    在后台重新编号间隔过小的歌单（线程安全）。
+    等待 `PLAYLIST_REBALANCE_DELAY` 秒后再处理，同一歌单的多次请求只重新编号一次。
+    """
+
+    def __init__(self):
+        self.rebalanced = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, list_index):
+        with self._lock:
+            self._pending.add(list_index)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="playlist-rebalance", daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(app.config["PLAYLIST_REBALANCE_DELAY"])
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for list_index in sorted(pending):
+                try:
+                    with app.app_context():
+                        rebalance(list_index)
+                        db.session.commit()
+                    with self._lock:
+                        self.rebalanced += 1
+                except OperationalError as error:
+                    if not is_locked_error(error):
+                        app.logger.exception("歌单 %d 重新编号失败", list_index)
+                        continue
+                    # 数据库被锁定，稍后重试
+                    with self._lock:
+                        self._pending.add(list_index)
+                    self._wakeup.set()
+                except Exception:
+                    app.logger.exception("歌单 %d 重新编号失败", list_index)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._pending), "rebalanced": self.rebalanced}
+
+
+rebalancer = Rebalancer()
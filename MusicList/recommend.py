@@ -0,0 +1,250 @@
+"""
+歌曲和歌单推荐。\n
+把 `music_list` 表看作歌单 × 歌曲的稀疏矩阵，由 SQLite 对矩阵做自连接聚合，得到
+歌曲 × 歌曲（同时出现在多少个歌单中）和歌单 × 歌单（有多少首相同的歌曲）的共现次数，
+再除以两者的模长得到余弦相似度，每首歌曲和每个歌单只保存前 `TOP_K` 个结果
+（`SimilarMusic` 和 `SimilarList`），页面上通过主键直接读取。
+只有公开歌单参与推荐，私密歌单的内容不会通过推荐结果泄露（私密歌单本身仍然可以得到相似的公开歌单）。\n
+`music_list` 表上的触发器会把增删的记录写入 `recommendation_dirty`（更改歌单私密性时写入歌单中的所有记录），重新计算时只更新受影响的歌曲和歌单。
+"""
+
+import heapq
+import itertools
+import math
+from operator import itemgetter
+
+from sqlalchemy import DDL, event, text
+
+from MusicList import db
+from MusicList.model import List, Music, MusicList, SimilarList, SimilarMusic, User
+
+TOP_K = 10
+DIRTY_TABLE = "recommendation_dirty"
+
+CREATE_STATEMENTS = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {DIRTY_TABLE} (
+        id INTEGER PRIMARY KEY, list_id INTEGER, music_id INTEGER
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_list_dirty_insert AFTER INSERT ON music_list BEGIN
+        INSERT INTO {DIRTY_TABLE}(list_id, music_id) VALUES (new.list_id, new.music_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_list_dirty_delete AFTER DELETE ON music_list BEGIN
+        INSERT INTO {DIRTY_TABLE}(list_id, music_id) VALUES (old.list_id, old.music_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_list_dirty_update
+    AFTER UPDATE OF list_id, music_id ON music_list BEGIN
+        INSERT INTO {DIRTY_TABLE}(list_id, music_id) VALUES (old.list_id, old.music_id);
+        INSERT INTO {DIRTY_TABLE}(list_id, music_id) VALUES (new.list_id, new.music_id);
+    END
+    """,
+    # 只有公开歌单参与推荐，更改私密性时歌单中的所有歌曲都受影响
+    f"""
+    CREATE TRIGGER IF NOT EXISTS list_dirty_share
+    AFTER UPDATE OF share ON list WHEN old.share IS NOT new.share BEGIN
+        INSERT INTO {DIRTY_TABLE}(list_id, music_id)
+        SELECT list_id, music_id FROM music_list WHERE list_id = new."index";
+    END
+    """,
+]
+
+DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS music_list_dirty_insert",
+    "DROP TRIGGER IF EXISTS music_list_dirty_delete",
+    "DROP TRIGGER IF EXISTS music_list_dirty_update",
+    "DROP TRIGGER IF EXISTS list_dirty_share",
+    f"DROP TABLE IF EXISTS {DIRTY_TABLE}",
+]
+
+for statement in CREATE_STATEMENTS:
+    event.listen(MusicList.__table__, "after_create", DDL(statement))
+for statement in DROP_STATEMENTS:
+    event.listen(MusicList.__table__, "before_drop", DDL(statement))
+
+# 共现次数：与 `items` 中的歌曲同在一个公开歌单中的其他歌曲，与 `items` 中的歌单包含相同歌曲的其他公开歌单
+PAIR_QUERIES = {
+    "music": """
+        SELECT a.music_id, b.music_id, count(*) FROM music_list AS a
+        JOIN list ON list."index" = a.list_id AND list.share = 1
+        JOIN music_list AS b ON b.list_id = a.list_id AND b.music_id != a.music_id
+        WHERE a.music_id IN ({items})
+        GROUP BY a.music_id, b.music_id
+        ORDER BY a.music_id
+    """,
+    "list": """
+        SELECT a.list_id, b.list_id, count(*) FROM music_list AS a
+        JOIN music_list AS b ON b.music_id = a.music_id AND b.list_id != a.list_id
+        JOIN list ON list."index" = b.list_id AND list.share = 1
+        WHERE a.list_id IN ({items})
+        GROUP BY a.list_id, b.list_id
+        ORDER BY a.list_id
+    """,
+}
+
+
+def ensure_schema():
+    """
+    为已有的数据库创建推荐结果表和记录变更的触发器。
+    """
+    SimilarMusic.__table__.create(bind=db.engine, checkfirst=True)
+    SimilarList.__table__.create(bind=db.engine, checkfirst=True)
+    for index in [*SimilarMusic.__table__.indexes, *SimilarList.__table__.indexes]:
+        index.create(bind=db.engine, checkfirst=True)
+    # 旧版本的更新触发器在调整歌曲顺序时也会触发，需要重新创建
+    db.session.execute(text("DROP TRIGGER IF EXISTS music_list_dirty_update"))
+    for statement in CREATE_STATEMENTS:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def _column(query):
+    return {row[0] for row in db.session.execute(text(query)) if row[0] is not None}
+
+
+def _in(ids):
+    return ", ".join(str(int(i)) for i in ids)
+
+
+def _members(column, of_column, ids, batch_size):
+    """`music_list` 中 `of_column` 在 `ids` 中的记录的 `column`"""
+    found = set()
+    ids = sorted(ids)
+    for start in range(0, len(ids), batch_size):
+        found |= _column(
+            f"SELECT DISTINCT {column} FROM music_list "
+            f"WHERE {of_column} IN ({_in(ids[start:start + batch_size])})"
+        )
+    return found
+
+
+def affected_items(watermark, batch_size=500):
+    """
+    根据 `id <= watermark` 的变更记录，返回需要重新计算的 `(歌曲, 歌单)`。\n
+    一首歌曲加入或移出歌单后，它所在的歌单数变化，与它同在一个歌单中的歌曲的相似度都会改变；
+    歌单的歌曲数变化后，与它有相同歌曲的歌单的相似度也都会改变。
+    """
+    changed_lists = _column(
+        f"SELECT DISTINCT list_id FROM {DIRTY_TABLE} WHERE id <= {int(watermark)}"
+    )
+    changed_musics = _column(
+        f"SELECT DISTINCT music_id FROM {DIRTY_TABLE} WHERE id <= {int(watermark)}"
+    )
+    # 包含变更歌曲的歌单，以及变更的歌单中的歌曲
+    related_lists = _members("list_id", "music_id", changed_musics, batch_size)
+    related_musics = _members("music_id", "list_id", changed_lists, batch_size)
+    musics = changed_musics | _members(
+        "music_id", "list_id", changed_lists | related_lists, batch_size
+    )
+    lists = changed_lists | related_lists | _members(
+        "list_id", "music_id", related_musics, batch_size
+    )
+    return musics, lists
+
+
+def _sizes(kind):
+    """每首歌曲所在的公开歌单数，或每个歌单的歌曲数"""
+    if kind == "music":
+        query = """
+            SELECT music_id, count(*) FROM music_list
+            JOIN list ON list."index" = music_list.list_id AND list.share = 1
+            GROUP BY music_id
+        """
+    else:
+        query = "SELECT list_id, count(*) FROM music_list GROUP BY list_id"
+    return dict(db.session.execute(text(query)).fetchall())
+
+
+def _top_k(pairs, sizes, top_k):
+    """
+    由按 `item` 排序的 `(item, other, 共现次数)` 计算余弦相似度，返回每个 `item` 的前 `top_k` 个结果。
+    """
+    for item, group in itertools.groupby(pairs, key=itemgetter(0)):
+        scored = (
+            (shared / math.sqrt(sizes[item] * sizes[other]), -other)
+            for _, other, shared in group
+        )
+        for rank, (score, other) in enumerate(heapq.nlargest(top_k, scored)):
+            yield item, rank, -other, score
+
+
+def _rebuild(kind, items, top_k, batch_size):
+    """重新计算 `items` 的推荐结果，每批一个事务，返回写入的记录数"""
+    model, key = (SimilarMusic, "music_id") if kind == "music" else (SimilarList, "list_id")
+    table = model.__table__
+    sizes = _sizes(kind)
+    items = sorted(items)
+    written = 0
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        db.session.execute(table.delete().where(table.c[key].in_(batch)))
+        pairs = db.session.execute(text(PAIR_QUERIES[kind].format(items=_in(batch))))
+        rows = [
+            {key: item, "rank": rank, "other_id": other, "score": score}
+            for item, rank, other, score in _top_k(pairs, sizes, top_k)
+        ]
+        if rows:
+            db.session.execute(table.insert(), rows)
+        db.session.commit()
+        written += len(rows)
+    return written
+
+
+def rebuild(full=False, top_k=TOP_K, batch_size=500):
+    """
+    重新计算推荐结果。默认只更新自上次计算以来受影响的歌曲和歌单，`full` 为真时全部重新计算。\n
+    返回重新计算的歌曲数、歌单数和写入的记录数。
+    """
+    ensure_schema()
+    watermark = db.session.execute(text(f"SELECT max(id) FROM {DIRTY_TABLE}")).scalar() or 0
+    if full:
+        musics = _column("SELECT DISTINCT music_id FROM music_list")
+        lists = _column("SELECT DISTINCT list_id FROM music_list")
+        # 歌单或歌曲被清空后不会再出现在 `music_list` 中，也需要清除旧的结果
+        db.session.execute(SimilarMusic.__table__.delete())
+        db.session.execute(SimilarList.__table__.delete())
+    else:
+        musics, lists = affected_items(watermark, batch_size)
+    stats = {
+        "musics": len(musics),
+        "lists": len(lists),
+        "similar_music": _rebuild("music", musics, top_k, batch_size),
+        "similar_list": _rebuild("list", lists, top_k, batch_size),
+    }
+    # 计算期间新增的变更留到下一次处理
+    db.session.execute(text(f"DELETE FROM {DIRTY_TABLE} WHERE id <= {int(watermark)}"))
+    db.session.commit()
+    return stats
+
+
+def similar_musics(music_index, limit=TOP_K):
+    """
+    经常与这首歌曲出现在同一个歌单中的歌曲。
+    """
+    return (
+        Music.query.join(SimilarMusic, SimilarMusic.other_id == Music.index)
+        .filter(SimilarMusic.music_id == music_index)
+        .order_by(SimilarMusic.rank)
+        .limit(limit)
+        .all()
+    )
+
+
+def similar_lists(list_index, limit=TOP_K):
+    """
+    与这个歌单相似的公开歌单，以及歌单创建者的用户名。
+    """
+    return (
+        db.session.query(List, User.username)
+        .join(SimilarList, SimilarList.other_id == List.index)
+        .join(User, User.index == List.owner)
+        .filter(SimilarList.list_id == list_index, List.share == 1)
+        .order_by(SimilarList.rank)
+        .limit(limit)
+        .all()
+    )
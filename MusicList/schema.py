@@ -0,0 +1,529 @@
+"""
+数据库结构维护。\n
+包括：为已有的数据库补建索引和外键约束；清理孤立的记录；检查各页面使用的查询是否仍需要全表扫描；
+检查数据库是否缺少模型中的表和列（缺少时处理第一个请求前报错，提示运行 `flask upgrade-db`）。
+"""
+
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, inspect, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from MusicList import app, db, archive, artists, playlists
+from MusicList.model import (
+    User,
+    Music,
+    List,
+    MusicList,
+    Message,
+    Comment,
+    FavoriteList,
+    FavoriteMessage,
+    MessageScore,
+    SimilarMusic,
+    SimilarList,
+    Artist,
+    MusicArtist,
+    MessageArchive,
+    CommentArchive,
+    music_content_key,
+)
+from MusicList.pagination import seek
+
+
+def _remove_duplicates(model, columns):
+    """
+    删除在 `columns` 上重复的记录，只保留 `index` 最小的一条。\n
+    返回删除的记录数。
+    """
+    keep = (
+        db.session.query(func.min(model.index))
+        .group_by(*[getattr(model, c) for c in columns])
+        .subquery()
+    )
+    return (
+        model.query.filter(model.index.notin_(db.session.query(keep)))
+        .delete(synchronize_session=False)
+    )
+
+
+def remove_duplicate_links():
+    """
+    删除关联表中重复的记录（创建唯一索引之前），返回各表删除的记录数。
+    """
+    removed = {}
+    for model, columns in [
+        (MusicList, ["list_id", "music_id"]),
+        (FavoriteList, ["list_id", "user_id"]),
+        (FavoriteMessage, ["message_id", "user_id"]),
+    ]:
+        removed[model.__tablename__] = _remove_duplicates(model, columns)
+    db.session.commit()
+    return removed
+
+
+def upgrade_indexes():
+    """
+    为已有的数据库创建缺少的索引。\n
+    创建唯一索引前会先删除关联表中的重复记录；重名的用户无法自动合并，
+    此时跳过 `User.username` 的唯一索引。缺少列的索引（需要先运行对应的迁移命令）也会跳过。\n
+    返回 `(created, removed, skipped)`：新建的索引名，各表删除的重复记录数，跳过的索引名。
+    """
+    removed = remove_duplicate_links()
+    duplicated_username = (
+        db.session.query(User.username)
+        .group_by(User.username)
+        .having(func.count() > 1)
+        .first()
+    )
+    existing = {
+        row[0] for row in db.session.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index'")
+        )
+    }
+    inspector = inspect(db.engine)
+    created, skipped = [], []
+    for table in db.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            missing_column = any(column.name not in columns for column in index.columns)
+            duplicated = index.name == "ix_user_username" and duplicated_username
+            if missing_column or duplicated:
+                skipped.append(index.name)
+                continue
+            index.create(bind=db.engine)
+            created.append(index.name)
+    return created, removed, skipped
+
+
+def add_music_content_key(batch_size=10000):
+    """
+    为已有的数据库添加 `Music.content_key` 列，并为缺少去重键的歌曲计算去重键。\n
+    返回更新的歌曲数量。
+    """
+    columns = {column["name"] for column in inspect(db.engine).get_columns("music")}
+    if "content_key" not in columns:
+        db.session.execute(text("ALTER TABLE music ADD COLUMN content_key VARCHAR(40)"))
+        db.session.commit()
+    updated = 0
+    last = 0
+    while True:
+        rows = (
+            db.session.query(Music.index, Music.music_name, Music.artist, Music.link)
+            .filter(Music.index > last, Music.content_key.is_(None))
+            .order_by(Music.index)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        db.session.execute(
+            Music.__table__.update()
+            .where(Music.__table__.c.index == bindparam("music_index"))
+            .values(content_key=bindparam("key")),
+            [dict(music_index=row[0], key=music_content_key(*row[1:])) for row in rows],
+        )
+        db.session.commit()
+        updated += len(rows)
+        last = rows[-1][0]
+    return updated
+
+
+def merge_duplicate_music():
+    """
+    合并去重键相同的歌曲：保留 `index` 最小的一条，歌单中的记录改为指向保留的歌曲
+    （歌单中已经有保留的歌曲时直接删除），然后删除其余的歌曲并创建唯一索引。\n
+    返回删除的歌曲数量。
+    """
+    statements = [
+        """
+        CREATE TEMP TABLE music_merge AS
+        SELECT music."index" AS old, keep.new AS new
+        FROM music JOIN (
+            SELECT content_key, min("index") AS new FROM music
+            GROUP BY content_key HAVING count(*) > 1
+        ) AS keep ON music.content_key = keep.content_key
+        WHERE music."index" != keep.new
+        """,
+        "CREATE UNIQUE INDEX temp.ix_music_merge_old ON music_merge (old)",
+        # 更新后会与已有记录重复的行保持不变，在下一步中删除
+        """
+        UPDATE OR IGNORE music_list
+        SET music_id = (SELECT new FROM music_merge WHERE old = music_list.music_id)
+        WHERE music_id IN (SELECT old FROM music_merge)
+        """,
+        "DELETE FROM music_list WHERE music_id IN (SELECT old FROM music_merge)",
+        'DELETE FROM music WHERE "index" IN (SELECT old FROM music_merge)',
+    ]
+    try:
+        for statement in statements[:-1]:
+            db.session.execute(text(statement))
+        removed = db.session.execute(text(statements[-1])).rowcount
+        db.session.commit()
+    finally:
+        db.session.execute(text("DROP TABLE IF EXISTS temp.music_merge"))
+    db.session.execute(text("DROP INDEX IF EXISTS ix_music_content"))
+    # 其他索引的列可能还没有添加（如 `artist_id`），由对应的迁移创建
+    for index in Music.__table__.indexes:
+        if index.name == "ix_music_content_key":
+            index.create(bind=db.engine, checkfirst=True)
+    return removed
+
+
+# 需要清理孤立记录的关联表：`(模型, [(外键列, 被引用的表)])`
+ORPHAN_REFERENCES = [
+    (MusicList, [("list_id", List), ("music_id", Music)]),
+    (FavoriteList, [("list_id", List), ("user_id", User)]),
+    (Comment, [("parent_massage", Message)]),
+    (FavoriteMessage, [("message_id", Message), ("user_id", User)]),
+]
+
+
+def remove_orphans(batch_size=10000):
+    """
+    分批删除引用了不存在的歌单、歌曲、帖子或用户的记录，每批一个事务，避免长时间锁住数据库。\n
+    返回各表删除的记录数。
+    """
+    removed = {}
+    for model, references in ORPHAN_REFERENCES:
+        table = model.__table__
+        orphaned = [
+            getattr(model, column).isnot(None)
+            & ~parent.query.filter(parent.index == getattr(model, column)).exists()
+            for column, parent in references
+        ]
+        batch = (
+            db.session.query(table.c.index)
+            .filter(db.or_(*orphaned))
+            .limit(batch_size)
+            .subquery()
+        )
+        statement = table.delete().where(table.c.index.in_(db.session.query(batch)))
+        removed[table.name] = 0
+        while True:
+            count = db.session.execute(statement).rowcount
+            db.session.commit()
+            removed[table.name] += count
+            if count < batch_size:
+                break
+    return removed
+
+
+def _rebuild_table(cursor, table):
+    """
+    按照模型的定义重建数据表（SQLite 不能为已有的表添加外键约束），保留所有记录、索引和触发器。
+    旧表中还没有的列（需要先运行对应的迁移命令）使用默认值。
+    """
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table.name})")}
+    columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in existing)
+    triggers = [
+        row[0] for row in cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table.name,)
+        )
+    ]
+    ddl = str(CreateTable(table).compile(dialect=db.engine.dialect)).strip()
+    ddl = ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_new ", 1)
+    cursor.execute(ddl)
+    cursor.execute(
+        f"INSERT INTO {table.name}_new ({columns}) SELECT {columns} FROM {table.name}"
+    )
+    cursor.execute(f"DROP TABLE {table.name}")
+    cursor.execute(f"ALTER TABLE {table.name}_new RENAME TO {table.name}")
+    for trigger in triggers:
+        cursor.execute(trigger)
+
+
+def _rebuild_tables(tables, after=None):
+    """
+    在一个事务中重建 `tables` 并重新创建索引，完成后检查外键约束。\n
+    `after`: 提交前以游标为参数调用，用于修正重建后的数据
+    """
+    db.session.remove()
+    # 重建数据表时需要关闭外键检查，而 `PRAGMA foreign_keys` 在事务中无效，因此直接控制事务。
+    # 其他表上的触发器可能引用正在重建的表，重命名时不检查这些触发器
+    connection = db.engine.raw_connection()
+    try:
+        connection.isolation_level = None
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("PRAGMA legacy_alter_table = ON")
+        cursor.execute("BEGIN")
+        try:
+            for table in tables:
+                _rebuild_table(cursor, table)
+                for index in table.indexes:
+                    cursor.execute(
+                        str(CreateIndex(index).compile(dialect=db.engine.dialect))
+                    )
+            if after is not None:
+                after(cursor)
+            violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise RuntimeError(f"仍有 {len(violations)} 条记录违反外键约束")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.execute("PRAGMA legacy_alter_table = OFF")
+            cursor.execute("PRAGMA foreign_keys = ON")
+            cursor.close()
+    finally:
+        connection.close()
+
+
+def upgrade_foreign_keys():
+    """
+    为已有的数据库添加外键约束：先清理孤立的记录，然后重建缺少外键约束的数据表，并重新创建索引
+    （包括唯一索引，因此同样先删除关联表中重复的记录）。\n
+    返回 `(removed, rebuilt)`：各表删除的孤立记录和重复记录数，重建的数据表名。
+    """
+    removed = remove_orphans()
+    for table, count in remove_duplicate_links().items():
+        removed[table] = removed.get(table, 0) + count
+    tables = [model.__table__ for model, _ in ORPHAN_REFERENCES]
+    inspector = inspect(db.engine)
+    pending = [table for table in tables if not inspector.get_foreign_keys(table.name)]
+    if pending:
+        _rebuild_tables(pending)
+    return removed, [table.name for table in pending]
+
+
+# 使用 `AUTOINCREMENT` 的表及其归档表：`index` 不能与已归档的记录重复
+AUTOINCREMENT_TABLES = [(Message, MessageArchive), (Comment, CommentArchive)]
+
+
+def upgrade_autoincrement():
+    """
+    重建还没有使用 `AUTOINCREMENT` 的 `message` 和 `comment` 表，并把 `sqlite_sequence`
+    设置为原表和归档表中最大的 `index`，之后新的记录不会再使用已删除或已归档的记录的 `index`。\n
+    需要先创建归档表（见 `MusicList.archive.ensure_schema`）。返回重建的数据表名。
+    """
+    pending = [
+        (model.__table__, archived.__table__)
+        for model, archived in AUTOINCREMENT_TABLES
+        if "AUTOINCREMENT" not in (
+            db.session.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": model.__tablename__},
+            ).scalar() or ""
+        ).upper()
+    ]
+    if not pending:
+        return []
+
+    def seed_sequence(cursor):
+        for table, archived in pending:
+            # 插入记录时 SQLite 已经记录了原表中最大的 `index`，这里再考虑归档表
+            last = cursor.execute(
+                f'SELECT max(seq) FROM (SELECT max("index") AS seq FROM {table.name} '
+                f'UNION ALL SELECT max("index") FROM {archived.name})'
+            ).fetchone()[0]
+            if last is None:
+                continue
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table.name,))
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table.name, last)
+            )
+
+    _rebuild_tables([table for table, _ in pending], after=seed_sequence)
+    return [table.name for table, _ in pending]
+
+
+def missing_schema():
+    """
+    数据库中缺少的模型的表和列（`表` 或 `表.列`），需要运行 `flask upgrade-db`。
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(
+            f"{table.name}.{column.name}" for column in table.columns if column.name not in columns
+        )
+    return missing
+
+
+@app.before_first_request
+def check_schema():
+    """
+    旧的数据库缺少新的列时，页面会在查询时才出错，这里在处理第一个请求前给出需要执行的命令。
+    """
+    missing = missing_schema()
+    if missing:
+        raise RuntimeError(
+            f"数据库结构不是最新的（缺少 {', '.join(missing[:5])}"
+            f"{' 等' if len(missing) > 5 else ''}），请先运行 `flask upgrade-db`"
+        )
+
+
+def route_queries():
+    """
+    各页面使用的查询（使用示例参数），用于检查查询计划。\n
+    返回 `(名称, 查询)` 的列表。
+    """
+    now = datetime.now()
+    message_columns = [
+        Message.index,
+        Message.time,
+        Message.title,
+        Message.like_count,
+        Message.comment_count,
+        User.username,
+    ]
+    message_key = [Message.time, Message.index]
+    comment_key = [Comment.time, Comment.index]
+    return [
+        ("login/register: 用户名", User.query.filter(User.username == "")),
+        ("user: 用户", User.query.filter(User.index == 1)),
+        ("search_music: 最近添加", seek(Music.query, [Music.index], "next", [1])),
+        ("search_result: 歌曲去重", Music.query.filter_by(content_key="")),
+        ("music_detail: 歌曲", Music.query.filter(Music.index == 1)),
+        (
+            "music_detail: 推荐歌曲",
+            Music.query.join(SimilarMusic, SimilarMusic.other_id == Music.index)
+            .filter(SimilarMusic.music_id == 1)
+            .order_by(SimilarMusic.rank),
+        ),
+        (
+            "music_detail: 艺术家",
+            Artist.query.join(MusicArtist, MusicArtist.artist_id == Artist.index)
+            .filter(MusicArtist.music_id == 1)
+            .order_by(MusicArtist.position),
+        ),
+        (
+            "artist_list: 艺术家",
+            seek(
+                Artist.query.filter(Artist.song_count > 0),
+                [Artist.list_count, Artist.index], "next", [1, 1],
+            ),
+        ),
+        ("artist_detail: 艺术家", Artist.query.filter(Artist.index == 1)),
+        (
+            "artist_detail: 艺术家的歌曲",
+            seek(artists.songs(1), artists.SONG_ORDER, "next", [1]),
+        ),
+        ("search_result: 艺术家去重", Artist.query.filter(Artist.name_key == "")),
+        ("music_lists: 用户歌单", List.query.filter_by(owner=1)),
+        ("music_lists: 同名歌单", List.query.filter_by(owner=1, list_name="")),
+        (
+            "list_detail: 歌单歌曲",
+            seek(playlists.entries(1), playlists.ORDER, "next", [1, 1], ascending=True),
+        ),
+        ("add_music_to_list: 歌曲记录", MusicList.query.filter_by(music_id=1, list_id=1)),
+        ("change_privacy: 歌单收藏", FavoriteList.query.filter(FavoriteList.list_id == 1)),
+        ("user_lists: 公开歌单", List.query.filter_by(owner=1, share=1)),
+        ("user_list_detail: 收藏情况", FavoriteList.query.filter_by(list_id=1, user_id=1)),
+        (
+            "user_list_detail: 相似歌单",
+            List.query.join(SimilarList, SimilarList.other_id == List.index)
+            .join(User, User.index == List.owner)
+            .filter(SimilarList.list_id == 1, List.share == 1)
+            .order_by(SimilarList.rank),
+        ),
+        (
+            "favorite_music_lists: 收藏的歌单",
+            List.query.join(User, User.index == List.owner)
+            .join(FavoriteList, FavoriteList.list_id == List.index)
+            .filter(FavoriteList.user_id == 1),
+        ),
+        (
+            "message_list: 最新消息",
+            seek(
+                Message.query.join(User, Message.owner == User.index)
+                .with_entities(*message_columns),
+                message_key, "next", [now, 1],
+            ),
+        ),
+        (
+            "hot_message_list: 热门消息",
+            seek(
+                MessageScore.query.join(Message, Message.index == MessageScore.message_id)
+                .join(User, Message.owner == User.index)
+                .with_entities(*message_columns, MessageScore.score, MessageScore.message_id),
+                [MessageScore.score, MessageScore.message_id], "next", [1.0, 1],
+            ),
+        ),
+        ("message_detail: 更新热度", MessageScore.query.filter(MessageScore.message_id == 1)),
+        (
+            "message_detail: 评论",
+            Comment.query.join(User, User.index == Comment.owner)
+            .filter(Comment.parent_massage == 1)
+            .order_by(Comment.time.desc()),
+        ),
+        ("message_detail: 点赞情况", FavoriteMessage.query.filter_by(message_id=1, user_id=1)),
+        ("message_detail: 已归档的消息", MessageArchive.query.filter(MessageArchive.index == 1)),
+        (
+            "message_detail: 已归档的评论",
+            archive.comments(1, ["index", "text", "time", "owner"])
+            .order_by(CommentArchive.time.desc()),
+        ),
+        ("delete_message: 级联删除评论", Comment.query.filter(Comment.parent_massage == 1)),
+        ("delete_list: 级联删除歌曲", MusicList.query.filter(MusicList.list_id == 1)),
+        ("dedupe-music: 级联删除歌曲", MusicList.query.filter(MusicList.music_id == 1)),
+        (
+            "user_message: 用户消息",
+            seek(
+                Message.query.join(User, Message.owner == User.index)
+                .filter(Message.owner == 1)
+                .with_entities(*message_columns),
+                message_key, "next", [now, 1],
+            ),
+        ),
+        ("user_message: 已归档的消息", MessageArchive.query.filter(MessageArchive.owner == 1)),
+        (
+            "user_message: 包括已归档的消息",
+            seek(
+                *archive.user_feed(1, ["index", "time", "title", "owner", "like_count"]),
+                "next", [now, 1],
+            ),
+        ),
+        (
+            "user_comment: 用户评论",
+            seek(
+                Comment.query.join(User, Comment.owner == User.index)
+                .join(Message, Message.index == Comment.parent_massage)
+                .filter(Comment.owner == 1),
+                comment_key, "next", [now, 1],
+            ),
+        ),
+        (
+            "favorite_message_list: 点赞的消息",
+            seek(
+                Message.query.join(User, Message.owner == User.index)
+                .join(FavoriteMessage, FavoriteMessage.message_id == Message.index)
+                .filter(FavoriteMessage.user_id == 1)
+                .with_entities(*message_columns),
+                message_key, "next", [now, 1],
+            ),
+        ),
+    ]
+
+
+def explain(query):
+    """
+    返回查询的 `EXPLAIN QUERY PLAN` 结果（每一步的描述）。
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = compiled.construct_params()
+    processors = compiled._bind_processors
+    values = tuple(
+        processors[name](params[name]) if name in processors else params[name]
+        for name in compiled.positiontup
+    )
+    connection = db.session.connection()
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), values)
+    return [row[-1] for row in rows]
+
+
+def is_full_scan(detail):
+    """
+    判断查询计划中的一步是否为全表扫描（不使用索引的 `SCAN`）。
+    """
+    return detail.startswith("SCAN ") and "USING" not in detail and "VIRTUAL TABLE" not in detail
@@ -0,0 +1,161 @@
+"""
+歌曲全文搜索。\n
+使用 SQLite 的 FTS5 虚拟表 `music_fts` 为 `Music.music_name` 和 `Music.artist` 建立索引，
+通过触发器与 `music` 表保持同步，搜索结果按照 bm25 相关度排序并分页。\n
+索引使用 `trigram` 分词（需要 SQLite 3.34 以上），可以匹配词中的任意部分，
+适用于不以空格分词的中文（如 `里香` 可以找到 `七里香`）。少于 3 个字符的词无法通过三元组匹配，
+改为对索引中的内容使用 `LIKE`。
+"""
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import DDL, event, text
+
+from MusicList import db
+from MusicList.model import Music
+
+FTS_TABLE = "music_fts"
+MIN_MATCH_LENGTH = 3  # `trigram` 分词可以匹配的最短的词
+
+# 建立索引所需的语句，`music_fts` 以 `music` 表作为外部内容表，本身不重复保存歌曲信息
+CREATE_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        music_name, artist,
+        content='music', content_rowid='index',
+        tokenize='trigram case_sensitive 0'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_fts_insert AFTER INSERT ON music BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, music_name, artist)
+        VALUES (new."index", new.music_name, new.artist);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_fts_delete AFTER DELETE ON music BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, music_name, artist)
+        VALUES ('delete', old."index", old.music_name, old.artist);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS music_fts_update
+    AFTER UPDATE OF music_name, artist ON music BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, music_name, artist)
+        VALUES ('delete', old."index", old.music_name, old.artist);
+        INSERT INTO {FTS_TABLE}(rowid, music_name, artist)
+        VALUES (new."index", new.music_name, new.artist);
+    END
+    """,
+]
+
+DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS music_fts_insert",
+    "DROP TRIGGER IF EXISTS music_fts_delete",
+    "DROP TRIGGER IF EXISTS music_fts_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# `db.create_all()` 和 `db.drop_all()` 时自动创建和删除索引
+for statement in CREATE_STATEMENTS:
+    event.listen(Music.__table__, "after_create", DDL(statement))
+for statement in DROP_STATEMENTS:
+    event.listen(Music.__table__, "before_drop", DDL(statement))
+
+
+def _rebuild():
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def ensure_schema():
+    """
+    为已有的数据库创建搜索索引和触发器。\n
+    旧版本的索引使用 `unicode61` 分词，此时删除并以 `trigram` 分词重新创建，然后重建索引的内容，返回 `True`；
+    其他情况下不重建索引的内容，返回 `False`。
+    """
+    sql = db.session.execute(
+        text("SELECT sql FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+    ).scalar()
+    outdated = sql is not None and "trigram" not in sql
+    if outdated:
+        db.session.execute(text(f"DROP TABLE {FTS_TABLE}"))
+    # 旧版本的更新触发器在修改歌曲的其他列时也会触发，需要重新创建
+    db.session.execute(text("DROP TRIGGER IF EXISTS music_fts_update"))
+    for statement in CREATE_STATEMENTS:
+        db.session.execute(text(statement))
+    db.session.commit()
+    if outdated:
+        _rebuild()
+    return outdated
+
+
+def rebuild_index():
+    """
+    创建（如果不存在）并重建搜索索引，用于已有的数据库。\n
+    返回索引中的歌曲数量。
+    """
+    if not ensure_schema():
+        _rebuild()
+    return db.session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+
+
+def _like(term):
+    """包含 `term` 的 `LIKE` 模式（使用 `\\` 转义）"""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def build_match_query(keyword):
+    """
+    将用户输入的关键词转换为搜索条件，返回 `(match, likes)`；关键词为空时返回 `None`。\n
+    多个词之间为“与”的关系。`match` 为 FTS5 查询语句，每个词作为短语匹配任意位置，没有足够长的词时为 `None`；
+    `likes` 为少于 `MIN_MATCH_LENGTH` 个字符的词的 `LIKE` 模式。
+    """
+    terms = keyword.split() if keyword else []
+    if not terms:
+        return None
+    long_terms = [term for term in terms if len(term) >= MIN_MATCH_LENGTH]
+    match = " ".join('"{}"'.format(term.replace('"', '""')) for term in long_terms) or None
+    likes = [_like(term) for term in terms if len(term) < MIN_MATCH_LENGTH]
+    return match, likes
+
+
+def search_music(keyword, page=1, per_page=30):
+    """
+    搜索歌曲名和艺术家，返回按照相关度排序的分页结果（`Pagination`）。\n
+    歌曲名的权重是艺术家的两倍。
+    """
+    page = max(page, 1)
+    query = build_match_query(keyword)
+    if query is None:
+        return Pagination(None, page, per_page, 0, [])
+    match, likes = query
+    conditions = []
+    params = {}
+    if match is not None:
+        conditions.append(f"{FTS_TABLE} MATCH :match")
+        params["match"] = match
+    for i, pattern in enumerate(likes):
+        conditions.append(
+            f"({FTS_TABLE}.music_name LIKE :like{i} ESCAPE '\\' "
+            f"OR {FTS_TABLE}.artist LIKE :like{i} ESCAPE '\\')"
+        )
+        params[f"like{i}"] = pattern
+    where = " AND ".join(conditions)
+    # 只有 `LIKE` 条件时没有相关度，最近添加的歌曲在前
+    order = f"bm25({FTS_TABLE}, 2.0, 1.0)" if match is not None else f"{FTS_TABLE}.rowid DESC"
+    total = db.session.execute(
+        text(f"SELECT count(*) FROM {FTS_TABLE} WHERE {where}"), params
+    ).scalar()
+    statement = text(
+        f"""
+        SELECT music.* FROM {FTS_TABLE}
+        JOIN music ON music."index" = {FTS_TABLE}.rowid
+        WHERE {where}
+        ORDER BY {order}
+        LIMIT :limit OFFSET :offset
+        """
+    )
+    params.update(limit=per_page, offset=(page - 1) * per_page)
+    items = Music.query.from_statement(statement).params(**params).all()
+    return Pagination(None, page, per_page, total, items)
@@ -0,0 +1,263 @@
+"""
+慢查询日志。\n
+`db` 的引擎上执行时间超过 `SLOW_QUERY_THRESHOLD` 秒的 SQL 语句会被记录下来，包括：
+语句、脱敏后的参数、发起查询的页面和 `EXPLAIN QUERY PLAN` 的结果。\n
+执行查询的线程只把语句和参数放入队列；后台线程每隔 `SLOW_QUERY_FLUSH_INTERVAL` 秒在另一个连接上
+获取查询计划，把记录加入内存中最近的 `SLOW_QUERY_LOG_SIZE` 条记录，并写入 `SLOW_QUERY_LOG_DIR`
+（默认为实例目录下的 `slow_queries`）下以进程号命名的文件，进程退出时写入剩余的记录。
+`flask slow-queries` 汇总所有进程的记录。
+"""
+
+import atexit
+
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from MusicList import app, db
+
+app.config.setdefault("SLOW_QUERY_THRESHOLD", 0.05)
+app.config.setdefault("SLOW_QUERY_LOG_SIZE", 200)
+app.config.setdefault("SLOW_QUERY_LOG_DIR", os.path.join(app.instance_path, "slow_queries"))
+app.config.setdefault("SLOW_QUERY_FLUSH_INTERVAL", 1.0)
+
+
+def redact(value):
+    """
+    脱敏参数：保留数字、日期和 `NULL`，字符串和二进制只保留类型和长度。
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return f"<str:{len(value)}>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<bytes:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    return [redact(value) for value in parameters or ()]
+
+
+class SlowQueryLog:
+    """
+    保存最近的慢查询的环形缓冲区（线程安全）。
+    """
+
+    def __init__(self, size):
+        self.recorded = 0
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def resize(self, size):
+        with self._lock:
+            if self._entries.maxlen != size:
+                self._entries = deque(self._entries, maxlen=size)
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"recorded": self.recorded, "buffered": len(self._entries)}
+
+
+slow_log = SlowQueryLog(app.config["SLOW_QUERY_LOG_SIZE"])
+
+
+def _log_path(pid=None):
+    return os.path.join(app.config["SLOW_QUERY_LOG_DIR"], f"{pid or os.getpid()}.json")
+
+
+def _save(entries):
+    """将本进程的记录写入文件（先写临时文件再替换，读取时不会读到一半的内容）"""
+    path = _log_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f"{path}.tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+    os.replace(temp, path)
+
+
+def _explain(connection, statement, parameters):
+    """获取语句的查询计划"""
+    if not statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+        return []
+    explain = connection.cursor()
+    try:
+        rows = explain.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+        return [row[-1] for row in rows]
+    except Exception as error:  # 查询计划只用于诊断，获取失败时不影响其他记录
+        return [f"无法获取查询计划：{error}"]
+    finally:
+        explain.close()
+
+
+class SlowQueryWriter:
+    """
+    在后台线程中处理慢查询：获取查询计划、加入 `slow_log` 并写入文件。
+
+    原始参数只在获取查询计划之前保存在队列中，不会写入文件。
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, entry, statement, parameters):
+        self._queue.put((entry, statement, parameters))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="slow-query-writer", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config["SLOW_QUERY_FLUSH_INTERVAL"])
+            try:
+                self.flush()
+            except Exception as error:  # 后台线程不能因为一次失败而退出
+                app.logger.warning("无法处理慢查询日志：%s", error)
+
+    def flush(self):
+        """处理队列中的所有记录"""
+        with self._lock:
+            pending = []
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not pending:
+                return
+            slow_log.resize(app.config["SLOW_QUERY_LOG_SIZE"])
+            raw = db.engine.raw_connection()
+            try:
+                for entry, statement, parameters in pending:
+                    entry["plan"] = _explain(raw.connection, statement, parameters)
+                    slow_log.add(entry)
+            finally:
+                raw.close()
+            try:
+                _save(slow_log.entries())
+            except OSError as error:
+                app.logger.warning("无法保存慢查询日志：%s", error)
+
+
+writer = SlowQueryWriter()
+atexit.register(writer.flush)
+
+
+def _route():
+    if has_request_context():
+        return f"{request.method} {request.endpoint or request.path}"
+    return None
+
+
+def install(engine):
+    """
+    在引擎上注册慢查询记录。
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slowlog_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["slowlog_start"].pop()
+        threshold = app.config["SLOW_QUERY_THRESHOLD"]
+        if threshold is None or seconds < threshold:
+            return
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        entry = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "seconds": seconds,
+            "statement": statement,
+            "parameters": redact_parameters(parameters),
+            "executemany": executemany,
+            "route": _route(),
+        }
+        writer.submit(entry, statement, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def discard_query(context):
+        starts = context.connection.info.get("slowlog_start") if context.connection else None
+        if starts:
+            starts.pop()
+
+
+db.engine_hooks.append(install)
+
+
+def load_entries():
+    """
+    读取所有进程保存的记录，按时间排序。
+    """
+    entries = []
+    for path in glob.glob(os.path.join(app.config["SLOW_QUERY_LOG_DIR"], "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries.extend(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(entries, key=lambda entry: entry["time"])
+
+
+def clear_entries():
+    """
+    删除所有进程保存的记录，返回删除的文件数。
+    """
+    writer.flush()
+    slow_log.clear()
+    paths = glob.glob(os.path.join(app.config["SLOW_QUERY_LOG_DIR"], "*.json"))
+    for path in paths:
+        os.remove(path)
+    return len(paths)
+
+
+def summarize(entries):
+    """
+    按语句汇总记录，返回按总耗时降序排列的列表，每一项包括次数、总耗时、最长耗时、
+    来源页面和最近一次的查询计划。
+    """
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(
+            entry["statement"],
+            {"statement": entry["statement"], "count": 0, "total": 0.0, "max": 0.0, "routes": set()},
+        )
+        group["count"] += 1
+        group["total"] += entry["seconds"]
+        group["max"] = max(group["max"], entry["seconds"])
+        group["routes"].add(entry["route"] or "-")
+        group["plan"] = entry["plan"]
+        group["parameters"] = entry["parameters"]
+    return sorted(groups.values(), key=lambda group: group["total"], reverse=True)
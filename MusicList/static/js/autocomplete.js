@@ -0,0 +1,42 @@
+// 搜索框的自动补全。
+// 输入停顿后请求 `data-autocomplete-url`，在 `data-suggestions` 指定的列表中显示匹配的歌曲。
+document.querySelectorAll("[data-autocomplete-url]").forEach(function (input) {
+    var list = document.getElementById(input.dataset.suggestions);
+    var timer = null;
+    var latest = 0;
+
+    function render(items) {
+        list.innerHTML = "";
+        items.forEach(function (item) {
+            var li = document.createElement("li");
+            var link = document.createElement("a");
+            link.href = item.url;
+            link.textContent = item.music_name + " - " + item.artist;
+            li.appendChild(link);
+            list.appendChild(li);
+        });
+        list.hidden = items.length === 0;
+    }
+
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var query = input.value.trim();
+            var request = ++latest;
+            if (!query) {
+                render([]);
+                return;
+            }
+            var url = input.dataset.autocompleteUrl + "?q=" + encodeURIComponent(query);
+            fetch(url, { credentials: "same-origin" })
+                .then(function (response) {
+                    return response.ok ? response.json() : { items: [] };
+                })
+                .then(function (data) {
+                    if (request === latest) {
+                        render(data.items);
+                    }
+                });
+        }, 100);
+    });
+});
@@ -0,0 +1,46 @@
+// 拖动歌单中的歌曲调整顺序。
+// 放下后把被移动的记录和它前面（在页面开头时为后面）的记录发送到 `data-move-url`，失败时刷新页面。
+document.querySelectorAll(".sortable").forEach(function (list) {
+    var dragging = null;
+
+    list.addEventListener("dragstart", function (event) {
+        dragging = event.target.closest("li");
+        dragging.classList.add("dragging");
+        event.dataTransfer.effectAllowed = "move";
+    });
+
+    list.addEventListener("dragover", function (event) {
+        var target = event.target.closest("li");
+        if (!dragging || !target || target === dragging) {
+            return;
+        }
+        event.preventDefault();
+        var rect = target.getBoundingClientRect();
+        var below = event.clientY > rect.top + rect.height / 2;
+        list.insertBefore(dragging, below ? target.nextSibling : target);
+    });
+
+    list.addEventListener("dragend", function () {
+        var item = dragging;
+        dragging = null;
+        item.classList.remove("dragging");
+        var data = new FormData();
+        data.append("entry", item.dataset.entry);
+        var prev = item.previousElementSibling;
+        var next = item.nextElementSibling;
+        if (prev) {
+            data.append("after", prev.dataset.entry);
+        } else if (next) {
+            data.append("before", next.dataset.entry);
+        }
+        fetch(list.dataset.moveUrl, { method: "POST", body: data, credentials: "same-origin" })
+            .then(function (response) {
+                if (!response.ok) {
+                    window.location.reload();
+                }
+            })
+            .catch(function () {
+                window.location.reload();
+            });
+    });
+});
@@ -0,0 +1,136 @@
+"""
+热门帖子。\n
+帖子的热度是每次互动的权重随时间指数衰减后的和（半衰期为 `TRENDING_HALF_LIFE` 秒）：
+`sum(w * exp(-(now - t) / tau))`。由于所有帖子同时衰减，只比较大小时可以去掉共同的 `exp(-now / tau)`，
+因此 `MessageScore.score` 保存 `log(sum(w * exp(t / tau)))`：新的互动只需要在对数空间中累加一项，
+已有的分数不需要随时间更新，页面直接按 `score` 降序读取。\n
+点赞、取消点赞、评论和删除评论时调用 `record` 更新分数，撤销时使用原来的互动时间（`like_time`），
+减去的正好是当时增加的热度；`refresh` 定期删除热度已经衰减到可以忽略的帖子，
+`rebuild` 根据已有的评论和点赞重新计算所有分数。
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from MusicList import app, db
+from MusicList.database import logaddexp
+from MusicList.model import Comment, FavoriteMessage, Message, MessageScore
+
+app.config.setdefault("TRENDING_HALF_LIFE", 12 * 3600)
+
+LIKE_WEIGHT = 2.0
+COMMENT_WEIGHT = 1.0
+
+
+def _tau():
+    """衰减的时间常数（秒）"""
+    return app.config["TRENDING_HALF_LIFE"] / math.log(2)
+
+
+def log_weight(weight, when):
+    """`when` 时刻一次权重为 `weight` 的互动在对数空间中的值"""
+    return when.timestamp() / _tau() + math.log(weight)
+
+
+def ensure_schema():
+    """
+    为已有的数据库添加 `FavoriteMessage.time` 列和热度表。
+    """
+    columns = {c["name"] for c in inspect(db.engine).get_columns("favorite_message")}
+    if "time" not in columns:
+        db.session.execute(text("ALTER TABLE favorite_message ADD COLUMN time DATETIME"))
+        db.session.commit()
+    MessageScore.__table__.create(bind=db.engine, checkfirst=True)
+    for index in MessageScore.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+
+def like_time(message_index, user_index):
+    """
+    用户点赞帖子的时间，用于取消点赞时撤销热度。没有记录时间的旧点赞按照帖子的发送时间计算（与 `rebuild` 相同），
+    没有点赞时返回 `None`。
+    """
+    return (
+        db.session.query(func.coalesce(FavoriteMessage.time, Message.time))
+        .join(Message, Message.index == FavoriteMessage.message_id)
+        .filter(FavoriteMessage.message_id == message_index, FavoriteMessage.user_id == user_index)
+        .scalar()
+    )
+
+
+def record(message_index, weight, when=None):
+    """
+    记录一次互动（不提交事务）。`weight` 为负数时撤销一次互动，例如取消点赞或删除评论。\n
+    `when` 为互动发生的时间（默认为当前时间），撤销时应传入原来的时间，减去的正好是当时增加的热度；
+    帖子只剩下这一次互动时删除它的分数。
+    """
+    table = MessageScore.__table__
+    value = log_weight(abs(weight), when or datetime.now())
+    if weight > 0:
+        statement = sqlite_insert(table).values(message_id=message_index, score=value)
+        statement = statement.on_conflict_do_update(
+            index_elements=["message_id"],
+            set_={"score": func.logaddexp(table.c.score, statement.excluded.score)},
+        )
+        db.session.execute(statement)
+        return
+    db.session.execute(
+        table.update()
+        .where(table.c.message_id == message_index)
+        .values(score=func.logsubexp(table.c.score, value))
+    )
+    db.session.execute(
+        table.delete().where(table.c.message_id == message_index, table.c.score.is_(None))
+    )
+
+
+def refresh(min_score=0.01, now=None):
+    """
+    删除当前热度低于 `min_score` 的帖子，返回删除的数量。
+    """
+    now = now or datetime.now()
+    table = MessageScore.__table__
+    threshold = now.timestamp() / _tau() + math.log(min_score)
+    count = db.session.execute(
+        table.delete().where((table.c.score < threshold) | table.c.score.is_(None))
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def rebuild(days=30, now=None):
+    """
+    根据最近 `days` 天的评论和点赞重新计算所有帖子的热度，返回有热度的帖子数。\n
+    没有记录时间的旧点赞按照帖子的发送时间计算。
+    """
+    now = now or datetime.now()
+    since = now - timedelta(days=days)
+    ensure_schema()
+    scores = {}
+    comments = db.session.query(Comment.parent_massage, Comment.time).filter(
+        Comment.time >= since
+    )
+    liked = func.coalesce(FavoriteMessage.time, Message.time)
+    likes = (
+        db.session.query(FavoriteMessage.message_id, liked)
+        .join(Message, Message.index == FavoriteMessage.message_id)
+        .filter(liked >= since)
+    )
+    for query, weight in ((comments, COMMENT_WEIGHT), (likes, LIKE_WEIGHT)):
+        for message_index, when in query.yield_per(10000):
+            if message_index is None or when is None:
+                continue
+            scores[message_index] = logaddexp(
+                scores.get(message_index), log_weight(weight, when)
+            )
+    db.session.execute(MessageScore.__table__.delete())
+    if scores:
+        db.session.execute(
+            MessageScore.__table__.insert(),
+            [dict(message_id=i, score=score) for i, score in scores.items()],
+        )
+    db.session.commit()
+    return len(scores)
@@ -0,0 +1,40 @@
+"""
+测试夹具。\n
+导入应用之前把 `DATABASE_URL` 指向临时目录中的数据库文件，不会修改本地的 `data.db`；
+每个测试使用重新创建的空数据库。
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+DIRECTORY = tempfile.mkdtemp(prefix="musiclist-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(DIRECTORY, "test.db")
+
+from MusicList import app as flask_app, db  # noqa: E402
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DIRECTORY, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(
+        TESTING=True,
+        PASSWORD_HASH_WORKERS=0,
+        FAVORITE_WRITE_BEHIND=False,
+        SLOW_QUERY_LOG_DIR=os.path.join(DIRECTORY, "slow_queries"),
+    )
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,21 @@
+"""并发压力测试：所有引擎配置使用相同的重试策略。"""
+
+import pytest
+
+from MusicList import database
+
+
+@pytest.mark.parametrize("profile", sorted(database.PROFILES))
+def test_stress_test_uses_the_same_retry_policy(app, monkeypatch, profile):
+    policies = set()
+    original = database.backoff_delays
+
+    def record(retries, base):
+        policies.add((retries, base))
+        return original(retries, base)
+
+    monkeypatch.setattr(database, "backoff_delays", record)
+    stats = database.stress_test(profile, threads=2, operations=20, retries=3)
+    assert policies == {(3, 0.01)}
+    assert stats["reads"] + stats["writes"] + stats["errors"] == 40
+    assert stats["errors"] == 0
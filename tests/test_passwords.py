@@ -0,0 +1,60 @@
+"""登录时使用新的哈希参数重新计算过时的密码哈希。"""
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from MusicList import db
+from MusicList.model import User
+
+OLD_METHOD = "pbkdf2:sha256:1000"
+NEW_METHOD = "pbkdf2:sha256:2000"
+
+
+def make_user(app, monkeypatch, password="secret"):
+    monkeypatch.setitem(app.config, "PASSWORD_HASH_METHOD", NEW_METHOD)
+    user = User(username="alice", level=0, password=generate_password_hash(password, OLD_METHOD))
+    db.session.add(user)
+    db.session.commit()
+    return user.index
+
+
+def stored_hash(user_index):
+    db.session.expire_all()
+    return User.query.filter(User.index == user_index).first().password
+
+
+def login(client, password):
+    return client.post("/login", data=dict(username="alice", password=password))
+
+
+def test_login_rehashes_outdated_password(app, client, monkeypatch):
+    user_index = make_user(app, monkeypatch)
+    response = login(client, "secret")
+    assert response.status_code == 302
+    assert "/login" not in response.headers["Location"]
+    pwhash = stored_hash(user_index)
+    assert pwhash.startswith(NEW_METHOD + "$")
+    assert check_password_hash(pwhash, "secret")
+
+
+def test_failed_login_keeps_the_old_hash(app, client, monkeypatch):
+    user_index = make_user(app, monkeypatch)
+    old = stored_hash(user_index)
+    response = login(client, "wrong")
+    assert "/login" in response.headers["Location"]
+    assert stored_hash(user_index) == old
+
+
+def test_current_hash_is_not_rewritten(app, client, monkeypatch):
+    user_index = make_user(app, monkeypatch)
+    login(client, "secret")
+    upgraded = stored_hash(user_index)
+    client.get("/logout")
+    login(client, "secret")
+    assert stored_hash(user_index) == upgraded
+
+
+def test_rehash_runs_on_the_hash_pool(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "PASSWORD_HASH_WORKERS", 2)
+    user_index = make_user(app, monkeypatch)
+    assert login(client, "secret").status_code == 302
+    assert stored_hash(user_index).startswith(NEW_METHOD + "$")
@@ -0,0 +1,130 @@
+"""歌单中歌曲的顺序：添加、移动、重新编号和分页的序号。"""
+
+import pytest
+from sqlalchemy import text
+
+from MusicList import db, playlists
+from MusicList.model import List, Music, MusicList, User
+from MusicList.pagination import encode_cursor
+
+
+def make_list(count):
+    """创建一个包含 `count` 首歌曲的歌单，返回 `(歌单的 index, 按添加顺序排列的 MusicList.index)`"""
+    user = User(username="owner", level=0)
+    db.session.add(user)
+    db.session.flush()
+    playlist = List(list_name="歌单", owner=user.index, share=1)
+    musics = [
+        Music(music_name=f"歌曲 {i}", artist="艺术家", link="", content_key=f"key-{i}")
+        for i in range(count)
+    ]
+    db.session.add_all([playlist, *musics])
+    db.session.flush()
+    entries = []
+    for music in musics:
+        record = MusicList(list_id=playlist.index, music_id=music.index)
+        db.session.add(record)
+        db.session.flush()  # 每条记录由触发器排在末尾
+        entries.append(record.index)
+    db.session.commit()
+    return playlist.index, entries
+
+
+def order(list_index):
+    return [row.entry for row in playlists.entries(list_index).order_by(*playlists.ORDER)]
+
+
+def positions(list_index):
+    return [row.position for row in playlists.entries(list_index).order_by(*playlists.ORDER)]
+
+
+def test_new_songs_are_appended_with_gaps(app):
+    list_index, entries = make_list(5)
+    assert order(list_index) == entries
+    assert positions(list_index) == [playlists.GAP * (i + 1) for i in range(5)]
+
+
+def test_move_updates_only_the_moved_song(app):
+    list_index, e = make_list(6)
+    updated, gap = playlists.move(list_index, e[4], after=e[0])
+    db.session.commit()
+    assert updated == 1
+    assert gap >= playlists.REBALANCE_GAP
+    assert order(list_index) == [e[0], e[4], e[1], e[2], e[3], e[5]]
+
+    playlists.move(list_index, e[5])  # 移动到开头
+    playlists.move(list_index, e[1], before=e[0])
+    db.session.commit()
+    assert order(list_index) == [e[5], e[1], e[0], e[4], e[2], e[3]]
+
+
+def test_move_range_keeps_the_block_together(app):
+    list_index, e = make_list(6)
+    playlists.move_range(list_index, e[1], e[3], after=e[5])
+    db.session.commit()
+    assert order(list_index) == [e[0], e[4], e[5], e[1], e[2], e[3]]
+    with pytest.raises(ValueError):
+        playlists.move_range(list_index, e[1], e[3], after=e[2])
+
+
+def test_move_without_gap_rebalances_first(app):
+    list_index, e = make_list(5)
+    # 没有间隔的歌单（如反复插入到同一处之后）
+    db.session.execute(
+        text('UPDATE music_list SET position = "index" WHERE list_id = :list'), {"list": list_index}
+    )
+    db.session.commit()
+    assert playlists.crowded_lists() == [list_index]
+    updated, gap = playlists.move(list_index, e[3], after=e[0])
+    db.session.commit()
+    assert updated > 1
+    assert gap >= playlists.REBALANCE_GAP
+    assert order(list_index) == [e[0], e[3], e[1], e[2], e[4]]
+
+
+def test_repeated_inserts_shrink_the_gap_until_rebalanced(app):
+    list_index, e = make_list(3)
+    gap = None
+    moved = 0
+    while gap is None or gap >= playlists.REBALANCE_GAP:
+        # 交替把最后两首歌曲移到第一首之后，间隔每次减半
+        _, gap = playlists.move(list_index, e[1 + moved % 2], after=e[0])
+        moved += 1
+    db.session.commit()
+    before = order(list_index)
+    assert playlists.crowded_lists() == [list_index]
+    assert playlists.rebalance(list_index) == 3
+    db.session.commit()
+    assert order(list_index) == before
+    assert positions(list_index) == [playlists.GAP * (i + 1) for i in range(3)]
+    assert playlists.crowded_lists() == []
+
+
+def test_keyset_pages_number_songs_without_counting(app, monkeypatch):
+    list_index, entries = make_list(7)
+    monkeypatch.setitem(app.config, "PAGINATION_MODE", "keyset")
+    monkeypatch.setattr(playlists, "ordinal", lambda *args, **kwargs: pytest.fail("不应统计序号"))
+    starts = []
+    cursor = None
+    while True:
+        query = {"cursor": cursor} if cursor else {}
+        with app.test_request_context(query_string=query):
+            page = playlists.page(list_index, per_page=3)
+        starts.append((page.start, [row.entry for row in page.items]))
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert starts == [(1, entries[0:3]), (4, entries[3:6]), (7, entries[6:7])]
+    with app.test_request_context(query_string={"cursor": page.prev_cursor}):
+        assert playlists.page(list_index, per_page=3).start == 4
+
+
+def test_cursor_without_number_falls_back_to_counting(app, monkeypatch):
+    list_index, entries = make_list(5)
+    monkeypatch.setitem(app.config, "PAGINATION_MODE", "keyset")
+    row = playlists.entries(list_index).filter(MusicList.index == entries[1]).one()
+    cursor = encode_cursor([row.position, row.entry], "next")
+    with app.test_request_context(query_string={"cursor": cursor}):
+        page = playlists.page(list_index, per_page=2)
+    assert page.start == 3
+    assert [row.entry for row in page.items] == entries[2:4]